@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import datetime as dt
+from django.db import models
+from django.db.models import F
+
+
+class DownloadJob(models.Model):
+    """
+    Abstract ledger entry for one requested download window.
+    Apps subclass this adding the fields which identify a window, so
+    interrupted backfills can skip windows which are already done.
+    """
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    start_dt = models.DateTimeField()
+    end_dt = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    row_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def mark_done(cls, pk, row_count):
+        cls.objects.filter(pk=pk).update(
+            status=cls.DONE,
+            attempts=F('attempts') + 1,
+            row_count=row_count,
+            error='',
+            updated_at=dt.datetime.utcnow()
+        )
+
+    @classmethod
+    def mark_failed(cls, pk, error):
+        cls.objects.filter(pk=pk).update(
+            status=cls.FAILED,
+            attempts=F('attempts') + 1,
+            error=str(error),
+            updated_at=dt.datetime.utcnow()
+        )
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import datetime as dt
+import random
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+from requests import Response
+from requests.exceptions import ConnectionError, HTTPError
+from bin import throttle, utils
+from bin.throttle import RetryError, RetryPolicy, TokenBucket
+
+
+class PgPoolTestCase(TransactionTestCase):
+    """
+    Points the bin.utils connection pool at the test database. Rows
+    are committed, so the pool's own connections can read them.
+    """
+
+    def setUp(self):
+        super(PgPoolTestCase, self).setUp()
+        utils.close_pg_pools()
+        self.pg_config = utils.get_pg_config()
+        utils._PG_CONFIG['local'] = dict(
+            self.pg_config,
+            dbname=connection.settings_dict['NAME']
+        )
+
+    def tearDown(self):
+        utils.close_pg_pools()
+        utils._PG_CONFIG['local'] = self.pg_config
+        super(PgPoolTestCase, self).tearDown()
+
+
+class PgPoolTest(PgPoolTestCase):
+
+    def test_iter_pg_chunks(self):
+        chunks = list(utils.iter_pg(
+            "select x, x * 2 from generate_series(1, %(n)s) x",
+            params={"n": 25},
+            chunk_size=10
+        ))
+        self.assertEqual([len(rows) for rows in chunks], [10, 10, 5])
+        self.assertEqual(
+            [row for rows in chunks for row in rows],
+            [(x, 2 * x) for x in range(1, 26)]
+        )
+        self.assertEqual(list(utils.iter_pg("select 1 where false")), [])
+
+    def test_connections_return_to_the_pool(self):
+        # more failures than the pool has connections
+        for _ in range(utils.PG_POOL_SIZE + 1):
+            with self.assertRaises(ZeroDivisionError):
+                with utils.pg_connection() as con:
+                    con.cursor().execute("create table pool_test (x int)")
+                    1 / 0
+            # the block was rolled back
+            self.assertTrue(
+                utils.query_pg("select to_regclass('pool_test') is null as gone")['gone'][0]
+            )
+        # and so did streams closed part way through
+        for _ in range(utils.PG_POOL_SIZE + 1):
+            stream = utils.iter_pg("select generate_series(1, 100)", chunk_size=10)
+            self.assertEqual(len(next(stream)), 10)
+            stream.close()
+        pool = utils.get_pg_pool()
+        self.assertEqual(pool._used, {})
+        # every connection can still be borrowed at once
+        cons = [pool.getconn() for _ in range(utils.PG_POOL_SIZE)]
+        for con in cons:
+            pool.putconn(con)
+
+
+class FakeClock(object):
+    """
+    Stands in for throttle's timer and sleep, so tests never wait.
+    Like a real sleep, each one takes at least a microsecond.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def timer(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += max(seconds, 1e-6)
+
+
+class ClockTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.patched = throttle.default_timer, throttle.sleep
+        throttle.default_timer, throttle.sleep = self.clock.timer, self.clock.sleep
+
+    def tearDown(self):
+        throttle.default_timer, throttle.sleep = self.patched
+
+
+class TokenBucketTest(ClockTestCase):
+
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+        bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 0.5)
+
+    def test_steady_rate(self):
+        bucket = TokenBucket(rate=4)
+        for _ in range(9):
+            bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 2.0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        bucket.acquire(2)
+        self.clock.now += 100
+        bucket.acquire(2)
+        self.assertAlmostEqual(self.clock.now, 100)
+        bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 101)
+
+    def test_pause_holds_back_callers(self):
+        bucket = TokenBucket(rate=5, capacity=5)
+        bucket.pause(2)
+        bucket.acquire()
+        # 2s of debt, then one token at 5 per second
+        self.assertAlmostEqual(self.clock.now, 2.2)
+
+
+def http_error(status, headers=None):
+    response = Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return HTTPError(response=response)
+
+
+class Flaky(object):
+    """ Raises the given errors in turn, then returns 'ok' """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class RetryPolicyTest(ClockTestCase):
+
+    def test_retries_until_success(self):
+        func = Flaky(ConnectionError(), http_error(503))
+        self.assertEqual(RetryPolicy(base_delay=1.0).call(func), 'ok')
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(len(self.clock.sleeps), 2)
+
+    def test_other_errors_are_raised(self):
+        for error in (ValueError(), http_error(404)):
+            func = Flaky(error)
+            with self.assertRaises(type(error)):
+                RetryPolicy().call(func)
+            self.assertEqual(func.calls, 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_gives_up_after_max_attempts(self):
+        last = http_error(502)
+        func = Flaky(ConnectionError(), ConnectionError(), last, ConnectionError())
+        with self.assertRaises(RetryError) as context:
+            RetryPolicy(max_attempts=3).call(func)
+        self.assertEqual(context.exception.attempts, 3)
+        self.assertIs(context.exception.error, last)
+        self.assertEqual(func.calls, 3)
+
+    def test_delay_is_jittered_exponential_backoff(self):
+        random.seed(0)
+        policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+        for attempt, backoff in ((1, 1.0), (2, 2.0), (4, 8.0), (6, 10.0)):
+            delays = [policy.delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= d <= backoff for d in delays))
+            self.assertGreater(max(delays), backoff / 2)
+
+    def test_retry_after_sets_minimum_delay_and_pauses(self):
+        bucket = TokenBucket(rate=10)
+        func = Flaky(http_error(429, {'Retry-After': '7'}))
+        policy = RetryPolicy(base_delay=0.001, rate_limiter=bucket)
+        self.assertEqual(policy.call(func), 'ok')
+        self.assertGreaterEqual(self.clock.sleeps[0], 7)
+        # the bucket was paused for the same 7s, so nothing else got through meanwhile
+        self.assertLessEqual(bucket.tokens, 0)
+        self.assertIsNone(policy.retry_after(http_error(503, {'Retry-After': '7'})))
+        self.assertIsNone(policy.retry_after(http_error(429, {'Retry-After': 'soon'})))
+
+
+class FillDtGapsTest(SimpleTestCase):
+
+    start_dt = dt.datetime(2017, 1, 1)
+
+    def frame(self, minutes, values):
+        index = [self.start_dt + dt.timedelta(minutes=m) for m in minutes]
+        return pd.DataFrame({'x': values}, index=index)
+
+    def test_grid(self):
+        # off the grid, duplicated and out of range rows are all dropped
+        frame = self.frame([-1, 0, 0, 1.5, 2, 4, 9], [0.0, 1.0, 9.0, 5.0, 2.0, 4.0, 9.0])
+        filled = utils.fill_dt_gaps(
+            frame,
+            self.start_dt,
+            self.start_dt + dt.timedelta(minutes=3, seconds=30),
+            window_seconds=60
+        )
+        # up to the first step at or after end_dt
+        self.assertTrue(filled.index.equals(pd.date_range(
+            self.start_dt, periods=5, freq='min', tz='UTC'
+        )))
+        np.testing.assert_array_equal(filled['x'].values, [1.0, np.nan, 2.0, np.nan, 4.0])
+
+    def test_ffill_limit(self):
+        frame = self.frame([0, 5], [1.0, 2.0])
+        end_dt = self.start_dt + dt.timedelta(minutes=5)
+        filled = utils.fill_dt_gaps(frame, self.start_dt, end_dt, 60, fill='ffill')
+        np.testing.assert_array_equal(filled['x'].values, [1, 1, 1, 1, 1, 2])
+        # the input keeps its datetime index
+        self.assertEqual(frame.index[1], end_dt)
+        filled = utils.fill_dt_gaps(frame, self.start_dt, end_dt, 60, fill='ffill', limit=2)
+        np.testing.assert_array_equal(filled['x'].values, [1, 1, 1, np.nan, np.nan, 2])
+
+    def test_interpolate_inside_only(self):
+        frame = self.frame([1, 5], [1.0, 5.0])
+        end_dt = self.start_dt + dt.timedelta(minutes=6)
+        filled = utils.fill_dt_gaps(frame, self.start_dt, end_dt, 60, fill='interpolate')
+        np.testing.assert_array_equal(filled['x'].values, [np.nan, 1, 2, 3, 4, 5, np.nan])
+        filled = utils.fill_dt_gaps(
+            frame, self.start_dt, end_dt, 60, fill='interpolate', limit=1
+        )
+        np.testing.assert_array_equal(filled['x'].values, [np.nan, 1, 2, np.nan, np.nan, 5, np.nan])
+        with self.assertRaises(ValueError):
+            utils.fill_dt_gaps(frame, self.start_dt, end_dt, 60, fill='bfill')
+
+    def test_ts_round_trip(self):
+        ts = np.array([0.0, 1483228800.0, 1483228800.25, 1500000000.5])
+        dts = utils.ts_to_dts(ts)
+        self.assertEqual(str(dts.tz), 'UTC')
+        self.assertEqual(dts[1], pd.Timestamp('2017-01-01', tz='UTC'))
+        np.testing.assert_allclose(utils.dts_to_ts(dts), ts, rtol=0, atol=1e-6)
+        # naive datetimes are taken to be UTC, and other zones are converted
+        np.testing.assert_allclose(utils.dts_to_ts(dts.tz_localize(None)), ts, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(
+            utils.dts_to_ts(dts.tz_convert('US/Eastern')), ts, rtol=0, atol=1e-6
+        )
+        self.assertEqual(
+            list(utils.dts_to_ts([self.start_dt])),
+            [utils.dt_to_ts(self.start_dt)]
+        )
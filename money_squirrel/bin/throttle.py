@@ -0,0 +1,136 @@
+import random
+import threading
+from time import sleep
+from timeit import default_timer
+from requests.exceptions import ConnectionError, Timeout
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket rate limiter.
+    Tokens refill continuously at `rate` per second up to `capacity`,
+    and acquire() blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate, capacity=1):
+        assert rate > 0
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = default_timer()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = default_timer()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            sleep(wait)
+
+    def pause(self, seconds):
+        """ Hold back every caller for `seconds`, eg. after an HTTP 429 """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RetryError(Exception):
+    """ Raised once a retryable call has failed max_attempts times """
+
+    def __init__(self, error, attempts):
+        super(RetryError, self).__init__(
+            "Gave up after {} attempts: {}".format(attempts, error)
+        )
+        self.error = error
+        self.attempts = attempts
+
+
+class RetryPolicy(object):
+    """
+    Retry a single unit of work with exponential backoff and full jitter.
+    Errors are retried if they are one of `retry_on`, or carry an HTTP
+    response with a retryable status. A Retry-After header sets the
+    minimum delay and also pauses the shared rate limiter, if given.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+            self,
+            max_attempts=5,
+            base_delay=1.0,
+            max_delay=60.0,
+            retry_on=(ConnectionError, Timeout),
+            rate_limiter=None,
+            logger=None
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.rate_limiter = rate_limiter
+        self.logger = logger
+
+    @staticmethod
+    def _status(error):
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None)
+
+    def retry_after(self, error):
+        """ Seconds requested by a Retry-After header, if any """
+        if self._status(error) != 429:
+            return None
+        try:
+            return float(error.response.headers['Retry-After'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def is_retryable(self, error):
+        return isinstance(error, self.retry_on) \
+            or self._status(error) in self.RETRY_STATUSES
+
+    def delay(self, attempt, error=None):
+        """ Seconds to wait after the `attempt`th failure """
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = random.uniform(0, backoff)
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    raise
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise RetryError(e, attempt)
+                retry_after = self.retry_after(e)
+                if retry_after is not None and self.rate_limiter is not None:
+                    self.rate_limiter.pause(retry_after)
+                delay = self.delay(attempt, e)
+                if self.logger is not None:
+                    self.logger.warn(
+                        "Attempt %s failed, retrying in %.1fs: %s",
+                        attempt,
+                        delay,
+                        e
+                    )
+                sleep(delay)
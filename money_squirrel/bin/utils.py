@@ -1,10 +1,16 @@
 import os
 import json
+import atexit
+import calendar
 import logging
+import threading
 import datetime as dt
+from contextlib import contextmanager
 from dateutil.parser import parse as dt_parse
 from pytz import timezone
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+import numpy as np
 import pandas as pd
 
 logging.basicConfig(format='%(asctime)s|%(name)s|%(levelname)s|%(message)s')
@@ -25,6 +31,11 @@ PRODUCT_LIST = (
     'ETH-BTC'
 )
 UTC = timezone('UTC')
+PG_POOL_SIZE = 8
+PG_CHUNK_SIZE = 10000
+_PG_CONFIG = dict()
+_PG_POOLS = dict()
+_PG_POOLS_LOCK = threading.Lock()
 
 
 def get_logger(name, level=None):
@@ -56,24 +67,95 @@ def load_config(name):
         return json.load(f)
 
 
-def get_pg_connection(env="local"):
+def get_pg_config(env="local"):
+    """ Postgres config for env, read from disk only once """
+    if env not in _PG_CONFIG:
+        _PG_CONFIG[env] = load_config("postgres")[env]
+    return _PG_CONFIG[env]
+
+
+def get_pg_pool(env="local"):
+    """ Shared thread safe connection pool, created on first use """
+    with _PG_POOLS_LOCK:
+        if env not in _PG_POOLS:
+            config = get_pg_config(env)
+            con_str = "host='{host}' dbname='{dbname}' user='{user}'"
+            con_str = con_str.format(**config)
+            LOGGER.info("Creating postgres connection pool @ %s", config['host'])
+            _PG_POOLS[env] = ThreadedConnectionPool(1, PG_POOL_SIZE, con_str)
+        return _PG_POOLS[env]
+
+
+def close_pg_pools():
+    """ Close every pooled connection, eg. before exiting a script """
+    with _PG_POOLS_LOCK:
+        for pool in _PG_POOLS.values():
+            pool.closeall()
+        _PG_POOLS.clear()
+
 
-    config = load_config("postgres")[env]
+atexit.register(close_pg_pools)
+
+
+@contextmanager
+def pg_connection(env="local"):
+    """
+    Borrow a connection from the pool, returning it when done.
+    Commits on success and rolls back if the block raises.
+    """
+    pool = get_pg_pool(env)
+    con = pool.getconn()
+    try:
+        yield con
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        pool.putconn(con)
+
+
+def get_pg_connection(env="local"):
+    """ A dedicated (unpooled) connection, which the caller must close """
+    config = get_pg_config(env)
     con_str = "host='{host}' dbname='{dbname}' user='{user}'"
     con_str = con_str.format(**config)
     LOGGER.info("Connecting to postgres DB @ %s", config['host'])
     return psycopg2.connect(con_str)
 
 
-def query_pg(query, env="local"):
-
-    con = get_pg_connection(env)
-    LOGGER.info("Executing query:\n\n%s\n", query)
-    return pd.read_sql(query, con=con)
+def query_pg(query, params=None, env="local"):
+    """
+    Run a query on a pooled connection and return a DataFrame.
+    Pass values through params (psycopg2 %(name)s or %s placeholders)
+    rather than formatting them into the query.
+    """
+    with pg_connection(env) as con:
+        LOGGER.info("Executing query:\n\n%s\n", query)
+        return pd.read_sql(query, con=con, params=params)
+
+
+def iter_pg(query, params=None, env="local", chunk_size=PG_CHUNK_SIZE):
+    """
+    Stream query results through a server side (named) cursor,
+    yielding lists of up to chunk_size row tuples.
+    """
+    with pg_connection(env) as con:
+        LOGGER.info("Streaming query:\n\n%s\n", query)
+        with con.cursor(name="iter_pg") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
 
 
 def dt_to_ts(datetime):
-    return float(datetime.strftime('%s'))
+    """ Epoch seconds. Naive datetimes are taken to be UTC """
+    return calendar.timegm(datetime.utctimetuple()) \
+        + datetime.microsecond / 1e6
 
 
 def ts_to_dt(timestamp):
@@ -83,6 +165,23 @@ def ts_to_dt(timestamp):
     )
 
 
+def dts_to_ts(datetimes):
+    """ Vectorized dt_to_ts: array of float epoch seconds """
+    index = pd.DatetimeIndex(datetimes)
+    if index.tz is not None:
+        index = index.tz_convert(UTC).tz_localize(None)
+    return index.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+
+
+def ts_to_dts(timestamps):
+    """ Vectorized ts_to_dt: UTC DatetimeIndex """
+    return pd.to_datetime(
+        np.asarray(timestamps, dtype=np.float64),
+        unit='s',
+        utc=True
+    )
+
+
 def get_utc_dt(*args):
     return dt.datetime(*args, tzinfo=UTC)
 
@@ -91,23 +190,33 @@ def parse_dt_str(dt_str):
     return dt_parse(dt_str).replace(tzinfo=UTC)
 
 
+FILL_METHODS = (None, 'ffill', 'interpolate')
+
+
 def fill_dt_gaps(df, start_dt, end_dt,
                  window_seconds, input_dt=True,
-                 output_dt=True):
-
+                 output_dt=True, fill=None, limit=None):
+    """
+    Reindex df onto a regular grid of window_seconds from start_dt until
+    the first step at or after end_dt. Rows off the grid are dropped.
+    Gaps are left NaN, or filled with fill='ffill' or 'interpolate'
+    (linear in time), filling at most `limit` consecutive gaps.
+    """
+    if fill not in FILL_METHODS:
+        raise ValueError("fill must be one of {}".format(FILL_METHODS))
     start_ts = dt_to_ts(start_dt)
     end_ts = dt_to_ts(end_dt)
-    ts_range = [start_ts]
-    while ts_range[-1] < end_ts:
-        ts_range.append(ts_range[-1] + window_seconds)
+    steps = max(int(np.ceil((end_ts - start_ts) / float(window_seconds))), 0)
+    ts_range = start_ts + window_seconds * np.arange(steps + 1, dtype=np.float64)
     if input_dt:
-        df.index = [dt_to_ts(t) for t in df.index]
-    df = df.merge(
-        pd.DataFrame(index=ts_range),
-        left_index=True,
-        right_index=True,
-        how='right'
-    )
+        # a shallow copy, so the caller's frame keeps its index
+        df = df.copy(deep=False)
+        df.index = dts_to_ts(df.index)
+    df = df[~df.index.duplicated(keep='first')].reindex(ts_range)
+    if fill == 'ffill':
+        df = df.ffill(limit=limit)
+    elif fill == 'interpolate':
+        df = df.interpolate(method='index', limit=limit, limit_area='inside')
     if output_dt:
-        df.index = [ts_to_dt(t) for t in df.index]
+        df.index = ts_to_dts(df.index)
     return df
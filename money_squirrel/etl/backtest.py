@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from bin import utils
+from etl import gdax as gdax_etl
+
+RESULT_COLUMNS = ['returns', 'costs', 'turnover', 'equity', 'pnl', 'drawdown']
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+
+class FeeModel(object):
+    """
+    Trading costs as a fraction of traded notional: the exchange fee
+    plus slippage (half spread and impact) paid on every trade.
+    """
+
+    def __init__(self, fee=0.0025, slippage=0.0005):
+        self.fee = fee
+        self.slippage = slippage
+
+    @property
+    def rate(self):
+        return self.fee + self.slippage
+
+
+def load_prices(
+        start_dt,
+        end_dt,
+        granularity=20,
+        product_list=utils.PRODUCT_LIST
+):
+    """
+    Close prices indexed by dt with one column per product, forward
+    filled over bars without trades. NaN until a product's first trade.
+    """
+    closes = gdax_etl.get_price_features(
+        start_dt,
+        end_dt,
+        granularity,
+        product_list,
+        columns=('close',),
+        fill='ffill'
+    )
+    closes.columns = [column[:-len('_close')] for column in closes.columns]
+    return closes[[p for p in product_list if p in closes.columns]]
+
+
+def _as_arrays(prices, signals):
+    index = prices.index if isinstance(prices, pd.DataFrame) else None
+    prices = np.asarray(prices, dtype=np.float64)
+    signals = np.asarray(signals, dtype=np.float64)
+    assert prices.shape == signals.shape, "prices and signals must line up"
+    return index, prices, signals
+
+
+def _bar_returns(prices):
+    """ Simple returns into each bar, 0 for the first bar and missing prices """
+    returns = np.zeros_like(prices)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = prices[1:] / prices[:-1] - 1
+    returns[~np.isfinite(returns)] = 0.0
+    return returns
+
+
+def _result(index, returns, costs, turnover, capital):
+    equity = capital * np.cumprod((1 + returns) * (1 - costs))
+    drawdown = equity / np.maximum(np.maximum.accumulate(equity), capital) - 1
+    return pd.DataFrame(
+        {
+            'returns': returns,
+            'costs': costs,
+            'turnover': turnover,
+            'equity': equity,
+            'pnl': equity - capital,
+            'drawdown': drawdown,
+        },
+        index=index,
+        columns=RESULT_COLUMNS
+    )
+
+
+def backtest(prices, signals, fee_model=None, capital=1.0, delay=0):
+    """
+    Replay target portfolio weights against prices, without a per-bar
+    loop. prices and signals are aligned (bars x products) frames or
+    arrays; signals[t] are the weights wanted after trading at the close
+    of bar t, so they may only use data up to bar t. delay shifts them
+    later by that many bars. Weights drift with prices between bars and
+    every rebalance pays fee_model.rate on the traded fraction of equity.
+
+    Returns a frame indexed like prices of per bar portfolio returns
+    (before costs), costs and turnover as fractions of equity, and the
+    equity, pnl and drawdown series.
+    """
+    fee_model = fee_model or FeeModel()
+    index, prices, signals = _as_arrays(prices, signals)
+    if delay:
+        signals = np.vstack([np.zeros((delay, signals.shape[1])), signals[:-delay]])
+    # nothing can be held before a product has a price
+    weights = np.where(np.isnan(prices), 0.0, np.nan_to_num(signals))
+    asset_returns = _bar_returns(prices)
+
+    held = np.zeros_like(weights)
+    held[1:] = weights[:-1]
+    returns = (held * asset_returns).sum(axis=1)
+    # weights just before rebalancing, after drifting through the bar
+    drifted = held * (1 + asset_returns) / (1 + returns)[:, None]
+    turnover = np.abs(weights - drifted).sum(axis=1)
+    return _result(index, returns, fee_model.rate * turnover, turnover, capital)
+
+
+def backtest_events(prices, strategy, fee_model=None, capital=1.0):
+    """
+    Event driven fallback for path dependent strategies (stops, position
+    sizing on equity, ...). strategy(i, dt, prices, weights, equity) is
+    called at the close of every bar with that bar's prices, the current
+    (drifted) weights and equity, and returns new target weights or None
+    to hold. Same accounting as backtest(), so a strategy returning
+    fixed signals reproduces it.
+    """
+    fee_model = fee_model or FeeModel()
+    index = prices.index if isinstance(prices, pd.DataFrame) else None
+    prices = np.asarray(prices, dtype=np.float64)
+    asset_returns = _bar_returns(prices)
+    n, width = prices.shape
+    returns = np.zeros(n)
+    costs = np.zeros(n)
+    turnover = np.zeros(n)
+    weights = np.zeros(width)
+    equity = capital
+    for i in range(n):
+        returns[i] = (weights * asset_returns[i]).sum()
+        weights = weights * (1 + asset_returns[i]) / (1 + returns[i])
+        equity *= 1 + returns[i]
+        target = strategy(
+            i,
+            index[i] if index is not None else None,
+            prices[i],
+            weights,
+            equity
+        )
+        if target is not None:
+            target = np.where(np.isnan(prices[i]), 0.0, np.nan_to_num(target))
+            turnover[i] = np.abs(target - weights).sum()
+            costs[i] = fee_model.rate * turnover[i]
+            equity *= 1 - costs[i]
+            weights = target
+    return _result(index, returns, costs, turnover, capital)
+
+
+def summarize(result, granularity=20):
+    """ Headline statistics of a backtest result frame """
+    net = (1 + result['returns'].values) * (1 - result['costs'].values) - 1
+    capital = result['equity'].values[0] - result['pnl'].values[0]
+    bars_per_year = SECONDS_PER_YEAR / float(granularity)
+    std = net.std()
+    return pd.Series({
+        'total_return': result['pnl'].values[-1] / capital,
+        'max_drawdown': result['drawdown'].min(),
+        'sharpe': net.mean() / std * np.sqrt(bars_per_year) if std > 0 else np.nan,
+        'turnover': result['turnover'].sum(),
+        'costs': result['costs'].sum(),
+        'trades': int((result['turnover'] > 0).sum()),
+    })
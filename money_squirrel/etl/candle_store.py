@@ -0,0 +1,124 @@
+import os
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bin import utils
+
+DEFAULT_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'data',
+    'candles'
+)
+PRICE_COLUMNS = ['low', 'high', 'open', 'close', 'volume']
+
+
+class CandleStore(object):
+    """
+    Candles kept in parquet files outside of postgres, partitioned as
+    <root>/<product>/<granularity>/<YYYY-MM-DD>.parquet so reads of a
+    time range only open the days they need.
+    """
+
+    COLUMNS = ['dt'] + PRICE_COLUMNS
+
+    def __init__(self, root=DEFAULT_ROOT, log_level=None):
+        self.root = root
+        self.logger = utils.get_logger(__name__, log_level)
+
+    def _path(self, product, granularity, day):
+        return os.path.join(
+            self.root,
+            product,
+            str(granularity),
+            day.strftime(utils.ISO_DAILY) + '.parquet'
+        )
+
+    def _paths(self, product, granularity, start_dt, end_dt):
+        """ Existing day partitions overlapping [start_dt, end_dt] """
+        day = dt.datetime(start_dt.year, start_dt.month, start_dt.day)
+        while day <= end_dt:
+            path = self._path(product, granularity, day)
+            if os.path.exists(path):
+                yield path
+            day += dt.timedelta(days=1)
+
+    def write(self, frame):
+        """
+        Merge a frame with product, granularity, dt and price columns into
+        the store, skipping candles already present.
+        Returns a tuple of (inserted, skipped) counts.
+        """
+        if not len(frame):
+            return 0, 0
+        inserted = 0
+        days = frame['dt'].values.astype('datetime64[D]')
+        for (product, granularity, day), part in frame.groupby(
+                [frame['product'], frame['granularity'], days]
+        ):
+            path = self._path(product, granularity, pd.Timestamp(day))
+            part = part[self.COLUMNS]
+            if os.path.exists(path):
+                existing = pq.read_table(path).to_pandas()
+                merged = pd.concat([existing, part], ignore_index=True)
+                merged = merged.drop_duplicates('dt', keep='first')
+                inserted += len(merged) - len(existing)
+            else:
+                directory = os.path.dirname(path)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                merged = part.drop_duplicates('dt')
+                inserted += len(merged)
+            # write then rename so readers never see a partial file
+            tmp_path = path + '.tmp'
+            pq.write_table(
+                pa.Table.from_pandas(
+                    merged.sort_values('dt'),
+                    preserve_index=False
+                ),
+                tmp_path
+            )
+            os.rename(tmp_path, path)
+        skipped = len(frame) - inserted
+        self.logger.info(
+            "Stored %s candles to parquet, skipped %s existing",
+            inserted,
+            skipped
+        )
+        return inserted, skipped
+
+    def read(
+            self,
+            start_dt,
+            end_dt,
+            granularity=60,
+            product_list=utils.PRODUCT_LIST,
+            memory_map=True
+    ):
+        """
+        Candles in [start_dt, end_dt], in the same layout as
+        etl.gdax.load_quotes: categorical product, dt, float32 prices.
+        Only the day files in range are opened (memory mapped). The dt
+        range is applied after reading, as older pyarrow only applies
+        read_table filters to partitioned datasets, not single files.
+        """
+        frames = []
+        for product in product_list:
+            for path in self._paths(product, granularity, start_dt, end_dt):
+                part = pq.read_table(path, memory_map=memory_map).to_pandas()
+                part = part[(part['dt'] >= start_dt) & (part['dt'] <= end_dt)]
+                part.insert(0, 'product', product)
+                frames.append(part)
+        if frames:
+            frame = pd.concat(frames, ignore_index=True)
+        else:
+            frame = pd.DataFrame(columns=['product'] + self.COLUMNS)
+            frame['dt'] = frame['dt'].astype('datetime64[ns]')
+        frame['product'] = pd.Categorical(
+            frame['product'],
+            categories=list(product_list)
+        )
+        for column in PRICE_COLUMNS:
+            frame[column] = frame[column].astype(np.float32)
+        return frame.sort_values(['dt', 'product']).reset_index(drop=True)
@@ -0,0 +1,361 @@
+import os
+import datetime as dt
+import numpy as np
+import pandas as pd
+from bin import utils
+from etl import gdax as gdax_etl
+from etl import trends as trends_etl
+from etl.patterns import sliding_windows, znormalize
+
+DEFAULT_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'data',
+    'clusters'
+)
+BATCH_SIZE = 1024  # windows per k-means step
+CHUNK_PERIODS = 24 * 7 * 8  # bars loaded from the database at a time
+DISTANCE_PART = '{:06d}_{}_{}.npz'  # sequence, first and last epoch second
+
+
+def window_batches(frame, length, batch_size=BATCH_SIZE, step=1, seed=None):
+    """
+    Yield shuffled float32 batches of z-normalized windows from every
+    column of frame, skipping windows with NaN. Windows are strided
+    views, so only one batch is ever copied.
+    """
+    values = np.asarray(frame, dtype=np.float64)
+    if len(values) < length:
+        return
+    random = np.random.RandomState(seed)
+    windows = [
+        sliding_windows(values[:, j], length)[::step]
+        for j in range(values.shape[1])
+    ]
+    block = max(1, batch_size // max(len(windows), 1))
+    for start in range(0, len(windows[0]) if windows else 0, block):
+        batch = np.vstack([w[start:start + block] for w in windows])
+        batch = batch[np.isfinite(batch).all(axis=1)]
+        if len(batch):
+            yield znormalize(random.permutation(batch)).astype(np.float32)
+
+
+class WindowClusters(object):
+    """
+    Online mini-batch k-means (Sculley 2010) over z-normalized windows
+    of `length` bars. Each centroid moves to the running mean of every
+    window ever assigned to it, so partial_fit() can keep learning from
+    new data without revisiting history.
+    """
+
+    def __init__(self, k=16, length=24, seed=None):
+        self.k = k
+        self.length = length
+        self.random = np.random.RandomState(seed)
+        self.centroids = None  # (k x length), set once k windows are seen
+        self.counts = np.zeros(k, dtype=np.int64)
+        self.pending = []  # windows held back until there are k to seed from
+
+    def _seed(self, windows):
+        """ k-means++ initial centroids """
+        centroids = [windows[self.random.randint(len(windows))]]
+        closest = ((windows - centroids[0]) ** 2).sum(axis=1)
+        for _ in range(1, self.k):
+            total = closest.sum()
+            i = self.random.choice(len(windows), p=closest / total) \
+                if total > 0 else self.random.randint(len(windows))
+            centroids.append(windows[i])
+            closest = np.minimum(closest, ((windows - windows[i]) ** 2).sum(axis=1))
+        self.centroids = np.array(centroids, dtype=np.float64)
+
+    def distances(self, windows):
+        """ (windows x k) float32 euclidean distances to the centroids """
+        windows = np.asarray(windows, dtype=np.float64)
+        squared = (windows ** 2).sum(axis=1)[:, None] \
+            - 2 * windows.dot(self.centroids.T) \
+            + (self.centroids ** 2).sum(axis=1)[None, :]
+        return np.sqrt(np.maximum(squared, 0.0)).astype(np.float32)
+
+    def partial_fit(self, windows):
+        windows = np.asarray(windows, dtype=np.float64)
+        if self.centroids is None:
+            self.pending.append(windows)
+            if sum(len(w) for w in self.pending) < self.k:
+                return self
+            windows = np.vstack(self.pending)
+            self.pending = []
+            self._seed(windows)
+        labels = self.distances(windows).argmin(axis=1)
+        assigned = np.bincount(labels, minlength=self.k)
+        sums = np.zeros_like(self.centroids)
+        np.add.at(sums, labels, windows)
+        self.counts += assigned
+        hit = assigned > 0
+        self.centroids[hit] += (
+            sums[hit] - assigned[hit, None] * self.centroids[hit]
+        ) / self.counts[hit, None]
+        return self
+
+    def fit(self, batches):
+        for windows in batches:
+            self.partial_fit(windows)
+        return self
+
+    @property
+    def fitted(self):
+        return self.centroids is not None
+
+    def columns(self, names):
+        return [
+            '{}_c{}'.format(name, i)
+            for name in names
+            for i in range(self.k)
+        ]
+
+    def transform(self, frame, batch_size=BATCH_SIZE):
+        """
+        float32 frame indexed like frame with k distances per column,
+        for the window ending at each row. NaN where the window is
+        incomplete or holds NaN.
+        """
+        values = np.asarray(frame, dtype=np.float64)
+        rows, width = values.shape
+        output = np.full((rows, width * self.k), np.nan, dtype=np.float32)
+        if rows >= self.length:
+            for j in range(width):
+                windows = sliding_windows(values[:, j], self.length)
+                for start in range(0, len(windows), batch_size):
+                    block = windows[start:start + batch_size]
+                    keep = np.flatnonzero(np.isfinite(block).all(axis=1))
+                    if len(keep):
+                        output[self.length - 1 + start + keep, j * self.k:(j + 1) * self.k] = \
+                            self.distances(znormalize(block[keep]))
+        return pd.DataFrame(
+            output,
+            index=frame.index,
+            columns=self.columns(frame.columns)
+        )
+
+    def save(self, path):
+        """ Persist centroids and counts to a .npz file """
+        np.savez(
+            path,
+            k=np.array([self.k]),
+            length=np.array([self.length]),
+            centroids=self.centroids if self.fitted else np.empty((0, self.length)),
+            counts=self.counts
+        )
+
+    @classmethod
+    def load(cls, path):
+        state = np.load(path)
+        clusters = cls(k=int(state['k'][0]), length=int(state['length'][0]))
+        if len(state['centroids']):
+            clusters.centroids = state['centroids'].copy()
+        clusters.counts = state['counts'].copy()
+        return clusters
+
+
+def load_window_inputs(
+        start_dt,
+        end_dt,
+        terms=(),
+        granularity=3600,
+        product_list=utils.PRODUCT_LIST,
+        geo=''
+):
+    """
+    Stitched Trends scores per term and closes per product on one dt
+    grid, indexed by naive UTC datetimes like the rest of the project.
+    """
+    frames = []
+    if terms:
+        frames.append(trends_etl.load_stitched_interest(
+            terms,
+            start_dt,
+            end_dt,
+            geo=geo,
+            granularity=granularity
+        ))
+    if product_list:
+        frames.append(gdax_etl.get_price_features(
+            start_dt,
+            end_dt,
+            granularity,
+            product_list,
+            columns=('close',),
+            fill='ffill'
+        ))
+    for frame in frames:
+        # price features come back on a tz-aware UTC grid
+        if frame.index.tz is not None:
+            frame.index = frame.index.tz_convert(utils.UTC).tz_localize(None)
+    return pd.concat(frames, axis=1)
+
+
+def _distance_parts(directory):
+    """ (sequence, first ts, last ts, path) of every part, in write order """
+    if not os.path.isdir(directory):
+        return []
+    parts = []
+    for name in os.listdir(directory):
+        if name.endswith('.npz'):
+            sequence, first_ts, last_ts = [int(x) for x in name[:-len('.npz')].split('_')]
+            parts.append((sequence, first_ts, last_ts, os.path.join(directory, name)))
+    return sorted(parts)
+
+
+def save_distances(distances, directory):
+    """
+    Append a distance frame to directory as a new .npz part, named by
+    sequence number and dt range. Stored parts are never read or
+    rewritten; where parts overlap, load_distances lets the newest win.
+    Written then renamed so readers never see a partial file.
+    """
+    if not len(distances):
+        return
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    parts = _distance_parts(directory)
+    sequence = parts[-1][0] + 1 if parts else 0
+    ts = distances.index.values.astype('datetime64[s]').astype(np.int64)
+    path = os.path.join(
+        directory,
+        DISTANCE_PART.format(sequence, ts.min(), ts.max())
+    )
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            dt=ts,
+            values=distances.values.astype(np.float32),
+            columns=np.array(distances.columns, dtype=str)
+        )
+    os.rename(tmp_path, path)
+
+
+def _load_part(path):
+    state = np.load(path)
+    return pd.DataFrame(
+        state['values'],
+        index=pd.Index(pd.to_datetime(state['dt'], unit='s'), name='dt'),
+        columns=[str(c) for c in state['columns']]
+    )
+
+
+def load_distances(directory, start_dt=None, end_dt=None):
+    """
+    float32 distance frame indexed by dt, as written by save_distances.
+    Only parts overlapping [start_dt, end_dt] are read.
+    """
+    start_ts = -np.inf if start_dt is None else utils.dt_to_ts(start_dt)
+    end_ts = np.inf if end_dt is None else utils.dt_to_ts(end_dt)
+    frames = [
+        _load_part(path)
+        for _, first_ts, last_ts, path in _distance_parts(directory)
+        if last_ts >= start_ts and first_ts <= end_ts
+    ]
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='dt'), dtype=np.float32)
+    distances = pd.concat(frames)
+    distances = distances[~distances.index.duplicated(keep='last')].sort_index()
+    return distances.loc[start_dt:end_dt]
+
+
+def last_distance_dt(directory):
+    """ Newest stored dt, from the part names alone """
+    parts = _distance_parts(directory)
+    if not parts:
+        return None
+    return pd.Timestamp(max(last_ts for _, _, last_ts, _ in parts), unit='s')
+
+
+class ClusterFeatures(object):
+    """
+    Distances to window clusters as compact features, kept under
+    <root>/<name>/ as centroids.npz and a distances/ folder.
+
+    update() walks the database in chunks of CHUNK_PERIODS bars, so
+    history is never loaded at once. Each chunk is transformed with the
+    centroids learned so far and then used to update them, so a
+    distance never depends on later data (except in the first chunk,
+    which seeds the clusters). Every chunk is appended to distances/
+    as its own part, together with the centroids it left behind.
+    """
+
+    def __init__(
+            self,
+            name,
+            terms=(),
+            product_list=utils.PRODUCT_LIST,
+            k=16,
+            length=24,
+            granularity=3600,
+            geo='',
+            root=DEFAULT_ROOT,
+            log_level=None
+    ):
+        self.directory = os.path.join(root, name)
+        self.terms = list(terms)
+        self.product_list = list(product_list)
+        self.granularity = granularity
+        self.geo = geo
+        self.logger = utils.get_logger(__name__, log_level)
+        self.centroids_path = os.path.join(self.directory, 'centroids.npz')
+        self.distances_directory = os.path.join(self.directory, 'distances')
+        if os.path.exists(self.centroids_path):
+            self.clusters = WindowClusters.load(self.centroids_path)
+        else:
+            self.clusters = WindowClusters(k=k, length=length)
+
+    def _load(self, start_dt, end_dt):
+        return load_window_inputs(
+            start_dt,
+            end_dt,
+            self.terms,
+            self.granularity,
+            self.product_list,
+            self.geo
+        )
+
+    def last_dt(self):
+        return last_distance_dt(self.distances_directory)
+
+    def load(self, start_dt=None, end_dt=None):
+        return load_distances(self.distances_directory, start_dt, end_dt)
+
+    def update(self, end_dt, start_dt=None):
+        """
+        Fit and transform bars from start_dt (default: just after the
+        last stored distance) to end_dt. Returns rows written.
+        """
+        bar = dt.timedelta(seconds=self.granularity)
+        last_dt = self.last_dt()
+        if start_dt is None:
+            assert last_dt is not None, "start_dt is needed for the first update"
+            start_dt = last_dt + bar
+        # earlier bars complete the first windows but are not written again
+        lookback = bar * (self.clusters.length - 1)
+        chunk_start = start_dt - lookback
+        written = 0
+        while chunk_start + lookback <= end_dt:
+            chunk_end = min(chunk_start + bar * (CHUNK_PERIODS - 1), end_dt)
+            frame = self._load(chunk_start, chunk_end)
+            seeding = not self.clusters.fitted
+            if seeding:
+                self.clusters.fit(window_batches(frame, self.clusters.length))
+            if self.clusters.fitted:
+                distances = self.clusters.transform(frame).loc[chunk_start + lookback:]
+                if not seeding:
+                    self.clusters.fit(window_batches(frame, self.clusters.length))
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                save_distances(distances, self.distances_directory)
+                self.clusters.save(self.centroids_path)
+                written += len(distances)
+            self.logger.info(
+                "Clustered windows from %s to %s",
+                chunk_start + lookback,
+                chunk_end
+            )
+            chunk_start = chunk_end + bar - lookback
+        return written
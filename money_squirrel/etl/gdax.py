@@ -1,45 +1,298 @@
 import datetime as dt
+import numpy as np
 import pandas as pd
 from bin import utils
 
+PRICE_COLUMNS = ['low', 'high', 'open', 'close', 'volume']
+# Keep in step with gdax_api.models.QuoteRollup.GRANULARITIES
+ROLLUP_GRANULARITIES = (300, 3600, 86400)
+EPOCH = dt.datetime(1970, 1, 1)
+LOGGER = utils.get_logger(__name__)
 
-def get_price_features_60(start_dt, end_dt):
 
+def get_product_ids(product_list=utils.PRODUCT_LIST):
+    """ Map product names to gdax_api_product ids """
     df = utils.query_pg(
+        """
+        select id
+            , name
+        from gdax_api_product
+        where name = any(%(product_list)s)
+        """,
+        params={"product_list": list(product_list)}
+    )
+    return dict(zip(df['name'], df['id']))
+
+
+def _quote_chunk(rows, product_names):
+    """ Typed frame from (product_id, epoch, low, high, open, close, volume) rows """
+    values = np.array(rows, dtype=np.float64).reshape(-1, 2 + len(PRICE_COLUMNS))
+    chunk = pd.DataFrame({
+        'product': pd.Categorical.from_codes(
+            np.searchsorted(product_names[0], values[:, 0]),
+            categories=product_names[1]
+        ),
+        'dt': pd.to_datetime(values[:, 1].astype(np.int64), unit='s'),
+    })
+    for i, column in enumerate(PRICE_COLUMNS):
+        chunk[column] = values[:, 2 + i].astype(np.float32)
+    return chunk
+
+
+def iter_quotes(
+        start_dt,
+        end_dt,
+        granularity=60,
+        product_list=utils.PRODUCT_LIST,
+        chunk_size=utils.PG_CHUNK_SIZE,
+        rollup_source=None
+):
+    """
+    Stream quotes in [start_dt, end_dt] ordered by dt, as DataFrames of at
+    most chunk_size rows: a categorical product, datetime64 dt and float32
+    prices. Memory use is bounded by chunk_size, not the time range.
+    With rollup_source set, read bars of the quote rollup table built
+    from that source granularity instead.
+    """
+    table = 'gdax_api_quoterollup' if rollup_source else 'gdax_api_quote'
+    rollup_filter = 'and source_granularity = %(rollup_source)s' if rollup_source else ''
+    product_ids = get_product_ids(product_list)
+    # sorted ids alongside their names, for mapping ids to category codes
+    ids = sorted(product_ids.values())
+    names = {v: k for k, v in product_ids.items()}
+    product_names = (np.array(ids, dtype=np.float64), [names[i] for i in ids])
+    empty = True
+    for rows in utils.iter_pg(
             """
-            select distinct product
-                , dt
+            select product_id
+                , cast(extract(epoch from dt) as bigint)
+                , low
+                , high
+                , open
                 , close
                 , volume
-            from gdax_gdaxprice
-            where granularity = 60
-                and dt <= cast('{end_dt}' as timestamp)
-                and dt >= cast('{start_dt}' as timestamp)
-            """.format(
-                start_dt=str(start_dt),
-                end_dt=str(end_dt)
-            )
+            from {table}
+            where granularity = %(granularity)s
+                and product_id = any(%(product_ids)s)
+                and dt >= %(start_dt)s
+                and dt <= %(end_dt)s
+                {rollup_filter}
+            order by dt, product_id
+            """.format(table=table, rollup_filter=rollup_filter),
+            params={
+                "rollup_source": rollup_source,
+                "granularity": granularity,
+                "product_ids": ids,
+                "start_dt": start_dt,
+                "end_dt": end_dt
+            },
+            chunk_size=chunk_size
+    ):
+        empty = False
+        yield _quote_chunk(rows, product_names)
+    if empty:
+        yield _quote_chunk([], product_names)
+
+
+def load_quotes(
+        start_dt,
+        end_dt,
+        granularity=60,
+        product_list=utils.PRODUCT_LIST,
+        chunk_size=utils.PG_CHUNK_SIZE,
+        rollup_source=None
+):
+    """ iter_quotes concatenated into one frame """
+    return pd.concat(
+        list(iter_quotes(
+            start_dt,
+            end_dt,
+            granularity,
+            product_list,
+            chunk_size,
+            rollup_source
+        )),
+        ignore_index=True
     )
-    close_df = df.pivot(
-        columns='product',
-        index='dt',
-        values='close'
-    ).sort_index()
-    volume_df = df.pivot(
-        columns='product',
-        index='dt',
-        values='volume'
-    ).sort_index()
-    output = close_df.merge(
-        volume_df,
-        how="outer",
-        left_index=True,
-        right_index=True,
-        suffixes=('_close', '_volume')
+
+
+def pick_rollup(granularity, source_granularity):
+    """
+    Coarsest rollup granularity which evenly divides granularity and is
+    built from source_granularity, or None if base quotes must be read.
+    """
+    candidates = [
+        g for g in ROLLUP_GRANULARITIES
+        if source_granularity < g <= granularity
+        and granularity % g == 0
+        and g % source_granularity == 0
+    ]
+    return max(candidates) if candidates else None
+
+
+def rollup_is_complete(
+        start_dt,
+        end_dt,
+        rollup,
+        source_granularity,
+        product_list=utils.PRODUCT_LIST
+):
+    """
+    Whether the rollup bars in [start_dt, end_dt] account for every
+    base quote they cover, per product. Rollups only exist for quotes
+    stored since they were added, or backfilled with refresh_rollups,
+    and go stale if quotes change without a refresh. Both counts come
+    from indexes, without reading the quotes themselves.
+    """
+    start_ts = utils.dt_to_ts(start_dt)
+    bars_start = EPOCH + dt.timedelta(seconds=-(-start_ts // rollup) * rollup)
+    bars_end = EPOCH + dt.timedelta(
+        seconds=(utils.dt_to_ts(end_dt) // rollup + 1) * rollup
     )
+    df = utils.query_pg(
+        """
+        select count(*) as mismatched
+        from (
+            select product_id
+                , count(*) as candles
+            from gdax_api_quote
+            where granularity = %(source_granularity)s
+                and product_id = any(%(product_ids)s)
+                and dt >= %(bars_start)s
+                and dt < %(bars_end)s
+            group by product_id
+        ) q
+        full join (
+            select product_id
+                , sum(candles) as candles
+            from gdax_api_quoterollup
+            where source_granularity = %(source_granularity)s
+                and granularity = %(rollup)s
+                and product_id = any(%(product_ids)s)
+                and dt >= %(bars_start)s
+                and dt < %(bars_end)s
+            group by product_id
+        ) r using (product_id)
+        where q.candles is distinct from r.candles
+        """,
+        params={
+            "source_granularity": source_granularity,
+            "rollup": rollup,
+            "product_ids": list(get_product_ids(product_list).values()),
+            "bars_start": bars_start,
+            "bars_end": bars_end
+        }
+    )
+    return int(df['mismatched'][0]) == 0
+
+
+def load_candles(
+        start_dt,
+        end_dt,
+        granularity=60,
+        product_list=utils.PRODUCT_LIST,
+        source_granularity=None
+):
+    """
+    Candles of any granularity, built from quotes downloaded at
+    source_granularity (default: granularity itself). Reads the coarsest
+    rollup that fits and resamples whatever is left, so long horizons
+    read a fraction of the base rows. Where that rollup doesn't cover
+    the range, base quotes are resampled instead.
+    """
+    source_granularity = source_granularity or granularity
+    assert granularity % source_granularity == 0
+    rollup = pick_rollup(granularity, source_granularity)
+    if rollup and not rollup_is_complete(
+            start_dt,
+            end_dt,
+            rollup,
+            source_granularity,
+            product_list
+    ):
+        LOGGER.warning(
+            "%ss rollups of %ss quotes are incomplete from %s to %s, "
+            "resampling quotes instead. Backfill them with refresh_rollups",
+            rollup,
+            source_granularity,
+            start_dt,
+            end_dt
+        )
+        rollup = None
+    if rollup:
+        candles = load_quotes(
+            start_dt,
+            end_dt,
+            rollup,
+            product_list,
+            rollup_source=source_granularity
+        )
+        read_granularity = rollup
+    else:
+        candles = load_quotes(start_dt, end_dt, source_granularity, product_list)
+        read_granularity = source_granularity
+    if read_granularity != granularity:
+        candles = resample_quotes(candles, granularity)
+    return candles
+
+
+def resample_quotes(quotes, granularity):
+    """
+    Aggregate finer candles (eg. 20s) into `granularity` second bars,
+    aligned to the epoch: first open, max high, min low, last close and
+    summed volume per product and bar.
+    """
+    quotes = quotes.sort_values('dt')
+    seconds = quotes['dt'].values.astype('datetime64[s]').astype(np.int64)
+    bars = quotes.assign(
+        dt=pd.to_datetime(seconds - seconds % granularity, unit='s')
+    ).groupby(['product', 'dt'], observed=True, sort=False).agg({
+        'low': 'min',
+        'high': 'max',
+        'open': 'first',
+        'close': 'last',
+        'volume': 'sum',
+    })
+    return bars.reset_index().sort_values(['dt', 'product']).reset_index(drop=True)
+
+
+def get_price_features(
+        start_dt,
+        end_dt,
+        granularity=60,
+        product_list=utils.PRODUCT_LIST,
+        columns=('close', 'volume'),
+        source_granularity=None,
+        fill=None
+):
+    """
+    Wide frame of price features indexed by dt with one column per
+    product and field, eg. BTC-USD_close, on a regular granularity grid.
+    Quotes stored at a finer source_granularity are read from rollups
+    or resampled, so one download serves every coarser granularity.
+    columns may include any of low, high, open, close, volume; fill is
+    passed to fill_dt_gaps.
+    """
+    quotes = load_candles(
+        start_dt,
+        end_dt,
+        granularity,
+        product_list,
+        source_granularity
+    ).drop_duplicates(['dt', 'product'])
+    output = quotes.set_index(['dt', 'product'])[list(columns)].unstack('product')
+    output.columns = [
+        '{}_{}'.format(product, column)
+        for column, product in output.columns
+    ]
     return utils.fill_dt_gaps(
-        output,
+        output.sort_index(),
         start_dt,
         end_dt,
-        window_seconds=60
+        window_seconds=granularity,
+        fill=fill
     )
+
+
+def get_price_features_60(start_dt, end_dt):
+    return get_price_features(start_dt, end_dt, granularity=60)
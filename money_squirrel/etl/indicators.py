@@ -0,0 +1,260 @@
+import numpy as np
+import pandas as pd
+from bin import utils
+
+
+class RollingWindow(object):
+    """
+    Ring buffer over the last `window` values of several series at once.
+    Running sums make each push and each mean/std O(1) per series.
+    Like pandas rolling(window), results are NaN until the window is
+    full and while it holds any NaN.
+    """
+
+    RESYNC = 1000  # pushes between recomputing sums, bounding float drift
+
+    def __init__(self, window, width):
+        self.window = window
+        self.values = np.full((window, width), np.nan)
+        self.pos = 0
+        self.pushes = 0
+        self._resync()
+
+    def _resync(self):
+        valid = ~np.isnan(self.values)
+        values = np.where(valid, self.values, 0.0)
+        self.total = values.sum(axis=0)
+        self.total_sq = (values ** 2).sum(axis=0)
+        self.valid = valid.sum(axis=0)
+
+    def push(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        old = self.values[self.pos]
+        old_valid = ~np.isnan(old)
+        new_valid = ~np.isnan(x)
+        old = np.where(old_valid, old, 0.0)
+        new = np.where(new_valid, x, 0.0)
+        self.total += new - old
+        self.total_sq += new ** 2 - old ** 2
+        self.valid += new_valid.astype(np.int64) - old_valid.astype(np.int64)
+        self.values[self.pos] = x
+        self.pos = (self.pos + 1) % self.window
+        self.pushes += 1
+        if self.pushes % self.RESYNC == 0:
+            self._resync()
+
+    def sum(self):
+        return np.where(self.valid == self.window, self.total, np.nan)
+
+    def mean(self):
+        return self.sum() / self.window
+
+    def std(self):
+        """ Sample standard deviation (ddof=1), as pandas """
+        if self.window < 2:
+            return np.full(len(self.total), np.nan)
+        var = (self.total_sq - self.total ** 2 / self.window) / (self.window - 1)
+        return np.where(
+            self.valid == self.window,
+            np.sqrt(np.maximum(var, 0.0)),
+            np.nan
+        )
+
+
+class IndicatorEngine(object):
+    """
+    Technical indicators over close/volume for several products:
+    log returns, and per window SMA, rolling std, z-score of close
+    against the SMA and VWAP, plus EMAs per span.
+
+    batch() computes indicators for a whole history with pandas and
+    leaves the engine ready for update(), which adds one bar in O(1)
+    per product. save()/load() persist the streaming state so a
+    restarted process picks up without recomputing the history.
+
+    update() agrees with batch() to within STREAM_TOLERANCE of each
+    indicator's scale (its largest absolute value), not of every value:
+    std and z-scores come from running sums of squares, which lose
+    digits when the std is small next to the price.
+    """
+
+    STREAM_TOLERANCE = 1e-6
+
+    def __init__(
+            self,
+            product_list=utils.PRODUCT_LIST,
+            windows=(15, 60, 240),
+            spans=(15, 60, 240)
+    ):
+        self.product_list = list(product_list)
+        self.windows = list(windows)
+        self.spans = list(spans)
+        self.last_dt = None
+        self._reset()
+
+    def _reset(self):
+        width = len(self.product_list)
+        self.closes = {w: RollingWindow(w, width) for w in self.windows}
+        self.price_volumes = {w: RollingWindow(w, width) for w in self.windows}
+        self.volumes = {w: RollingWindow(w, width) for w in self.windows}
+        self.emas = {s: np.full(width, np.nan) for s in self.spans}
+        self.prev_log_close = np.full(width, np.nan)
+
+    @property
+    def columns(self):
+        columns = ['return']
+        for w in self.windows:
+            columns += [
+                'sma_{}'.format(w),
+                'std_{}'.format(w),
+                'z_{}'.format(w),
+                'vwap_{}'.format(w)
+            ]
+        columns += ['ema_{}'.format(s) for s in self.spans]
+        return [
+            '{}_{}'.format(product, column)
+            for column in columns
+            for product in self.product_list
+        ]
+
+    def split_features(self, features):
+        """ Close and volume frames from get_price_features output """
+        close = features[['{}_close'.format(p) for p in self.product_list]]
+        volume = features[['{}_volume'.format(p) for p in self.product_list]]
+        close.columns = volume.columns = self.product_list
+        return close, volume
+
+    def batch(self, close, volume):
+        """
+        Vectorized indicators for frames indexed by dt with one column
+        per product. Also primes the streaming state with the tail.
+        """
+        close = close[self.product_list].astype(np.float64)
+        volume = volume[self.product_list].astype(np.float64)
+        volume = volume.where(close.notnull())
+        price_volume = close * volume
+        output = {'return': np.log(close).diff()}
+        for w in self.windows:
+            sma = close.rolling(w).mean()
+            std = close.rolling(w).std()
+            output['sma_{}'.format(w)] = sma
+            output['std_{}'.format(w)] = std
+            output['z_{}'.format(w)] = (close - sma) / std
+            output['vwap_{}'.format(w)] = (
+                price_volume.rolling(w).sum() / volume.rolling(w).sum()
+            )
+        for s in self.spans:
+            output['ema_{}'.format(s)] = close.ewm(
+                span=s,
+                adjust=False,
+                ignore_na=True
+            ).mean()
+        frame = pd.concat(output, axis=1)
+        frame.columns = [
+            '{}_{}'.format(product, name)
+            for name, product in frame.columns
+        ]
+        frame = frame[self.columns]
+
+        self._reset()
+        tail = max(self.windows) if self.windows else 1
+        for i in range(max(len(close) - tail, 0), len(close)):
+            self._push(close.values[i], volume.values[i])
+        for s in self.spans:
+            self.emas[s] = output['ema_{}'.format(s)].values[-1] \
+                if len(close) else self.emas[s]
+        self.last_dt = close.index[-1] if len(close) else self.last_dt
+        return frame
+
+    def _push(self, close, volume):
+        close = np.asarray(close, dtype=np.float64)
+        volume = np.where(np.isnan(close), np.nan, np.asarray(volume, dtype=np.float64))
+        for w in self.windows:
+            self.closes[w].push(close)
+            self.price_volumes[w].push(close * volume)
+            self.volumes[w].push(volume)
+        log_close = np.log(close)
+        log_return = log_close - self.prev_log_close
+        self.prev_log_close = log_close
+        return log_return
+
+    def update(self, dt, close, volume):
+        """
+        Add one bar. close and volume are sequences (or Series indexed
+        by product) in product_list order. Returns a Series of the same
+        indicators batch() would give for this bar.
+        """
+        if isinstance(close, pd.Series):
+            close = close[self.product_list].values
+        if isinstance(volume, pd.Series):
+            volume = volume[self.product_list].values
+        close = np.asarray(close, dtype=np.float64)
+        log_return = self._push(close, volume)
+        values = [log_return]
+        for w in self.windows:
+            sma = self.closes[w].mean()
+            std = self.closes[w].std()
+            values += [
+                sma,
+                std,
+                (close - sma) / std,
+                self.price_volumes[w].sum() / self.volumes[w].sum(),
+            ]
+        valid = ~np.isnan(close)
+        for s in self.spans:
+            alpha = 2.0 / (s + 1)
+            ema = self.emas[s]
+            self.emas[s] = np.where(
+                valid,
+                np.where(np.isnan(ema), close, alpha * close + (1 - alpha) * ema),
+                ema
+            )
+            values.append(self.emas[s])
+        self.last_dt = dt
+        return pd.Series(np.concatenate(values), index=self.columns, name=dt)
+
+    def save(self, path):
+        """ Persist the streaming state to a .npz file """
+        arrays = {
+            'product_list': np.array(self.product_list),
+            'windows': np.array(self.windows, dtype=np.int64),
+            'spans': np.array(self.spans, dtype=np.int64),
+            'last_dt': np.array([str(self.last_dt) if self.last_dt is not None else '']),
+            'prev_log_close': self.prev_log_close,
+        }
+        for w in self.windows:
+            for name, buffers in (
+                    ('closes', self.closes),
+                    ('price_volumes', self.price_volumes),
+                    ('volumes', self.volumes)
+            ):
+                arrays['{}_{}'.format(name, w)] = buffers[w].values
+            arrays['pos_{}'.format(w)] = np.array([self.closes[w].pos])
+        for s in self.spans:
+            arrays['ema_{}'.format(s)] = self.emas[s]
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        state = np.load(path)
+        engine = cls(
+            product_list=[str(p) for p in state['product_list']],
+            windows=[int(w) for w in state['windows']],
+            spans=[int(s) for s in state['spans']]
+        )
+        engine.prev_log_close = state['prev_log_close']
+        for w in engine.windows:
+            pos = int(state['pos_{}'.format(w)][0])
+            for name, buffers in (
+                    ('closes', engine.closes),
+                    ('price_volumes', engine.price_volumes),
+                    ('volumes', engine.volumes)
+            ):
+                buffers[w].values = state['{}_{}'.format(name, w)].copy()
+                buffers[w].pos = pos
+                buffers[w]._resync()
+        for s in engine.spans:
+            engine.emas[s] = state['ema_{}'.format(s)]
+        last_dt = str(state['last_dt'][0])
+        engine.last_dt = pd.Timestamp(last_dt) if last_dt else None
+        return engine
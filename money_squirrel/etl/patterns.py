@@ -0,0 +1,197 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.spatial import cKDTree
+
+BUFFER_SIZE = 4096  # windows searched by brute force before being indexed
+
+
+def sliding_windows(series, length):
+    """ (n - length + 1, length) read only view of every window """
+    series = np.ascontiguousarray(series, dtype=np.float64)
+    step = series.strides[0]
+    return as_strided(
+        series,
+        shape=(len(series) - length + 1, length),
+        strides=(step, step),
+        writeable=False
+    )
+
+
+def znormalize(windows):
+    """ Each row to zero mean and unit std; flat rows become all zeros """
+    windows = np.atleast_2d(windows)
+    mean = windows.mean(axis=1, keepdims=True)
+    std = windows.std(axis=1, keepdims=True)
+    return np.where(std > 0, (windows - mean) / np.where(std > 0, std, 1.0), 0.0)
+
+
+def paa(windows, segments):
+    """
+    Piecewise aggregate approximation: the mean of each of `segments`
+    equal parts. Scaled by sqrt(length / segments), euclidean distance
+    between PAAs lower bounds the distance between the windows.
+    """
+    length = windows.shape[1]
+    reduced = windows.reshape(len(windows), segments, length // segments).mean(axis=2)
+    return reduced * np.sqrt(length / float(segments))
+
+
+def dtw_distances(query, candidates, band):
+    """
+    Dynamic time warping distance from query to each candidate row,
+    with warping limited to `band` steps (Sakoe-Chiba). Each cell is
+    vectorized across candidates.
+    """
+    count, length = candidates.shape
+    previous = np.full((count, length + 1), np.inf)
+    previous[:, 0] = 0.0
+    for i in range(length):
+        current = np.full((count, length + 1), np.inf)
+        for j in range(max(0, i - band), min(length, i + band + 1)):
+            cost = (query[i] - candidates[:, j]) ** 2
+            current[:, j + 1] = cost + np.minimum(
+                np.minimum(previous[:, j + 1], current[:, j]),
+                previous[:, j]
+            )
+        previous = current
+    return np.sqrt(previous[:, length])
+
+
+class PatternIndex(object):
+    """
+    Top-k search for the historical windows most similar in shape to a
+    query window (z-normalized euclidean distance, optionally DTW), as
+    needed by the latent source approach in data_thoughts.md.
+
+    Windows are indexed by their PAA in KD-trees. Appended values land
+    in a small buffer searched by brute force; full buffers become
+    trees, and trees of similar size are merged, so building is
+    incremental with amortized O(log n) rebuilds per window. Queries
+    take candidates from every tree and rerank them exactly.
+    """
+
+    def __init__(self, length, segments=8, buffer_size=BUFFER_SIZE):
+        assert length % segments == 0, "length must be a multiple of segments"
+        self.length = length
+        self.segments = segments
+        self.buffer_size = buffer_size
+        self.series = np.empty(0)
+        self.trees = []  # (cKDTree, first window position, PAA rows)
+        self.buffer_start = 0  # first window position not in a tree
+
+    def __len__(self):
+        return max(len(self.series) - self.length + 1, 0)
+
+    def append(self, values):
+        """ Add new values to the end of the series and index new windows """
+        self.series = np.concatenate([self.series, np.asarray(values, dtype=np.float64)])
+        while len(self) - self.buffer_start >= self.buffer_size:
+            end = self.buffer_start + self.buffer_size
+            self._add_tree(self.buffer_start, self._paa(self.buffer_start, end))
+            self.buffer_start = end
+
+    def _windows(self, start, end):
+        return sliding_windows(self.series, self.length)[start:end]
+
+    def _paa(self, start, end):
+        return paa(znormalize(self._windows(start, end)), self.segments)
+
+    def _add_tree(self, start, points):
+        # merge with the newest tree while it is no bigger, like a binary counter
+        while self.trees and len(self.trees[-1][2]) <= len(points):
+            _, previous_start, previous_points = self.trees.pop()
+            start, points = previous_start, np.vstack([previous_points, points])
+        self.trees.append((cKDTree(points), start, points))
+
+    def _limit(self, before):
+        """ Windows at positions below this end by position `before` """
+        if before is None:
+            return len(self)
+        return max(0, min(len(self), before - self.length + 1))
+
+    def _candidates(self, query_paa, count, limit):
+        """
+        The `count` nearest PAAs of every tree, among windows below
+        position limit. The tree straddling limit is searched by radius
+        so that windows past it can't crowd out the earlier ones.
+        """
+        positions = []
+        for tree, start, points in self.trees:
+            if start >= limit:
+                continue
+            if start + len(points) <= limit:
+                _, found = tree.query(query_paa, k=min(count, len(points)))
+                positions.append(start + np.atleast_1d(found))
+                continue
+            allowed = limit - start
+            _, found = tree.query(query_paa, k=min(count, allowed))
+            found = np.atleast_1d(found)
+            found = found[found < allowed]
+            if len(found) < min(count, allowed):
+                # brute force over the allowed part, which is no bigger than the tree
+                distances = ((points[:allowed] - query_paa) ** 2).sum(axis=1)
+                found = np.argsort(distances, kind='mergesort')[:count]
+            positions.append(start + found)
+        if limit > self.buffer_start:
+            # the buffer is small enough to rank in full
+            positions.append(np.arange(self.buffer_start, limit))
+        return np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+
+    def _rank(self, query, positions, k, dtw_band, exclusion, limit):
+        positions = np.unique(positions)
+        positions = positions[positions < limit]
+        if not len(positions):
+            return positions, np.empty(0)
+        found = znormalize(sliding_windows(self.series, self.length)[positions])
+        if dtw_band is None:
+            distances = np.sqrt(((found - query) ** 2).sum(axis=1))
+        else:
+            distances = dtw_distances(query[0], found, dtw_band)
+        order = np.argsort(distances, kind='mergesort')
+        chosen = []
+        for i in order:
+            if all(abs(positions[i] - positions[j]) > exclusion for j in chosen):
+                chosen.append(i)
+                if len(chosen) == k:
+                    break
+        return positions[chosen], distances[chosen]
+
+    def query(self, window, k=10, candidates=None, dtw_band=None, exclusion=None, before=None):
+        """
+        Start positions and distances of the k windows most similar to
+        `window`, nearest first. Matches within `exclusion` positions
+        (default length // 2) of a better match are skipped as trivially
+        similar, and only windows ending by position `before` count.
+
+        Each tree offers `candidates` (default 4k) nearest PAAs, which are
+        reranked exactly. For euclidean distance a second pass then
+        fetches every window whose PAA lies within the k-th distance,
+        which the PAA lower bound guarantees includes the true top k.
+        dtw_band reranks the first pass with banded DTW instead. Trees
+        wholly after `before` are skipped and the one straddling it only
+        offers windows ending in time.
+        """
+        query = znormalize(np.asarray(window, dtype=np.float64))
+        query_paa = paa(query, self.segments)[0]
+        exclusion = self.length // 2 if exclusion is None else exclusion
+        limit = self._limit(before)
+        positions = self._candidates(query_paa, candidates or 4 * k, limit)
+        found, distances = self._rank(query, positions, k, dtw_band, exclusion, limit)
+        if dtw_band is not None or not len(found):
+            return found, distances
+        # with fewer than k matches anything might rank, so take every tree whole
+        radius = distances[-1] if len(found) == k else np.inf
+        within = [
+            start + np.array(tree.query_ball_point(query_paa, radius), dtype=np.int64)
+            if np.isfinite(radius) else start + np.arange(min(len(points), limit - start))
+            for tree, start, points in self.trees
+            if start < limit
+        ]
+        return self._rank(
+            query,
+            np.concatenate([positions] + within),
+            k,
+            dtw_band,
+            exclusion,
+            limit
+        )
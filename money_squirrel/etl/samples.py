@@ -0,0 +1,117 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from bin import utils
+from etl import gdax as gdax_etl
+
+MAX_BATCH_BYTES = 64 * 2 ** 20
+
+
+class WindowSampler(object):
+    """
+    Training samples as in data_thoughts.md: the K periods before a
+    target time each hold W bars, and a sample takes one randomly chosen
+    bar per period, so each target has W**K possible samples.
+
+    The (targets x K x W x features) lookback tensor is a strided view
+    over the price matrix, never copied, and each batch is a single
+    fancy-index gather of `samples` draws per target. Memory depends only
+    on the batch, whose size is capped in bytes.
+    """
+
+    def __init__(self, values, periods, window, samples=32, seed=None, relative=True):
+        """
+        values: (bars x features) array or frame on a regular grid,
+        eg. get_price_features output. relative=True divides samples by
+        the last bar before the target, so they are scale free.
+        """
+        self.index = getattr(values, 'index', None)
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+        if self.values.ndim == 1:
+            self.values = self.values[:, None]
+        self.periods = periods
+        self.window = window
+        self.samples = samples
+        self.relative = relative
+        self.random = np.random.RandomState(seed)
+        self.lookback = periods * window
+        bars, width = self.values.shape
+        assert bars > self.lookback, "need more bars than periods * window"
+        row, column = self.values.strides
+        # view[i] is the lookback for target bar i + lookback
+        self.view = as_strided(
+            self.values,
+            shape=(bars - self.lookback + 1, periods, window, width),
+            strides=(row, window * row, row, column),
+            writeable=False
+        )
+
+    @classmethod
+    def from_prices(
+            cls,
+            start_dt,
+            end_dt,
+            periods,
+            window,
+            granularity=60,
+            product_list=utils.PRODUCT_LIST,
+            columns=('close',),
+            **kwargs
+    ):
+        features = gdax_etl.get_price_features(
+            start_dt,
+            end_dt,
+            granularity,
+            product_list,
+            columns=columns,
+            fill='ffill'
+        )
+        return cls(features, periods, window, **kwargs)
+
+    @property
+    def targets(self):
+        """
+        Bar positions with a full lookback before them, leaving out those
+        whose lookback has a missing (NaN) bar
+        """
+        missing = np.concatenate([[0], np.cumsum(np.isnan(self.values).any(axis=1))])
+        targets = np.arange(self.lookback, len(self.values))
+        return targets[missing[targets] == missing[targets - self.lookback]]
+
+    def sample(self, targets):
+        """ (targets x samples x periods x features) float32 draws """
+        rows = np.asarray(targets) - self.lookback
+        offsets = self.random.randint(
+            0,
+            self.window,
+            size=(len(rows), self.samples, self.periods)
+        )
+        draws = self.view[
+            rows[:, None, None],
+            np.arange(self.periods)[None, None, :],
+            offsets
+        ]
+        if self.relative:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                draws /= self.values[rows + self.lookback - 1][:, None, None, :]
+        return draws
+
+    def batch_size(self, max_bytes=MAX_BATCH_BYTES):
+        sample_bytes = self.samples * self.periods * self.values.shape[1] * 4
+        return max(1, int(max_bytes // sample_bytes))
+
+    def batches(self, targets=None, y=None, shuffle=False, max_bytes=MAX_BATCH_BYTES):
+        """
+        Yield (targets, X, y) batches: X is (batch x samples x periods x
+        features) and y, if given per bar, is y at each target.
+        """
+        targets = self.targets if targets is None else np.asarray(targets)
+        if shuffle:
+            targets = self.random.permutation(targets)
+        size = self.batch_size(max_bytes)
+        for start in range(0, len(targets), size):
+            batch = targets[start:start + size]
+            yield (
+                batch,
+                self.sample(batch),
+                None if y is None else np.asarray(y)[batch]
+            )
@@ -0,0 +1,583 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import datetime as dt
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+from bin.tests import PgPoolTestCase
+from etl import clusters
+from etl import gdax as gdax_etl
+from etl.backtest import FeeModel, backtest, backtest_events
+from etl.clusters import ClusterFeatures, load_distances, save_distances
+from etl.indicators import IndicatorEngine
+from etl.patterns import PatternIndex, sliding_windows, znormalize
+from etl.samples import WindowSampler
+from etl.walk_forward import walk_forward, walk_forward_folds
+from gdax_api.models import Product, Quote, QuoteRollup
+from trends_api.models import StitchedInterest
+
+PRODUCTS = ['BTC-USD', 'LTC-USD', 'ETH-USD', 'LTC-BTC', 'ETH-BTC']
+
+
+def random_prices(n, seed=0, start='2017-01-01', freq='min'):
+    """ Random walk closes at realistic price levels, plus volumes """
+    random = np.random.RandomState(seed)
+    scale = np.array([10000.0, 200.0, 3000.0, 0.02, 0.3])
+    index = pd.date_range(start, periods=n, freq=freq)
+    close = pd.DataFrame(
+        scale * np.exp(np.cumsum(random.normal(0, 1e-3, (n, len(scale))), axis=0)),
+        index=index,
+        columns=PRODUCTS
+    )
+    volume = pd.DataFrame(
+        random.exponential(10, (n, len(scale))),
+        index=index,
+        columns=PRODUCTS
+    )
+    return close, volume
+
+
+def store_quotes(quotes, granularity):
+    """ Save a long frame of product, dt and price columns as Quote rows """
+    product_ids = Product.get_ids(quotes['product'].unique())
+    Quote.objects.bulk_create([
+        Quote(
+            product_id=product_ids[row.product],
+            granularity=granularity,
+            dt=row.dt.to_pydatetime(),
+            low=row.low,
+            high=row.high,
+            open=row.open,
+            close=row.close,
+            volume=row.volume
+        )
+        for row in quotes.itertuples()
+    ])
+
+
+def long_quotes(close, volume, spread=0.0):
+    """
+    Wide closes and volumes as a long frame of candles, with lows,
+    highs and opens `spread` apart from the close.
+    """
+    quotes = close.stack().rename('close').to_frame()
+    quotes['volume'] = volume.stack()
+    quotes = quotes.rename_axis(['dt', 'product']).reset_index()
+    quotes['low'] = quotes['close'] * (1 - spread)
+    quotes['high'] = quotes['close'] * (1 + spread)
+    quotes['open'] = quotes['close'] * (1 + spread / 2)
+    return quotes
+
+
+class IndicatorEngineTest(SimpleTestCase):
+
+    def setUp(self):
+        self.close, self.volume = random_prices(3000)
+        self.close.iloc[100:110, 1] = np.nan
+        self.close.iloc[2500:2505, 3] = np.nan
+        self.split = 2000
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_update_matches_batch(self):
+        expected = IndicatorEngine(PRODUCTS).batch(self.close, self.volume)
+        engine = IndicatorEngine(PRODUCTS)
+        engine.batch(self.close.iloc[:self.split], self.volume.iloc[:self.split])
+        path = os.path.join(self.directory, 'engine.npz')
+        engine.save(path)
+        engine = IndicatorEngine.load(path)
+        streamed = pd.DataFrame([
+            engine.update(dt, self.close.loc[dt], self.volume.loc[dt])
+            for dt in self.close.index[self.split:]
+        ])
+        expected = expected.iloc[self.split:]
+        self.assertEqual(list(streamed.columns), list(expected.columns))
+        np.testing.assert_array_equal(
+            np.isnan(streamed.values),
+            np.isnan(expected.values)
+        )
+        scale = np.nanmax(np.abs(expected.values), axis=0)
+        error = np.nanmax(np.abs(streamed.values - expected.values), axis=0)
+        self.assertTrue(
+            (error <= IndicatorEngine.STREAM_TOLERANCE * scale).all(),
+            expected.columns[error > IndicatorEngine.STREAM_TOLERANCE * scale]
+        )
+
+
+class BacktestTest(SimpleTestCase):
+
+    def setUp(self):
+        self.prices, _ = random_prices(500, freq='20s')
+        self.prices.iloc[:50, 4] = np.nan
+        self.prices.iloc[300:310, 2] = np.nan
+        random = np.random.RandomState(1)
+        signals = random.uniform(-0.5, 1.0, self.prices.shape)
+        # rebalance now and then, so some bars trade and others drift
+        signals[random.uniform(size=len(signals)) < 0.7] = np.nan
+        self.signals = pd.DataFrame(
+            signals,
+            index=self.prices.index,
+            columns=self.prices.columns
+        ).ffill().fillna(0.0)
+
+    def test_events_match_vectorized(self):
+        fee_model = FeeModel(fee=0.001, slippage=0.0002)
+        expected = backtest(self.prices, self.signals, fee_model, capital=100.0)
+        signals = self.signals.values
+        result = backtest_events(
+            self.prices,
+            lambda i, dt, prices, weights, equity: signals[i],
+            fee_model,
+            capital=100.0
+        )
+        self.assertEqual(list(result.columns), list(expected.columns))
+        self.assertTrue(result.index.equals(expected.index))
+        np.testing.assert_allclose(result.values, expected.values, rtol=1e-9, atol=1e-12)
+        self.assertGreater(result['turnover'].sum(), 0)
+
+    def test_delay_shifts_signals(self):
+        delayed = backtest(self.prices, self.signals, delay=2)
+        shifted = backtest(self.prices, self.signals.shift(2).fillna(0.0))
+        np.testing.assert_allclose(delayed.values, shifted.values)
+
+
+def brute_force(series, window, k, exclusion, limit):
+    """ PatternIndex.query by exhaustive search over windows below limit """
+    windows = znormalize(sliding_windows(series, len(window))[:limit])
+    distances = np.sqrt(((windows - znormalize(window)) ** 2).sum(axis=1))
+    chosen = []
+    for i in np.argsort(distances, kind='mergesort'):
+        if all(abs(i - j) > exclusion for j in chosen):
+            chosen.append(i)
+            if len(chosen) == k:
+                break
+    return np.array(chosen), distances[chosen]
+
+
+class PatternIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(2)
+        self.series = np.cumsum(random.normal(size=5000))
+        self.length = 32
+        # small buffers so queries cross several merged trees and the buffer
+        self.index = PatternIndex(self.length, buffer_size=350)
+        for chunk in np.array_split(self.series, 7):
+            self.index.append(chunk)
+        self.queries = [
+            self.series[start:start + self.length] + random.normal(0, 0.5, self.length)
+            for start in random.randint(0, len(self.series) - self.length, 10)
+        ]
+
+    def assertMatches(self, window, k, before=None):
+        found, distances = self.index.query(window, k=k, before=before)
+        limit = len(self.index) if before is None \
+            else max(0, before - self.length + 1)
+        expected, expected_distances = brute_force(
+            self.series,
+            window,
+            k,
+            self.length // 2,
+            limit
+        )
+        np.testing.assert_array_equal(found, expected)
+        np.testing.assert_allclose(distances, expected_distances)
+
+    def test_index_is_incremental(self):
+        self.assertEqual(len(self.index), len(self.series) - self.length + 1)
+        self.assertGreater(len(self.index.trees), 1)
+        self.assertLess(self.index.buffer_start, len(self.index))
+
+    def test_query_matches_brute_force(self):
+        for window in self.queries:
+            self.assertMatches(window, k=5)
+
+    def test_before_matches_brute_force(self):
+        # inside a tree, on a tree boundary, in the buffer and too early for k matches
+        tree_end = self.index.trees[0][1] + len(self.index.trees[0][2])
+        for before in (2500, tree_end + self.length - 1, 4950, 150):
+            for window in self.queries:
+                self.assertMatches(window, k=10, before=before)
+
+
+class WindowSamplerTest(SimpleTestCase):
+
+    def setUp(self):
+        # each bar holds its own position, so draws show where they came from
+        bars = np.arange(100, dtype=np.float64)
+        self.values = np.column_stack([bars, 1000 + bars])
+
+    def test_draws_come_from_their_period(self):
+        sampler = WindowSampler(self.values, periods=3, window=4, samples=50, seed=0, relative=False)
+        targets = sampler.targets
+        self.assertEqual(list(targets), list(range(12, 100)))
+        draws = sampler.sample(targets)
+        self.assertEqual(draws.shape, (88, 50, 3, 2))
+        self.assertEqual(draws.dtype, np.float32)
+        np.testing.assert_array_equal(draws[..., 1], 1000 + draws[..., 0])
+        # period p of target t draws from bars t - 12 + 4p to t - 12 + 4p + 3
+        first = targets[:, None, None] - 12 + 4 * np.arange(3)[None, None, :]
+        offsets = draws[..., 0] - first
+        self.assertEqual((offsets.min(), offsets.max()), (0, 3))
+        # nothing from the target bar or later
+        self.assertTrue((draws[..., 0] < targets[:, None, None]).all())
+        self.assertEqual(draws[0].min(), 0)
+
+    def test_relative_to_the_last_bar(self):
+        sampler = WindowSampler(self.values + 1, periods=2, window=5, samples=10, seed=0)
+        draws = sampler.sample([10, 99])
+        last = np.array([[10, 1010], [99, 1099]], dtype=np.float32)
+        absolute = draws * last[:, None, None, :]
+        np.testing.assert_allclose(absolute[..., 1], 1000 + absolute[..., 0], rtol=1e-5)
+        self.assertTrue((absolute[..., 0] <= last[:, None, None, 0]).all())
+
+    def test_gaps_and_batches(self):
+        self.values[50, 1] = np.nan
+        sampler = WindowSampler(self.values, periods=2, window=6, samples=8, seed=0, relative=False)
+        # targets whose 12 bar lookback holds bar 50 are left out
+        self.assertEqual(list(sampler.targets), list(range(12, 51)) + list(range(63, 100)))
+        y = np.arange(100) * 2
+        max_bytes = 3 * 8 * 2 * 2 * 4  # 3 targets per batch
+        batches = list(sampler.batches(y=y, shuffle=True, max_bytes=max_bytes))
+        self.assertTrue(all(len(targets) <= 3 for targets, _, _ in batches))
+        targets = np.concatenate([t for t, _, _ in batches])
+        self.assertEqual(sorted(targets), list(sampler.targets))
+        for batch, X, batch_y in batches:
+            self.assertEqual(X.shape, (len(batch), 8, 2, 2))
+            self.assertFalse(np.isnan(X).any())
+            np.testing.assert_array_equal(batch_y, 2 * batch)
+        with self.assertRaises(AssertionError):
+            WindowSampler(self.values[:12], periods=2, window=6)
+
+
+class LastRowModel(object):
+    """
+    Predicts each row's own index as the mean, with the newest row
+    index it was trained on (plus one) as the std, so the metrics
+    show which rows each fold trained and tested on.
+    """
+
+    def fit(self, X, y):
+        self.train_end = X[:, 0].max() + 1
+        return self
+
+    def predict(self, X):
+        return X[:, 0], np.full(len(X), self.train_end)
+
+
+class WalkForwardTest(SimpleTestCase):
+
+    def test_folds(self):
+        for n, train_size, test_size, step, gap in [
+            (100, 30, 10, None, 0),
+            (100, 30, 10, 15, 5),
+            (57, 20, 7, 7, 3),
+        ]:
+            folds = walk_forward_folds(n, train_size, test_size, step, gap)
+            self.assertEqual(
+                len(folds),
+                (n - train_size - gap - test_size) // (step or test_size) + 1
+            )
+            for (train, test), (_, next_test) in zip(folds, folds[1:] + [(None, (n, n))]):
+                self.assertEqual(train[1] - train[0], train_size)
+                self.assertEqual(test[1] - test[0], test_size)
+                # no lookahead across the gap, and test rows never overlap
+                self.assertEqual(test[0] - train[1], gap)
+                self.assertLessEqual(test[1], next_test[0])
+                self.assertLessEqual(test[1], n)
+        expanding = walk_forward_folds(100, 30, 10, expanding=True)
+        self.assertEqual(expanding[:2], [((0, 30), (30, 40)), ((0, 40), (40, 50))])
+
+    def test_models_only_see_the_past(self):
+        n = 60
+        X = np.arange(n, dtype=np.float64).reshape(-1, 1)
+        y = np.arange(n, dtype=np.float64)
+        y[45] = np.nan
+        regimes = np.where(np.arange(n) % 2, 'up', 'down')
+        folds = walk_forward_folds(n, 20, 10, gap=2)
+        metrics = walk_forward(X, y, folds, LastRowModel, regimes=regimes, processes=2)
+
+        everything = metrics[metrics['regime'] == 'all'].set_index('fold')
+        self.assertEqual(list(everything.index), [0, 1, 2])
+        self.assertEqual(list(everything['train_start']), [0, 10, 20])
+        self.assertEqual(list(everything['test_start']), [22, 32, 42])
+        # each model trained up to gap rows before its test rows, and no further
+        self.assertEqual(list(everything['mean_std']), [20, 30, 40])
+        self.assertEqual(list(everything['rmse']), [0, 0, 0])
+        self.assertEqual(list(everything['rows']), [10, 10, 9])
+        self.assertEqual(
+            metrics[metrics['regime'] != 'all'].groupby('fold')['rows'].sum().tolist(),
+            [10, 10, 9]
+        )
+
+
+class ClusterFeaturesTest(PgPoolTestCase):
+
+    start_dt = dt.datetime(2017, 1, 1)
+    hours = 120
+
+    def setUp(self):
+        super(ClusterFeaturesTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.chunk_periods = clusters.CHUNK_PERIODS
+        clusters.CHUNK_PERIODS = 30  # several chunks per update
+        close, volume = random_prices(self.hours, freq='H')
+        store_quotes(long_quotes(close[['BTC-USD']], volume[['BTC-USD']]), 3600)
+        scores = np.random.RandomState(3).uniform(0, 100, self.hours)
+        StitchedInterest.objects.bulk_create([
+            StitchedInterest(
+                term='bitcoin',
+                search_terms='bitcoin',
+                dt=quote_dt.to_pydatetime(),
+                score=score,
+                scale=1.0,
+                start_dt=self.start_dt,
+                end_dt=self.start_dt + dt.timedelta(hours=self.hours)
+            )
+            for quote_dt, score in zip(close.index, scores)
+        ])
+
+    def tearDown(self):
+        clusters.CHUNK_PERIODS = self.chunk_periods
+        shutil.rmtree(self.directory)
+        super(ClusterFeaturesTest, self).tearDown()
+
+    def features(self):
+        return ClusterFeatures(
+            'test',
+            terms=['bitcoin'],
+            product_list=['BTC-USD'],
+            k=4,
+            length=6,
+            root=self.directory,
+            log_level='ERROR'
+        )
+
+    def test_update_mixes_trends_and_prices(self):
+        hour = dt.timedelta(hours=1)
+        first_dt = self.start_dt + 5 * hour
+        self.assertEqual(self.features().update(self.start_dt + 79 * hour, first_dt), 75)
+        parts = os.path.join(self.directory, 'test', 'distances')
+        stored = {
+            name: os.path.getmtime(os.path.join(parts, name))
+            for name in os.listdir(parts)
+        }
+        self.assertEqual(len(stored), 3)  # one per chunk
+        # a later run carries on from the last stored bar with the saved centroids
+        features = self.features()
+        self.assertTrue(features.clusters.fitted)
+        self.assertEqual(features.last_dt(), self.start_dt + 79 * hour)
+        self.assertEqual(features.update(self.start_dt + 119 * hour), 40)
+        # and only appends
+        self.assertEqual(
+            {name: os.path.getmtime(os.path.join(parts, name)) for name in stored},
+            stored
+        )
+        self.assertEqual(len(os.listdir(parts)), 5)
+
+        distances = features.load()
+        self.assertIsNone(distances.index.tz)
+        self.assertTrue(distances.index.equals(
+            pd.date_range(first_dt, self.start_dt + 119 * hour, freq='H')
+        ))
+        self.assertEqual(
+            list(distances.columns),
+            ['bitcoin_c{}'.format(i) for i in range(4)]
+            + ['BTC-USD_close_c{}'.format(i) for i in range(4)]
+        )
+        self.assertEqual(distances.values.dtype, np.float32)
+        self.assertTrue(np.isfinite(distances.values).all())
+
+    def test_newest_distances_win(self):
+        directory = os.path.join(self.directory, 'distances')
+        index = pd.date_range(self.start_dt, periods=15, freq='H')
+        save_distances(pd.DataFrame({'a': 1.0}, index=index[:10]), directory)
+        save_distances(pd.DataFrame({'a': 2.0}, index=index[5:]), directory)
+        distances = load_distances(directory)
+        self.assertTrue(distances.index.equals(index))
+        self.assertEqual(list(distances['a']), [1.0] * 5 + [2.0] * 10)
+        self.assertEqual(list(load_distances(directory, index[2], index[6])['a']), [1.0] * 3 + [2.0] * 2)
+        self.assertEqual(len(load_distances(directory, index[-1] + dt.timedelta(hours=1))), 0)
+
+
+class QuoteRollupTest(PgPoolTestCase):
+
+    start_dt = dt.datetime(2017, 1, 1, 7, 13, 20)  # on no rollup boundary
+    end_dt = dt.datetime(2017, 1, 3, 5)
+
+    def setUp(self):
+        super(QuoteRollupTest, self).setUp()
+        periods = int((self.end_dt - self.start_dt).total_seconds() // 20) + 1
+        close, volume = random_prices(periods, start=self.start_dt, freq='20s')
+        self.products = ['BTC-USD', 'ETH-USD']
+        self.quotes = long_quotes(close[self.products], volume[self.products], 0.01)
+        store_quotes(self.quotes, 20)
+        self.product_ids = list(Product.get_ids(self.products).values())
+
+    def refresh(self, start_dt, end_dt):
+        return QuoteRollup.refresh(self.product_ids, 20, start_dt, end_dt)
+
+    def is_complete(self, start_dt, end_dt, rollup=3600):
+        return gdax_etl.rollup_is_complete(start_dt, end_dt, rollup, 20, self.products)
+
+    def test_rollups_match_resampled_quotes(self):
+        self.assertGreater(self.refresh(self.start_dt, self.end_dt), 0)
+        for granularity in QuoteRollup.GRANULARITIES:
+            expected = gdax_etl.resample_quotes(self.quotes, granularity)
+            seconds = self.quotes['dt'].values.astype('datetime64[s]').astype(np.int64)
+            counts = self.quotes.groupby(
+                ['product', seconds - seconds % granularity]
+            ).size()
+            rollups = pd.DataFrame(
+                list(QuoteRollup.objects.filter(granularity=granularity).order_by(
+                    'dt', 'product__name'
+                ).values_list(
+                    'product__name', 'dt', 'low', 'high', 'open', 'close', 'volume', 'candles'
+                )),
+                columns=['product', 'dt'] + gdax_etl.PRICE_COLUMNS + ['candles']
+            )
+            self.assertEqual(
+                rollups[['product', 'dt']].values.tolist(),
+                expected[['product', 'dt']].values.tolist()
+            )
+            np.testing.assert_allclose(
+                rollups[gdax_etl.PRICE_COLUMNS].values,
+                expected[gdax_etl.PRICE_COLUMNS].values.astype(np.float64),
+                rtol=1e-12
+            )
+            self.assertEqual(rollups['candles'].tolist(), counts.sort_index(level=[1, 0]).tolist())
+            self.assertEqual(rollups['candles'].sum(), len(self.quotes))
+
+    def test_completeness(self):
+        middle_dt = dt.datetime(2017, 1, 2, 3, 30)
+        self.refresh(self.start_dt, middle_dt)
+        self.assertTrue(self.is_complete(self.start_dt, middle_dt))
+        # the bar holding middle_dt was refreshed whole
+        self.assertTrue(self.is_complete(self.start_dt, dt.datetime(2017, 1, 2, 3, 59)))
+        self.assertFalse(self.is_complete(self.start_dt, self.end_dt))
+        self.assertFalse(self.is_complete(middle_dt, self.end_dt, rollup=300))
+
+        self.refresh(middle_dt, self.end_dt)
+        for rollup in QuoteRollup.GRANULARITIES:
+            self.assertTrue(self.is_complete(self.start_dt, self.end_dt, rollup))
+
+        # quotes changed since the refresh leave the rollups stale
+        Quote.objects.filter(
+            dt__gte=dt.datetime(2017, 1, 2, 12),
+            dt__lt=dt.datetime(2017, 1, 2, 12, 5)
+        ).delete()
+        self.assertFalse(self.is_complete(self.start_dt, self.end_dt))
+        self.assertTrue(self.is_complete(self.start_dt, dt.datetime(2017, 1, 2, 11)))
+        self.refresh(dt.datetime(2017, 1, 2, 12), dt.datetime(2017, 1, 2, 12))
+        for rollup in QuoteRollup.GRANULARITIES:
+            self.assertTrue(self.is_complete(self.start_dt, self.end_dt, rollup))
+        self.assertFalse(QuoteRollup.objects.filter(
+            granularity=300,
+            dt=dt.datetime(2017, 1, 2, 12)
+        ).exists())
+
+
+class PriceFeaturesTest(PgPoolTestCase):
+
+    start_dt = dt.datetime(2017, 1, 1)
+
+    def candles(self, product, seconds, close):
+        close = np.asarray(close, dtype=np.float64)
+        return pd.DataFrame({
+            'product': product,
+            'dt': [self.start_dt + dt.timedelta(seconds=s) for s in seconds],
+            'low': close - 1,
+            'high': close + 1,
+            'open': close - 0.5,
+            'close': close,
+            'volume': np.ones(len(close)),
+        })
+
+    def test_resample_aligns_to_epoch(self):
+        quotes = pd.concat([
+            self.candles('BTC-USD', [40, 60, 80, 100, 120], [1, 2, 3, 4, 5]),
+            self.candles('ETH-USD', [100, 60], [7, 6]),
+        ], ignore_index=True)
+        bars = gdax_etl.resample_quotes(quotes, 60)
+        minute = dt.timedelta(minutes=1)
+        self.assertEqual(
+            bars[['dt', 'product']].values.tolist(),
+            [
+                [self.start_dt, 'BTC-USD'],
+                [self.start_dt + minute, 'BTC-USD'],
+                [self.start_dt + minute, 'ETH-USD'],
+                [self.start_dt + 2 * minute, 'BTC-USD'],
+            ]
+        )
+        np.testing.assert_array_equal(
+            bars[gdax_etl.PRICE_COLUMNS].values,
+            [
+                [0, 2, 0.5, 1, 1],
+                [1, 5, 1.5, 4, 3],  # first open, max high, min low, last close
+                [5, 8, 5.5, 7, 2],
+                [4, 6, 4.5, 5, 1],
+            ]
+        )
+
+    def test_wide_features_on_a_filled_grid(self):
+        minutes = np.arange(0, 60)
+        btc = self.candles('BTC-USD', 60 * minutes, 100 + minutes)
+        # ETH misses 00:10 to 00:25
+        eth_minutes = minutes[(minutes < 10) | (minutes >= 25)]
+        eth = self.candles('ETH-USD', 60 * eth_minutes, 10 + eth_minutes)
+        store_quotes(pd.concat([btc, eth], ignore_index=True), 60)
+        end_dt = self.start_dt + dt.timedelta(minutes=59)
+
+        features = gdax_etl.get_price_features(
+            self.start_dt,
+            end_dt,
+            granularity=300,
+            product_list=['BTC-USD', 'ETH-USD'],
+            columns=('open', 'close', 'volume'),
+            source_granularity=60,
+            fill='ffill'
+        )
+        self.assertEqual(sorted(features.columns), [
+            'BTC-USD_close', 'BTC-USD_open', 'BTC-USD_volume',
+            'ETH-USD_close', 'ETH-USD_open', 'ETH-USD_volume',
+        ])
+        # the grid runs on to 01:00, which has no quotes yet
+        self.assertTrue(features.index.equals(
+            pd.date_range(self.start_dt, periods=13, freq='5min', tz='UTC')
+        ))
+        bars = np.arange(12)
+        np.testing.assert_array_equal(
+            features['BTC-USD_close'].values,
+            np.append(104 + 5 * bars, 159)
+        )
+        np.testing.assert_array_equal(
+            features['BTC-USD_open'].values,
+            np.append(99.5 + 5 * bars, 154.5)
+        )
+        np.testing.assert_array_equal(features['BTC-USD_volume'].values, 5)
+        # the 00:10 and 00:15 bars are missing and carried forward, 00:25 starts afresh
+        np.testing.assert_array_equal(
+            features['ETH-USD_close'].values[:6],
+            [14, 19, 19, 19, 19, 39]
+        )
+
+        # read from rollups once they cover the range, with the same result
+        QuoteRollup.refresh(Product.get_ids(['BTC-USD', 'ETH-USD']).values(), 60, self.start_dt, end_dt)
+        self.assertTrue(gdax_etl.rollup_is_complete(
+            self.start_dt, end_dt, 300, 60, ['BTC-USD', 'ETH-USD']
+        ))
+        from_rollups = gdax_etl.get_price_features(
+            self.start_dt,
+            end_dt,
+            granularity=300,
+            product_list=['BTC-USD', 'ETH-USD'],
+            columns=('open', 'close', 'volume'),
+            source_granularity=60,
+            fill='ffill'
+        )
+        pd.testing.assert_frame_equal(from_rollups[features.columns], features)
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+from bin import utils
+
+
+def _score_matrix(chunks, terms, start_ts, periods, granularity):
+    """ Scatter (term, epoch, score) rows onto a dt x term float32 grid """
+    matrix = np.full((periods, len(terms)), np.nan, dtype=np.float32)
+    columns = pd.Index(terms)
+    for rows in chunks:
+        term_col, ts_col, score_col = zip(*rows)
+        ts_col = np.array(ts_col, dtype=np.int64)
+        positions = ts_col - start_ts
+        row_index = positions // granularity
+        column_index = columns.get_indexer(list(term_col))
+        keep = (positions % granularity == 0) & (row_index >= 0) \
+            & (row_index < periods) & (column_index >= 0)
+        matrix[row_index[keep], column_index[keep]] = \
+            np.array(score_col, dtype=np.float32)[keep]
+    return matrix
+
+
+def load_interest_over_time(
+        terms,
+        start_dt,
+        end_dt,
+        geo='',
+        granularity=3600,
+        search_terms=None,
+        chunk_size=utils.PG_CHUNK_SIZE
+):
+    """
+    Dense frame of Trends scores indexed by dt on a regular granularity
+    grid from start_dt, with one float32 column per term (NaN where
+    nothing was downloaded). geo '' is worldwide.
+
+    Scores are relative to the batch and window they were requested
+    with. Where several windows cover an hour the most recently
+    requested one wins; pass search_terms to read a single batch.
+    """
+    terms = list(terms)
+    batch_filter = 'and search_terms = %(search_terms)s' if search_terms else ''
+    start_ts = int(utils.dt_to_ts(start_dt))
+    periods = int((utils.dt_to_ts(end_dt) - start_ts) // granularity) + 1
+    chunks = utils.iter_pg(
+        """
+        select distinct on (term, dt)
+            term
+            , cast(extract(epoch from dt) as bigint)
+            , score
+        from trends_api_interestovertime
+        where term = any(%(terms)s)
+            and geo = %(geo)s
+            and dt >= %(start_dt)s
+            and dt <= %(end_dt)s
+            {batch_filter}
+        order by term, dt, end_dt desc, start_dt desc
+        """.format(batch_filter=batch_filter),
+        params={
+            "terms": terms,
+            "geo": geo,
+            "start_dt": start_dt,
+            "end_dt": end_dt,
+            "search_terms": search_terms
+        },
+        chunk_size=chunk_size
+    )
+    matrix = _score_matrix(chunks, terms, start_ts, periods, granularity)
+    index = pd.to_datetime(
+        start_ts + granularity * np.arange(periods, dtype=np.int64),
+        unit='s'
+    )
+    return pd.DataFrame(matrix, index=pd.Index(index, name='dt'), columns=terms)
+
+
+def load_stitched_interest(
+        terms,
+        start_dt,
+        end_dt,
+        geo='',
+        granularity=3600,
+        search_terms=None,
+        chunk_size=utils.PG_CHUNK_SIZE
+):
+    """
+    Like load_interest_over_time, but from the stitched series, so
+    scores are comparable across weeks. Each series is rebased onto its
+    newest window, whose scores keep their raw 0-100 scale. A term in
+    several batches is read from the first batch alphabetically unless
+    search_terms picks one.
+    """
+    terms = list(terms)
+    batch_filter = 'and s.search_terms = %(search_terms)s' if search_terms else ''
+    start_ts = int(utils.dt_to_ts(start_dt))
+    periods = int((utils.dt_to_ts(end_dt) - start_ts) // granularity) + 1
+    chunks = utils.iter_pg(
+        """
+        select distinct on (s.term, s.dt)
+            s.term
+            , cast(extract(epoch from s.dt) as bigint)
+            , s.score / newest.scale
+        from trends_api_stitchedinterest s
+        cross join lateral (
+            select scale
+            from trends_api_stitchedinterest n
+            where n.term = s.term
+                and n.geo = s.geo
+                and n.search_terms = s.search_terms
+            order by n.dt desc
+            limit 1
+        ) newest
+        where s.term = any(%(terms)s)
+            and s.geo = %(geo)s
+            and s.dt >= %(start_dt)s
+            and s.dt <= %(end_dt)s
+            {batch_filter}
+        order by s.term, s.dt, s.search_terms
+        """.format(batch_filter=batch_filter),
+        params={
+            "terms": terms,
+            "geo": geo,
+            "start_dt": start_dt,
+            "end_dt": end_dt,
+            "search_terms": search_terms
+        },
+        chunk_size=chunk_size
+    )
+    matrix = _score_matrix(chunks, terms, start_ts, periods, granularity)
+    index = pd.to_datetime(
+        start_ts + granularity * np.arange(periods, dtype=np.int64),
+        unit='s'
+    )
+    return pd.DataFrame(matrix, index=pd.Index(index, name='dt'), columns=terms)
@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from bin import utils
+
+LOGGER = utils.get_logger(__name__)
+COVERAGE_LEVELS = (0.5, 0.8, 0.9, 0.95)
+REGIMES = ('down', 'flat', 'up')
+
+
+class GaussianRidge(object):
+    """
+    Baseline model of FP and S: ridge regression for the mean, and a
+    second ridge on log squared residuals for a per row sigma.
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.mean_coef = None
+        self.scale_coef = None
+
+    def _ridge(self, X, y):
+        X = np.hstack([X, np.ones((len(X), 1))])
+        penalty = self.alpha * np.eye(X.shape[1])
+        penalty[-1, -1] = 0.0  # leave the intercept alone
+        return np.linalg.solve(X.T.dot(X) + penalty, X.T.dot(y))
+
+    @staticmethod
+    def _apply(coef, X):
+        return X.dot(coef[:-1]) + coef[-1]
+
+    def fit(self, X, y):
+        self.mean_coef = self._ridge(X, y)
+        residuals = y - self._apply(self.mean_coef, X)
+        self.scale_coef = self._ridge(X, np.log(residuals ** 2 + 1e-12))
+        return self
+
+    def predict(self, X):
+        """ (mean, std) per row """
+        mean = self._apply(self.mean_coef, X)
+        # E[log e^2] sits 1.27 below log var for gaussian residuals
+        std = np.sqrt(np.exp(self._apply(self.scale_coef, X) + 1.2704))
+        return mean, std
+
+
+def walk_forward_folds(n, train_size, test_size, step=None, gap=0, expanding=False):
+    """
+    (train, test) index ranges rolling forward through n rows. Test
+    rows always come after their train rows, `gap` rows apart so the
+    target horizon can't leak. expanding=True grows the train window
+    from row 0 instead of rolling it.
+    """
+    step = step or test_size
+    folds = []
+    train_start = 0
+    while train_start + train_size + gap + test_size <= n:
+        train_end = train_start + train_size
+        test_start = train_end + gap
+        folds.append((
+            (0 if expanding else train_start, train_end),
+            (test_start, test_start + test_size)
+        ))
+        train_start += step
+    return folds
+
+
+def label_regimes(close, lookback, threshold=0.0):
+    """
+    'up', 'down' or 'flat' per row by the trailing log return over
+    `lookback` rows, 'flat' within +/- threshold. NaN history is 'flat'.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    trailing = np.full(len(close), np.nan)
+    trailing[lookback:] = np.log(close[lookback:] / close[:-lookback])
+    labels = np.full(len(close), 'flat', dtype=object)
+    labels[trailing > threshold] = 'up'
+    labels[trailing < -threshold] = 'down'
+    return labels
+
+
+def asymmetric_loss(y, mean, over=2.0, under=1.0):
+    """
+    Squared error weighted `over` where the prediction was too high
+    (buying into a loss) and `under` where it was too low (a missed gain).
+    """
+    error = mean - y
+    return np.mean(np.where(error > 0, over, under) * error ** 2)
+
+
+def fold_metrics(y, mean, std, over=2.0, under=1.0):
+    """ Error, asymmetric loss and interval coverage for one set of rows """
+    metrics = {
+        'rows': len(y),
+        'rmse': np.sqrt(np.mean((mean - y) ** 2)),
+        'asymmetric_loss': asymmetric_loss(y, mean, over, under),
+        'mean_std': np.mean(std),
+    }
+    z = np.abs(y - mean) / std
+    for level in COVERAGE_LEVELS:
+        metrics['coverage_{:g}'.format(100 * level)] = np.mean(z <= norm.ppf(0.5 + level / 2))
+    return metrics
+
+
+# arrays each worker process maps from disk, set by _init_worker
+_SHARED = dict()
+
+
+def _init_worker(directory):
+    for name in ('X', 'y', 'regimes'):
+        path = os.path.join(directory, name + '.npy')
+        _SHARED[name] = np.load(path, mmap_mode='r') \
+            if os.path.exists(path) else None
+
+
+def _run_fold(task):
+    """ Fit and evaluate one fold inside a worker """
+    fold, (train, test), model_factory, over, under = task
+    X, y, regimes = _SHARED['X'], _SHARED['y'], _SHARED['regimes']
+    X_train, y_train = X[train[0]:train[1]], y[train[0]:train[1]]
+    keep = np.isfinite(y_train) & np.isfinite(X_train).all(axis=1)
+    model = model_factory().fit(X_train[keep], y_train[keep])
+
+    X_test, y_test = X[test[0]:test[1]], y[test[0]:test[1]]
+    keep = np.isfinite(y_test) & np.isfinite(X_test).all(axis=1)
+    mean, std = model.predict(X_test[keep])
+    y_test = y_test[keep]
+    groups = [('all', np.ones(len(y_test), dtype=bool))]
+    if regimes is not None:
+        test_regimes = regimes[test[0]:test[1]][keep]
+        groups += [(regime, test_regimes == regime) for regime in REGIMES]
+    rows = []
+    for regime, mask in groups:
+        if mask.any():
+            row = fold_metrics(y_test[mask], mean[mask], std[mask], over, under)
+            row.update({
+                'fold': fold,
+                'regime': regime,
+                'train_start': train[0],
+                'test_start': test[0],
+            })
+            rows.append(row)
+    return rows
+
+
+def walk_forward(
+        X,
+        y,
+        folds,
+        model_factory=GaussianRidge,
+        regimes=None,
+        processes=None,
+        over=2.0,
+        under=1.0
+):
+    """
+    Fit model_factory() on each fold's train rows and score its test
+    rows, folds running in a process pool. X, y and regimes are written
+    once to .npy files which every worker memory maps, so the feature
+    matrix is never pickled or copied per fold. model_factory must be
+    picklable and build objects with fit(X, y) and predict(X) returning
+    (mean, std). Rows with NaN are dropped per fold.
+
+    Returns a frame of metrics per fold and regime ('all', plus 'up',
+    'down' and 'flat' when regimes are given).
+    """
+    directory = tempfile.mkdtemp(prefix='walk_forward_')
+    try:
+        np.save(os.path.join(directory, 'X.npy'), np.asarray(X, dtype=np.float64))
+        np.save(os.path.join(directory, 'y.npy'), np.asarray(y, dtype=np.float64))
+        if regimes is not None:
+            np.save(
+                os.path.join(directory, 'regimes.npy'),
+                np.asarray(regimes, dtype='U8')
+            )
+        tasks = [
+            (fold, window, model_factory, over, under)
+            for fold, window in enumerate(folds)
+        ]
+        LOGGER.info("Running %s walk forward folds", len(tasks))
+        pool = Pool(processes, initializer=_init_worker, initargs=(directory,))
+        try:
+            results = pool.map(_run_fold, tasks)
+        finally:
+            pool.terminate()
+    finally:
+        shutil.rmtree(directory)
+    columns = ['fold', 'regime', 'train_start', 'test_start', 'rows', 'rmse',
+               'asymmetric_loss', 'mean_std'] \
+        + ['coverage_{:g}'.format(100 * level) for level in COVERAGE_LEVELS]
+    return pd.DataFrame([row for rows in results for row in rows], columns=columns)
+
+
+def summarize_folds(metrics):
+    """
+    Metrics averaged over folds per regime, weighted by rows. Coverage
+    near its level (eg. coverage_90 ~ 0.9) means well calibrated.
+    """
+    values = metrics.drop(['fold', 'train_start', 'test_start'], axis=1)
+    weighted = values.drop(['regime', 'rows'], axis=1).multiply(values['rows'], axis=0)
+    weighted['regime'] = values['regime']
+    weighted['rows'] = values['rows']
+    totals = weighted.groupby('regime').sum()
+    return totals.drop('rows', axis=1).divide(totals['rows'], axis=0).assign(rows=totals['rows'])
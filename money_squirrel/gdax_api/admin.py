@@ -2,6 +2,9 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
-from models import Quote
+from models import Product, Quote, QuoteJob, QuoteRollup
 
+admin.site.register(Product)
 admin.site.register(Quote)
+admin.site.register(QuoteJob)
+admin.site.register(QuoteRollup)
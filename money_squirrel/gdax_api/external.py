@@ -1,15 +1,154 @@
 import datetime as dt
-from time import sleep
+import json
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+import numpy as np
 import requests
+import pandas as pd
 import gdax
+from websocket import create_connection, WebSocketConnectionClosedException
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
 from bin import utils
-from models import Quote
+from bin.throttle import RetryError, RetryPolicy, TokenBucket
+from models import Product, Quote, QuoteJob, QuoteRollup
 
 
-class QuoteDownloader(gdax.PublicClient):
+class QuoteStore(object):
+    """
+    Bulk Quote storage shared by the REST downloader and the websocket
+    streamer. Expects self.logger, self.inserted_count, self.skipped_count
+    and a self.touched dict.
+    """
+
+    STORE_COLUMNS = (
+        "product_id",
+        "granularity",
+        "dt",
+        "low",
+        "high",
+        "open",
+        "close",
+        "volume"
+    )
+
+    def _store_postgres(self, records):
+        """
+        COPY records into a temp staging table, then merge them in one
+        INSERT, letting the unique index drop duplicates.
+        """
+        columns = ", ".join(self.STORE_COLUMNS)
+        buf = StringIO()
+        records.to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                create temp table if not exists quote_staging as
+                select {columns} from {table} with no data
+                """.format(columns=columns, table=Quote._meta.db_table)
+            )
+            cursor.execute("truncate quote_staging")
+            cursor.copy_expert(
+                "copy quote_staging ({}) from stdin with csv".format(columns),
+                buf
+            )
+            cursor.execute(
+                """
+                insert into {table} ({columns})
+                select {columns} from quote_staging
+                on conflict (product_id, granularity, dt) do nothing
+                """.format(columns=columns, table=Quote._meta.db_table)
+            )
+            return cursor.rowcount
+
+    def _store_generic(self, records):
+        """ Fallback for backends without COPY or ON CONFLICT, eg. sqlite """
+        keys = ["product_id", "granularity", "dt"]
+        existing = pd.DataFrame(
+            list(Quote.objects.filter(
+                product_id__in=records["product_id"].unique().tolist(),
+                granularity__in=records["granularity"].unique().tolist(),
+                dt__gte=records["dt"].min().to_pydatetime(),
+                dt__lte=records["dt"].max().to_pydatetime(),
+            ).values_list(*keys)),
+            columns=keys
+        )
+        records = records.drop_duplicates(keys)
+        if len(existing):
+            existing["dt"] = pd.to_datetime(existing["dt"])
+            records = records.merge(existing, on=keys, how="left", indicator=True)
+            records = records[records["_merge"] == "left_only"].drop("_merge", axis=1)
+        Quote.objects.bulk_create([
+            Quote(**datum) for datum in records.to_dict("records")
+        ])
+        return len(records)
+
+    def _store(self, records):
+        """
+        Bulk insert a frame of records, skipping those already stored.
+        Returns a tuple of (inserted, skipped) counts.
+        """
+        if not len(records):
+            return 0, 0
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                inserted = self._store_postgres(records)
+            else:
+                inserted = self._store_generic(records)
+        skipped = len(records) - inserted
+        self.inserted_count += inserted
+        self.skipped_count += skipped
+        self.logger.info(
+            "Stored %s GDAX records, skipped %s existing",
+            inserted,
+            skipped
+        )
+        return inserted, skipped
+
+    def _touch(self, records):
+        """ Widen the dt range stored per (product_id, granularity) """
+        bounds = records.groupby(["product_id", "granularity"])["dt"].agg(["min", "max"])
+        for key, (min_dt, max_dt) in bounds.iterrows():
+            if key in self.touched:
+                touched_min, touched_max = self.touched[key]
+                min_dt, max_dt = min(min_dt, touched_min), max(max_dt, touched_max)
+            self.touched[key] = (min_dt, max_dt)
+
+    def _refresh_rollups(self):
+        """ Recompute rollup bars for just the time ranges stored so far """
+        if not self.touched:
+            return
+        if connection.vendor != "postgresql":
+            self.logger.info("Skipping rollups, they need postgres")
+            return
+        written = 0
+        for (product_id, granularity), (min_dt, max_dt) in self.touched.items():
+            written += QuoteRollup.refresh(
+                [int(product_id)],
+                int(granularity),
+                min_dt.to_pydatetime(),
+                max_dt.to_pydatetime()
+            )
+        self.touched = dict()
+        self.logger.info("Refreshed %s rollup bars", written)
+
+
+class QuoteDownloader(QuoteStore, gdax.PublicClient):
 
     RECORD_LIMIT = 200
-    RATE_LIMIT_SLEEP = 2  # limit 3 requests/sec, so being conservative
+    RATE_LIMIT = 3  # public endpoints allow 3 requests/sec
+    WORKERS = 4
+    MAX_ATTEMPTS = 5  # per (product, window) before it is marked failed
+    TIMEOUT = 30
+    # GDAX omits candles for periods without trades, so only holes
+    # longer than this many candles count as missing when syncing
+    GAP_TOLERANCE = 10
+    STORE_BUFFER = 1000  # records held in memory before a bulk insert
     DATA_KEYS = [
         "timestamp",  # storing everything but this
         "low",
@@ -19,63 +158,354 @@ class QuoteDownloader(gdax.PublicClient):
         "volume"
     ]
 
-    def __init__(self, log_level='INFO'):
-        gdax.PublicClient.__init__(self)
+    def __init__(
+            self,
+            log_level='INFO',
+            workers=WORKERS,
+            rate=RATE_LIMIT,
+            api_url='https://api.gdax.com',
+            candle_store=None,
+            store_db=True
+    ):
+        """
+        candle_store: optional etl.candle_store.CandleStore also (or,
+        with store_db=False, only) receiving downloaded candles.
+        """
+        gdax.PublicClient.__init__(self, api_url=api_url)
+        self.candle_store = candle_store
+        self.store_db = store_db
+        self.workers = workers
+        self.rate_limiter = TokenBucket(rate)
+        self.session = requests.Session()
         self.start_dt = None
         self.end_dt = None
-        self.granularity = None
+        self.product_ids = dict()
+        self.product_names = dict()
+        self.buffer = []
+        self.buffer_jobs = []
+        self.touched = dict()
+        self.inserted_count = 0
+        self.skipped_count = 0
         self.logger = utils.get_logger(__name__, log_level)
+        self.retry_policy = RetryPolicy(
+            max_attempts=self.MAX_ATTEMPTS,
+            retry_on=(
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                ValueError  # truncated JSON bodies
+            ),
+            rate_limiter=self.rate_limiter,
+            logger=self.logger
+        )
+
+    def _get_candles(self, payload):
+        """
+        Like get_product_historic_rates, but raises on HTTP errors
+        (keeping the response, eg. for Retry-After) instead of
+        returning the error message as data.
+        """
+        response = self.session.get(
+            "{}/products/{}/candles".format(self.url, payload["product_id"]),
+            params={
+                "start": payload["start"],
+                "end": payload["end"],
+                "granularity": payload["granularity"],
+            },
+            timeout=self.TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
 
-    def _validate_response(self, response):
+    def _validate_response(self, response, payload=None):
+        """
+        Check shape and types of a whole response, returning a 2d array.
+        Candles must be consistent (low <= open, close <= high and volume
+        >= 0) and, given the request payload, start within its window.
+        """
         try:
             assert type(response) is list
-            for record in response:
-                assert type(record) is list
-                assert len(record) is len(self.DATA_KEYS)
-        except AssertionError as e:
+            candles = np.array(response, dtype=np.float64, ndmin=2)
+            if candles.size == 0:
+                candles = candles.reshape(0, len(self.DATA_KEYS))
+            assert candles.ndim == 2
+            assert candles.shape[1] == len(self.DATA_KEYS)
+            assert np.isfinite(candles).all()
+            ts, low, high, open_, close, volume = candles.T
+            assert (low <= np.minimum(open_, close)).all()
+            assert (high >= np.maximum(open_, close)).all()
+            assert (volume >= 0).all()
+            if payload is not None:
+                start_ts = utils.dt_to_ts(utils.parse_dt_str(payload["start"]))
+                end_ts = utils.dt_to_ts(utils.parse_dt_str(payload["end"]))
+                start_ts -= start_ts % payload["granularity"]
+                assert ((ts >= start_ts) & (ts <= end_ts)).all()
+        except (AssertionError, TypeError, ValueError):
             self.logger.critical(
                 "GDAX response failed validation:\n%s",
                 response
             )
-            raise e
+            raise AssertionError("GDAX response failed validation")
+        return candles
 
     def _download_and_clean(self, payload):
-        new_data = self.get_product_historic_rates(
-            **payload
-        )
+        """ Parse a response into a frame with STORE_COLUMNS in one go """
+        new_data = self._get_candles(payload)
         self.logger.info("Validating response")
-        self._validate_response(new_data)
-        new_data = [
-            {
-                self.DATA_KEYS[i]: datum[i]
-                for i in range(len(self.DATA_KEYS))
+        candles = self._validate_response(new_data, payload)
+        frame = pd.DataFrame(candles[:, 1:], columns=self.DATA_KEYS[1:])
+        # GDAX timestamps are epoch seconds; store as naive UTC
+        frame["dt"] = pd.to_datetime(candles[:, 0].astype(np.int64), unit="s")
+        frame["product_id"] = self.product_ids[payload["product_id"]]
+        frame["granularity"] = payload["granularity"]
+        return frame[list(self.STORE_COLUMNS)]
+
+    def _flush(self, force=False):
+        """ Store buffered frames and mark their jobs done together """
+        if not (self.buffer or self.buffer_jobs):
+            return
+        buffered = sum(len(frame) for frame in self.buffer)
+        if force or buffered >= self.STORE_BUFFER:
+            frames, self.buffer = self.buffer, []
+            jobs, self.buffer_jobs = self.buffer_jobs, []
+            with transaction.atomic():
+                if frames:
+                    records = pd.concat(frames, ignore_index=True)
+                    if self.store_db:
+                        self._store(records)
+                        self._touch(records)
+                    if self.candle_store is not None:
+                        self.candle_store.write(records.assign(
+                            product=records["product_id"].map(self.product_names)
+                        ))
+                for job_ids, row_count in jobs:
+                    for job_id in job_ids:
+                        QuoteJob.mark_done(job_id, row_count)
+
+    def _windows(self, start_dt, end_dt, granularity):
+        """
+        Split a time range into windows of RECORD_LIMIT candles.
+        Windows are aligned to the epoch so they line up with ledger
+        entries from earlier runs over overlapping ranges; the last one
+        is clipped to end_dt.
+        """
+        window = dt.timedelta(seconds=granularity * self.RECORD_LIMIT)
+        offset = (
+            start_dt.replace(tzinfo=None) - dt.datetime(1970, 1, 1)
+        ).total_seconds() % window.total_seconds()
+        current_dt = start_dt - dt.timedelta(seconds=offset)
+        while current_dt < end_dt:
+            yield current_dt, min(current_dt + window, end_dt)
+            current_dt += window
+
+    @property
+    def sinks(self):
+        """ Ledger sinks this downloader writes to """
+        sinks = [QuoteJob.DB] if self.store_db else []
+        if self.candle_store is not None:
+            sinks.append(QuoteJob.PARQUET)
+        return sinks
+
+    def _jobs(self, windows, granularity, failed_only=False, refill=False):
+        """
+        Match (product_id, start_dt, end_dt) windows against the ledger
+        of every sink written to. Closed windows get a QuoteJob per sink,
+        created if needed; windows still in the future are downloaded
+        without one. Returns (job_ids, window) for every window which
+        isn't done in all sinks yet, or was done for a shorter (clipped)
+        range. refill=True downloads done windows again, eg. to fill
+        gaps found in the stored quotes.
+        """
+        now = dt.datetime.utcnow()
+        closed = [w for w in windows if w[2] <= now]
+        sinks = self.sinks
+
+        def get_ledger():
+            if not closed:
+                return dict()
+            return {
+                (product_id, sink, start_dt): (job_id, status, end_dt)
+                for product_id, sink, start_dt, job_id, status, end_dt
+                in QuoteJob.objects.filter(
+                    product_id__in=set(self.product_ids.values()),
+                    granularity=granularity,
+                    sink__in=sinks,
+                    start_dt__gte=min(w[1] for w in closed),
+                    start_dt__lte=max(w[1] for w in closed),
+                ).values_list('product_id', 'sink', 'start_dt', 'id', 'status', 'end_dt')
             }
-            for datum in new_data
+
+        ledger = get_ledger()
+        new_jobs = [
+            QuoteJob(
+                product_id=self.product_ids[product_id],
+                granularity=granularity,
+                sink=sink,
+                start_dt=start_dt,
+                end_dt=end_dt
+            )
+            for product_id, start_dt, end_dt in closed
+            for sink in sinks
+            if (self.product_ids[product_id], sink, start_dt) not in ledger
         ]
-        for datum in new_data:
-            datum['dt'] = dt.datetime.fromtimestamp(datum['timestamp'])
-            datum.update({
-                'product_id': payload["product_id"],
-                'granularity': payload["granularity"],
-            })
-            del datum['timestamp']
-        return new_data
+        if new_jobs:
+            QuoteJob.objects.bulk_create(new_jobs)
+            ledger = get_ledger()
 
-    def _store(self, records):
+        jobs = []
+        done_count = 0
+        for window in windows:
+            entries = [
+                ledger[(self.product_ids[window[0]], sink, window[1])]
+                for sink in sinks
+                if (self.product_ids[window[0]], sink, window[1]) in ledger
+            ]
+            statuses = set(status for _, status, _ in entries)
+            job_ids = tuple(job_id for job_id, _, _ in entries)
+            complete = all(end_dt >= window[2] for _, _, end_dt in entries)
+            if entries and statuses == {QuoteJob.DONE} and complete and not refill:
+                done_count += 1
+            elif QuoteJob.FAILED in statuses or not failed_only or not complete:
+                if not complete:
+                    QuoteJob.objects.filter(pk__in=job_ids).update(end_dt=window[2])
+                jobs.append((job_ids, window))
+        self.logger.info(
+            "Ledger: %s windows already done, %s to download",
+            done_count,
+            len(jobs)
+        )
+        return jobs
 
-        for datum in records:
-            price_record, created = Quote.objects.get_or_create(**datum)
-            if created:
-                self.logger.debug(
-                    "Storing GDAX Historical price %s",
-                    price_record
-                )
-                price_record.save()
+    def _gaps_postgres(self, product_id, granularity, start_dt, end_dt):
+        """ Compare each quote with the next in one pass on the server """
+        query = """
+            select dt
+                , next_dt
+            from (
+                select dt
+                    , lead(dt) over (order by dt) as next_dt
+                from {table}
+                where product_id = %s
+                    and granularity = %s
+                    and dt >= %s
+                    and dt <= %s
+            ) q
+            where next_dt > dt + %s * interval '1 second'
+            order by dt
+        """.format(table=Quote._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(query, [
+                product_id,
+                granularity,
+                start_dt,
+                end_dt,
+                granularity * self.GAP_TOLERANCE
+            ])
+            return cursor.fetchall()
+
+    def _gaps_generic(self, product_id, granularity, start_dt, end_dt):
+        """ Fallback for backends without interval arithmetic, eg. sqlite """
+        tolerance = dt.timedelta(seconds=granularity * self.GAP_TOLERANCE)
+        dts = Quote.objects.filter(
+            product_id=product_id,
+            granularity=granularity,
+            dt__gte=start_dt,
+            dt__lte=end_dt
+        ).order_by('dt').values_list('dt', flat=True)
+        gaps = []
+        last_dt = None
+        for next_dt in dts.iterator():
+            if last_dt is not None and next_dt - last_dt > tolerance:
+                gaps.append((last_dt, next_dt))
+            last_dt = next_dt
+        return gaps
+
+    def _gaps(self, product_id, granularity, start_dt, end_dt):
+        """ Holes between consecutive stored quotes as (last_dt, next_dt) """
+        if connection.vendor == "postgresql":
+            return self._gaps_postgres(product_id, granularity, start_dt, end_dt)
+        return self._gaps_generic(product_id, granularity, start_dt, end_dt)
+
+    def coverage(
+            self,
+            start_dt,
+            end_dt,
+            granularity=20,
+            product_list=utils.PRODUCT_LIST
+    ):
+        """
+        Report stored quotes per product within [start_dt, end_dt] and the
+        time ranges which still need downloading.
+        """
+        product_ids = Product.get_ids(product_list)
+        tolerance = dt.timedelta(seconds=granularity * self.GAP_TOLERANCE)
+        expected = int((end_dt - start_dt).total_seconds() // granularity) + 1
+        report = []
+        for product in product_list:
+            stats = Quote.objects.filter(
+                product_id=product_ids[product],
+                granularity=granularity,
+                dt__gte=start_dt,
+                dt__lte=end_dt
+            ).aggregate(
+                candles=Count('id'),
+                first_dt=Min('dt'),
+                last_dt=Max('dt')
+            )
+            if not stats['candles']:
+                missing = [(start_dt, end_dt)]
             else:
-                self.logger.debug(
-                    "Record already exists: %s",
-                    price_record
-                )
+                missing = [
+                    (last_dt + dt.timedelta(seconds=granularity), next_dt)
+                    for last_dt, next_dt in self._gaps(
+                        product_ids[product],
+                        granularity,
+                        start_dt,
+                        end_dt
+                    )
+                ]
+                if stats['first_dt'] - start_dt > tolerance:
+                    missing.insert(0, (start_dt, stats['first_dt']))
+                if end_dt - stats['last_dt'] > tolerance:
+                    missing.append(
+                        (stats['last_dt'] + dt.timedelta(seconds=granularity), end_dt)
+                    )
+            report.append({
+                "product_id": product,
+                "candles": stats['candles'],
+                "expected": expected,
+                "coverage": float(stats['candles']) / expected,
+                "gaps": len(missing),
+                "missing_seconds": sum(
+                    (gap_end - gap_start).total_seconds()
+                    for gap_start, gap_end in missing
+                ),
+                "missing": missing,
+            })
+        return pd.DataFrame(
+            report,
+            columns=[
+                "product_id",
+                "candles",
+                "expected",
+                "coverage",
+                "gaps",
+                "missing_seconds",
+                "missing"
+            ]
+        )
+
+    def _fetch(self, job):
+        """
+        Runs in a worker thread: download and parse a single window,
+        retrying just this window with backoff on transient errors.
+        Returns (job, records, error) so failures reach the main thread.
+        """
+        _, request_payload = job
+        self.logger.info("Loading from GDAX:  %s", request_payload)
+        try:
+            return job, self.retry_policy.call(self._download_and_clean, request_payload), None
+        except RetryError as e:
+            return job, None, e
 
     def run(
             self,
@@ -83,53 +513,310 @@ class QuoteDownloader(gdax.PublicClient):
             end_dt,
             granularity=20,
             product_list=utils.PRODUCT_LIST,
-            max_failures=10
+            max_failures=10,
+            sync=False,
+            failed_only=False
     ):
-        """ Download historical prices """
+        """
+        Download historical prices.
+        (product, window) requests are fanned out to a thread pool sharing
+        one rate limiter, while this thread stores results as they arrive.
+        Each window is retried with backoff; after max_failures windows
+        exhaust their retries the run aborts.
+        With sync=True only ranges missing from the DB are requested,
+        even where the ledger has them done.
+        Progress is kept in the QuoteJob ledger so an aborted run resumes
+        where it stopped; failed_only=True retries just the failed windows.
+        """
         self.start_dt = start_dt
         self.end_dt = end_dt
-        self.granularity = granularity
-        current_dt = start_dt
-        next_dt = min(
-            current_dt + dt.timedelta(
-                seconds=granularity * self.RECORD_LIMIT
-            ),
-            end_dt
+        self.product_ids = Product.get_ids(product_list)
+        self.product_names = {v: k for k, v in self.product_ids.items()}
+        self.touched = dict()
+        self.inserted_count = 0
+        self.skipped_count = 0
+        if sync:
+            report = self.coverage(start_dt, end_dt, granularity, product_list)
+            self.logger.info(
+                "Coverage before sync:\n%s",
+                report.drop('missing', axis=1).to_string(index=False)
+            )
+            ranges = [
+                (row.product_id, gap_start, gap_end)
+                for row in report.itertuples()
+                for gap_start, gap_end in row.missing
+            ]
+        else:
+            ranges = [
+                (product_id, start_dt, end_dt)
+                for product_id in product_list
+            ]
+        windows = []
+        for product_id, range_start, range_end in ranges:
+            for window_start, window_end in self._windows(range_start, range_end, granularity):
+                # neighbouring gaps can clip the same window differently
+                if windows and windows[-1][:2] == (product_id, window_start):
+                    windows[-1] = (product_id, window_start, max(windows[-1][2], window_end))
+                else:
+                    windows.append((product_id, window_start, window_end))
+        pending = [
+            (
+                job_ids,
+                {
+                    "product_id": product_id,
+                    "start": window_start.strftime(utils.ISO),
+                    "end": window_end.strftime(utils.ISO),
+                    "granularity": granularity,
+                }
+            )
+            for job_ids, (product_id, window_start, window_end)
+            in self._jobs(windows, granularity, failed_only, refill=sync)
+        ]
+        self.logger.info(
+            "Scheduling %s GDAX requests on %s workers",
+            len(pending),
+            self.workers
         )
         failure_count = 0
-        while current_dt < end_dt:
-            try:
-                for product_id in product_list:
-                    sleep(self.RATE_LIMIT_SLEEP)
-                    request_payload = {
-                        "product_id": product_id,
-                        "start": current_dt.strftime(utils.ISO),
-                        "end": next_dt.strftime(utils.ISO),
-                        "granularity": granularity,
-                    }
-                    self.logger.info(
-                        "Loading from GDAX:  %s",
-                        request_payload
-                    )
-                    new_data = self._download_and_clean(request_payload)
-                    self._store(new_data)
-                current_dt = next_dt
-                next_dt = min(
-                    current_dt + dt.timedelta(
-                        seconds=granularity * self.RECORD_LIMIT
-                    ),
-                    end_dt
-                )
-            except (requests.exceptions.ConnectionError, ValueError) as e:
+        pool = ThreadPool(self.workers)
+        try:
+            for job, new_data, error in pool.imap_unordered(self._fetch, pending):
+                job_ids = job[0]
+                if error is None:
+                    self.buffer.append(new_data)
+                    self.buffer_jobs.append((job_ids, len(new_data)))
+                    self._flush()
+                    continue
+                for job_id in job_ids:
+                    QuoteJob.mark_failed(job_id, error)
                 failure_count += 1
                 self.logger.warn(
-                    "HTTP Connection failure. Failure count: {}. Error message: {}"
-                    .format(failure_count, str(e))
+                    "Window failed. Failure count: {}. Error message: {}"
+                    .format(failure_count, str(error))
                 )
-                sleep(60)
                 if failure_count >= max_failures:
                     raise RuntimeError(
-                        "{} HTTP connection errors. Aborting."
+                        "{} windows failed. Aborting."
                         .format(max_failures)
                     )
-        self.logger.info("GDAX finished downloading")
+        finally:
+            pool.terminate()
+            self._flush(force=True)
+            self._refresh_rollups()
+        self.logger.info(
+            "GDAX finished downloading. Inserted %s records, skipped %s",
+            self.inserted_count,
+            self.skipped_count
+        )
+
+
+class CandleAggregator(object):
+    """
+    Builds OHLCV candles from websocket match (trade) messages.
+    A bucket closes once a trade arrives `grace` seconds past its end.
+    Buckets already underway when the first trade arrived are dropped
+    rather than stored partial, as are trades for buckets already closed.
+    """
+
+    def __init__(self, granularities=(20, 60), grace=2):
+        self.granularities = list(granularities)
+        self.grace = grace
+        # (product, granularity, bucket ts) -> [low, high, open, close, volume]
+        self.candles = dict()
+        self.started_ts = None
+        self.latest_ts = None
+        self.match_count = 0
+        self.late_count = 0
+
+    def _closed(self, granularity, bucket):
+        return bucket + granularity + self.grace <= self.latest_ts
+
+    def add(self, message):
+        """ Fold one message in. Returns False for anything but a match """
+        if message.get("type") != "match":
+            return False
+        ts = utils.dt_to_ts(utils.parse_dt_str(message["time"]))
+        price = float(message["price"])
+        size = float(message["size"])
+        if self.started_ts is None:
+            self.started_ts = ts
+        self.latest_ts = ts if self.latest_ts is None else max(self.latest_ts, ts)
+        self.match_count += 1
+        for granularity in self.granularities:
+            bucket = int(ts - ts % granularity)
+            if self._closed(granularity, bucket):
+                self.late_count += 1
+                continue
+            key = (message["product_id"], granularity, bucket)
+            candle = self.candles.get(key)
+            if candle is None:
+                self.candles[key] = [price, price, price, price, size]
+            else:
+                candle[0] = min(candle[0], price)
+                candle[1] = max(candle[1], price)
+                candle[3] = price
+                candle[4] += size
+        return True
+
+    def pop_closed(self):
+        """
+        Remove and return closed candles as a frame of product,
+        granularity, dt and price columns.
+        """
+        closed = []
+        if self.latest_ts is not None:
+            closed = [
+                key for key in self.candles
+                if self._closed(key[1], key[2])
+            ]
+        rows = []
+        for key in closed:
+            candle = self.candles.pop(key)
+            if key[2] >= self.started_ts:
+                rows.append(key + tuple(candle))
+        frame = pd.DataFrame(
+            rows,
+            columns=["product", "granularity", "ts", "low", "high", "open", "close", "volume"]
+        )
+        frame["dt"] = pd.to_datetime(frame.pop("ts"), unit="s")
+        return frame
+
+
+class QuoteStreamer(QuoteStore, gdax.WebsocketClient):
+    """
+    Live candles from the GDAX websocket matches channel. Trades are
+    aggregated in memory and closed candles are written in micro batches
+    through the same bulk path as QuoteDownloader, refreshing rollups
+    for just what was written.
+
+    Each connection starts a fresh aggregator, so candles spanning a
+    disconnect are dropped instead of stored incomplete; fill those with
+    download_gdax --sync. Raw messages can be recorded to a JSON lines
+    file and replayed offline through the same path with replay().
+    """
+
+    FLUSH_INTERVAL = 10  # seconds between micro batch writes
+    FLUSH_SIZE = 1000  # closed candles which trigger an early write
+
+    def __init__(
+            self,
+            product_list=utils.PRODUCT_LIST,
+            granularities=(20, 60),
+            log_level='INFO',
+            url='wss://ws-feed.gdax.com',
+            flush_interval=FLUSH_INTERVAL,
+            record_path=None
+    ):
+        gdax.WebsocketClient.__init__(self, url=url, products=list(product_list))
+        self.granularities = list(granularities)
+        self.flush_interval = flush_interval
+        self.record_path = record_path
+        self.record_file = None
+        self.product_ids = Product.get_ids(product_list)
+        self.aggregator = CandleAggregator(self.granularities)
+        self.pending = []
+        self.last_flush = default_timer()
+        self.touched = dict()
+        self.inserted_count = 0
+        self.skipped_count = 0
+        self.error = None
+        self.logger = utils.get_logger(__name__, log_level)
+
+    def _connect(self):
+        # gdax 1.0.6 subscribes without channels, which gets the full feed
+        self.ws = create_connection(self.url.rstrip("/"))
+        self.stop = False
+        self.ws.send(json.dumps({
+            "type": "subscribe",
+            "product_ids": self.products,
+            "channels": ["matches"]
+        }))
+
+    def _listen(self):
+        # gdax 1.0.6 never calls on_close from the listener thread
+        try:
+            gdax.WebsocketClient._listen(self)
+        finally:
+            self.on_close()
+
+    def close(self):
+        """
+        Stop streaming. The listener thread writes what is left as it
+        exits; without a running listener the final write happens here.
+        """
+        self.stop = True
+        try:
+            if self.ws:
+                self.ws.close()
+        except WebSocketConnectionClosedException:
+            pass
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        else:
+            self.on_close()
+
+    def on_open(self):
+        self.aggregator = CandleAggregator(self.granularities)
+        self.last_flush = default_timer()
+        if self.record_path:
+            self.record_file = open(self.record_path, "a")
+        self.logger.info("Streaming %s from %s", ", ".join(self.products), self.url)
+
+    def on_message(self, msg):
+        if self.record_file is not None:
+            self.record_file.write(json.dumps(msg) + "\n")
+        if msg.get("type") == "error":
+            self.logger.warn("GDAX error message: %s", msg.get("message"))
+            return
+        if self.aggregator.add(msg):
+            self._flush()
+
+    def on_error(self, e, data=None):
+        if self.stop:
+            return  # the socket was closed on purpose
+        self.error = e
+        self.stop = True
+        self.logger.error("Websocket error: %s", e)
+
+    def on_close(self):
+        self._flush(force=True)
+        if self.record_file is not None:
+            self.record_file.close()
+            self.record_file = None
+        connection.close()  # release this thread's DB connection
+        self.logger.info(
+            "Stream closed. Inserted %s candles, skipped %s, dropped %s late trades",
+            self.inserted_count,
+            self.skipped_count,
+            self.aggregator.late_count
+        )
+
+    def _flush(self, force=False):
+        """ Write closed candles once the interval or batch size is reached """
+        closed = self.aggregator.pop_closed()
+        if len(closed):
+            self.pending.append(closed)
+        buffered = sum(len(frame) for frame in self.pending)
+        due = default_timer() - self.last_flush >= self.flush_interval
+        if not buffered or not (force or due or buffered >= self.FLUSH_SIZE):
+            return
+        frames, self.pending = self.pending, []
+        self.last_flush = default_timer()
+        records = pd.concat(frames, ignore_index=True)
+        records["product_id"] = records["product"].map(self.product_ids)
+        records = records[list(self.STORE_COLUMNS)]
+        with transaction.atomic():
+            self._store(records)
+            self._touch(records)
+        self._refresh_rollups()
+
+    def replay(self, path):
+        """ Feed a recorded JSON lines file through the live code path """
+        self.on_open()
+        try:
+            with open(path) as messages:
+                for line in messages:
+                    if line.strip():
+                        self.on_message(json.loads(line))
+        finally:
+            self.on_close()
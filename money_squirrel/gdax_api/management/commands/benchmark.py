@@ -0,0 +1,447 @@
+import datetime as dt
+import json
+import os
+import pickle
+import resource
+import sys
+import threading
+from time import sleep
+from timeit import default_timer
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from etl import backtest as backtest_etl
+from etl import gdax as gdax_etl
+from gdax_api.external import QuoteDownloader
+from gdax_api.models import Product, Quote
+from bin import utils
+
+
+class Rollback(Exception):
+    """ Raised to throw away synthetic benchmark data """
+
+
+def time_call(func, repeat):
+    """ Best wall clock time of `repeat` calls, in milliseconds """
+    timings = []
+    for _ in range(repeat):
+        start = default_timer()
+        func()
+        timings.append(default_timer() - start)
+    return 1000 * min(timings)
+
+
+def measure_in_child(func):
+    """
+    Call func in a forked child, since ru_maxrss only ever grows and
+    would hide the peak of every call after the largest. Returns func's
+    (picklable) result, seconds taken and how far the child's peak
+    resident memory rose above where it started, in MB. Pooled
+    connections are closed first so the child opens its own.
+    """
+    utils.close_pg_pools()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = default_timer()
+            result = func()
+            elapsed = default_timer() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+            # kilobytes on Linux, bytes on macOS
+            peak *= 1 if sys.platform == 'darwin' else 1024
+            payload = (result, elapsed, peak / 1e6, None)
+        except Exception as e:
+            payload = (None, None, None, repr(e))
+        try:
+            with os.fdopen(write_fd, 'wb') as f:
+                pickle.dump(payload, f)
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as f:
+        result, elapsed, peak, error = pickle.load(f)
+    os.waitpid(pid, 0)
+    if error is not None:
+        raise RuntimeError("Benchmark child failed: {}".format(error))
+    return result, elapsed, peak
+
+
+def generate_quotes(size, granularity, start_dt):
+    """
+    Insert `size` synthetic quotes spread over BENCH-* products,
+    server side. Returns the {name: id} map of the products used.
+    """
+    product_ids = Product.get_ids(
+        ['BENCH-{}'.format(i) for i in range(len(utils.PRODUCT_LIST))]
+    )
+    per_product = size // len(product_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            insert into {table}
+                (product_id, granularity, dt, low, high, open, close, volume)
+            select p.id
+                , %s
+                , %s + n * interval '1 second' * %s
+                , 1, 1, 1, 1, 1
+            from generate_series(0, %s - 1) n
+            cross join unnest(%s) p(id)
+            """.format(table=Quote._meta.db_table),
+            [granularity, start_dt, granularity, per_product,
+             list(product_ids.values())]
+        )
+        cursor.execute("analyze {}".format(Quote._meta.db_table))
+    return product_ids
+
+
+def bench_quote_index(sizes, repeat, logger):
+    """
+    Point lookups and range scans on gdax_api_quote holding `size` rows.
+    Synthetic quotes are generated inside a transaction which is
+    rolled back afterwards.
+    """
+    sizes = sizes or [1000000, 10000000]
+    granularity = 60
+    start_dt = dt.datetime(2017, 1, 1)
+    results = []
+    for size in sizes:
+        try:
+            with transaction.atomic():
+                logger.info("Generating %s synthetic quotes", size)
+                product_ids = generate_quotes(size, granularity, start_dt)
+                per_product = size // len(product_ids)
+                product_id = product_ids['BENCH-0']
+                mid_dt = start_dt + dt.timedelta(
+                    seconds=granularity * (per_product // 2)
+                )
+                queries = {
+                    "point lookup": Quote.objects.filter(
+                        product_id=product_id,
+                        granularity=granularity,
+                        dt=mid_dt
+                    ),
+                    "1 day range, 1 product": Quote.objects.filter(
+                        product_id=product_id,
+                        granularity=granularity,
+                        dt__gte=mid_dt,
+                        dt__lt=mid_dt + dt.timedelta(days=1)
+                    ),
+                    "1 day range, all products": Quote.objects.filter(
+                        granularity=granularity,
+                        dt__gte=mid_dt,
+                        dt__lt=mid_dt + dt.timedelta(days=1)
+                    ),
+                }
+                for name, queryset in queries.items():
+                    results.append({
+                        "rows": size,
+                        "query": name,
+                        "ms": time_call(lambda: list(queryset.all()), repeat),
+                    })
+                raise Rollback
+        except Rollback:
+            pass
+    return pd.DataFrame(results)
+
+
+def bench_quote_loader(sizes, repeat, logger):
+    """
+    Peak resident memory and time loading quotes with utils.query_pg
+    versus the chunked etl.gdax.load_quotes, each in a forked child.
+    The loaders use their own connections, so synthetic quotes and
+    products are committed and deleted after.
+    """
+    sizes = sizes or [1000000]
+    granularity = 20
+    start_dt = dt.datetime(2017, 1, 1)
+    results = []
+    for size in sizes:
+        logger.info("Generating %s synthetic quotes", size)
+        product_ids = generate_quotes(size, granularity, start_dt)
+        end_dt = start_dt + dt.timedelta(
+            seconds=granularity * size // len(product_ids)
+        )
+        loaders = {
+            "query_pg": lambda: utils.query_pg(
+                """
+                select p.name as product, q.dt, q.low, q.high, q.open, q.close, q.volume
+                from gdax_api_quote q
+                join gdax_api_product p on p.id = q.product_id
+                where q.granularity = %(granularity)s
+                    and p.name = any(%(product_list)s)
+                    and q.dt >= %(start_dt)s
+                    and q.dt <= %(end_dt)s
+                """,
+                params={
+                    "granularity": granularity,
+                    "product_list": list(product_ids),
+                    "start_dt": start_dt,
+                    "end_dt": end_dt
+                }
+            ),
+            "load_quotes": lambda: gdax_etl.load_quotes(
+                start_dt, end_dt, granularity, list(product_ids)
+            ),
+        }
+        try:
+            for name, loader in loaders.items():
+                frame_mb, elapsed, peak_mb = measure_in_child(
+                    lambda: loader().memory_usage(deep=True).sum() / 1e6
+                )
+                results.append({
+                    "rows": size,
+                    "loader": name,
+                    "seconds": elapsed,
+                    "peak MB": peak_mb,
+                    "frame MB": frame_mb,
+                })
+        finally:
+            Quote.objects.filter(product_id__in=product_ids.values()).delete()
+            Product.objects.filter(id__in=product_ids.values()).delete()
+    return pd.DataFrame(results)
+
+
+class StubCandleHandler(BaseHTTPRequestHandler):
+    """ Serves synthetic GDAX candles after a fixed delay """
+
+    LATENCY = 0.25
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        start_ts = utils.dt_to_ts(utils.parse_dt_str(params['start'][0]))
+        end_ts = utils.dt_to_ts(utils.parse_dt_str(params['end'][0]))
+        granularity = int(params['granularity'][0])
+        candles = [
+            [int(ts), 1.0, 1.0, 1.0, 1.0, 1.0]
+            for ts in range(int(end_ts), int(start_ts), -granularity)
+        ]
+        sleep(self.LATENCY)
+        body = json.dumps(candles).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def bench_download(sizes, repeat, logger):
+    """
+    QuoteDownloader throughput against a local stub of the GDAX API.
+    Sizes are worker counts, compared to the old serial loop which slept
+    2 seconds per request. Each configuration runs once (repeat is
+    ignored) and stored quotes are rolled back.
+    """
+    sizes = sizes or [1, 2, 4, 8]
+    configs = [("serial (old)", 1, 0.5)] + [
+        ("{} workers".format(workers), workers, QuoteDownloader.RATE_LIMIT)
+        for workers in sizes
+    ]
+    server = StubServer(('127.0.0.1', 0), StubCandleHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    api_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    end_dt = dt.datetime(2017, 1, 2)
+    start_dt = end_dt - dt.timedelta(minutes=6 * QuoteDownloader.RECORD_LIMIT)
+    results = []
+    try:
+        for name, workers, rate in configs:
+            downloader = QuoteDownloader(
+                'WARNING',
+                workers=workers,
+                rate=rate,
+                api_url=api_url
+            )
+            try:
+                with transaction.atomic():
+                    start = default_timer()
+                    downloader.run(start_dt, end_dt, granularity=60)
+                    elapsed = default_timer() - start
+                    raise Rollback
+            except Rollback:
+                pass
+            requests_made = len(utils.PRODUCT_LIST) * len(list(
+                downloader._windows(start_dt, end_dt, 60)
+            ))
+            results.append({
+                "config": name,
+                "requests": requests_made,
+                "seconds": elapsed,
+                "requests/sec": requests_made / elapsed,
+                "quotes": downloader.inserted_count,
+            })
+    finally:
+        server.shutdown()
+    return pd.DataFrame(results)
+
+
+def fill_dt_gaps_loop(df, start_dt, end_dt, window_seconds):
+    """ The original per-element fill_dt_gaps, kept for comparison """
+    start_ts = float(start_dt.strftime('%s'))
+    end_ts = float(end_dt.strftime('%s'))
+    ts_range = [start_ts]
+    while ts_range[-1] < end_ts:
+        ts_range.append(ts_range[-1] + window_seconds)
+    df.index = [float(t.strftime('%s')) for t in df.index]
+    df = df.merge(
+        pd.DataFrame(index=ts_range),
+        left_index=True,
+        right_index=True,
+        how='right'
+    )
+    df.index = [utils.ts_to_dt(t) for t in df.index]
+    return df
+
+
+def bench_fill_dt_gaps(sizes, repeat, logger):
+    """
+    fill_dt_gaps against the original loop on `size` 20 second steps
+    with 10% of rows missing. The default top size is a year.
+    """
+    sizes = sizes or [10000, 100000, 1576800]
+    window_seconds = 20
+    start_dt = dt.datetime(2017, 1, 1)
+    random = np.random.RandomState(0)
+    results = []
+    for size in sizes:
+        end_dt = start_dt + dt.timedelta(seconds=window_seconds * (size - 1))
+        index = pd.date_range(start_dt, end_dt, freq='{}s'.format(window_seconds))
+        keep = random.rand(size) > 0.1
+        df = pd.DataFrame(
+            {'close': random.rand(keep.sum()), 'volume': random.rand(keep.sum())},
+            index=index[keep].to_pydatetime()
+        )
+        implementations = {
+            "loop (old)": lambda: fill_dt_gaps_loop(
+                df.copy(), start_dt, end_dt, window_seconds
+            ),
+            "vectorized": lambda: utils.fill_dt_gaps(
+                df.copy(), start_dt, end_dt, window_seconds
+            ),
+            "vectorized, ffill": lambda: utils.fill_dt_gaps(
+                df.copy(), start_dt, end_dt, window_seconds, fill='ffill'
+            ),
+        }
+        for name, func in implementations.items():
+            results.append({
+                "rows": size,
+                "implementation": name,
+                "ms": time_call(func, repeat),
+            })
+    return pd.DataFrame(results)
+
+
+def bench_backtest(sizes, repeat, logger):
+    """
+    Vectorized backtest against the event driven loop on `size` bars of
+    synthetic prices for every product in PRODUCT_LIST, with a moving
+    average crossover signal. The default top size is a year of 20
+    second bars; the event loop only runs up to 200k bars.
+    """
+    sizes = sizes or [100000, 1576800]
+    random = np.random.RandomState(0)
+    width = len(utils.PRODUCT_LIST)
+    results = []
+    for size in sizes:
+        prices = 100 * np.exp(np.cumsum(random.normal(0, 1e-3, (size, width)), axis=0))
+        moving_average = pd.DataFrame(prices).rolling(180).mean().values
+        signals = np.where(prices > moving_average, 1.0 / width, 0.0)
+        implementations = {
+            "vectorized": lambda: backtest_etl.backtest(prices, signals),
+        }
+        if size <= 200000:
+            implementations["event loop"] = lambda: backtest_etl.backtest_events(
+                prices,
+                lambda i, dt, bar_prices, weights, equity: signals[i]
+            )
+        for name, func in implementations.items():
+            ms = time_call(func, repeat)
+            results.append({
+                "bars": size,
+                "products": width,
+                "implementation": name,
+                "ms": ms,
+                "bars/sec": size / ms * 1000,
+            })
+    return pd.DataFrame(results)
+
+
+BENCHMARKS = {
+    "backtest": bench_backtest,
+    "fill_dt_gaps": bench_fill_dt_gaps,
+    "download": bench_download,
+    "quote_index": bench_quote_index,
+    "quote_loader": bench_quote_loader,
+}
+
+
+class Command(BaseCommand):
+    help = """
+    Run a performance benchmark and print timings.
+    Benchmarks which need data generate their own and clean up after.
+    """
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            'benchmark',
+            type=str,
+            help='One of: {}'.format(', '.join(sorted(BENCHMARKS)))
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            dest='size',
+            nargs='*',
+            help='Problem sizes (eg. number of rows). Defaults depend on the benchmark'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            dest='repeat',
+            nargs=1,
+            help='How many times to repeat each timing. Default 5'
+        )
+        parser.add_argument(
+            '--log_level',
+            type=str,
+            dest='log_level',
+            nargs=1,
+            help='Python logging level'
+        )
+
+    def handle(self, *args, **options):
+
+        if options['benchmark'] not in BENCHMARKS:
+            raise CommandError(
+                "Unknown benchmark {}".format(options['benchmark'])
+            )
+        repeat = options['repeat'][0] if options['repeat'] else 5
+        log_level = options['log_level'][0] if options['log_level'] else 'INFO'
+        logger = utils.get_logger(__name__, log_level)
+
+        results = BENCHMARKS[options['benchmark']](
+            options['size'],
+            repeat,
+            logger
+        )
+        self.stdout.write(results.to_string(index=False))
@@ -1,6 +1,7 @@
 import datetime as dt
 from dateutil.parser import parse as dt_parse
 from django.core.management.base import BaseCommand
+from etl.candle_store import CandleStore, DEFAULT_ROOT
 from gdax_api.external import QuoteDownloader
 from bin import utils
 
@@ -39,7 +40,7 @@ class Command(BaseCommand):
             type=int,
             dest='max_failures',
             nargs=1,
-            help='How many HTTP failures before shut down?'
+            help='How many windows may fail, after retrying each, before shut down?'
         )
         parser.add_argument(
             '--product',
@@ -48,6 +49,47 @@ class Command(BaseCommand):
             nargs='*',
             help='Products to download, eg. BTC-USD, LTC-BTC, etc. Multiple products possible.'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            nargs=1,
+            help='Number of concurrent download threads. Default 4'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            dest='rate',
+            nargs=1,
+            help='Max GDAX requests per second shared by all workers. Default 3'
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Only download time ranges missing from the DB, and report coverage'
+        )
+        parser.add_argument(
+            '--retry_failed',
+            action='store_true',
+            help='Only retry windows marked failed in the download ledger'
+        )
+        parser.add_argument(
+            '--parquet',
+            action='store_true',
+            help='Also write candles to the parquet candle store'
+        )
+        parser.add_argument(
+            '--parquet_root',
+            type=str,
+            dest='parquet_root',
+            nargs=1,
+            help='Directory of the parquet candle store. Default money_squirrel/data/candles'
+        )
+        parser.add_argument(
+            '--parquet_only',
+            action='store_true',
+            help='Write candles to the parquet store only, not the Quote table'
+        )
         parser.add_argument(
             '--log_level',
             type=str,
@@ -70,14 +112,37 @@ class Command(BaseCommand):
             if options['product'] \
             else utils.PRODUCT_LIST
         log_level = options['log_level'][0] if options['log_level'] else 'INFO'
+        workers = options['workers'][0] if options['workers'] else QuoteDownloader.WORKERS
+        rate = options['rate'][0] if options['rate'] else QuoteDownloader.RATE_LIMIT
 
         assert end_date > start_date
 
-        qd = QuoteDownloader(log_level)
+        parquet_root = options['parquet_root'][0] if options['parquet_root'] else DEFAULT_ROOT
+        candle_store = None
+        if options['parquet'] or options['parquet_only'] or options['parquet_root']:
+            candle_store = CandleStore(parquet_root, log_level)
+
+        qd = QuoteDownloader(
+            log_level,
+            workers=workers,
+            rate=rate,
+            candle_store=candle_store,
+            store_db=not options['parquet_only']
+        )
         qd.run(
             start_dt=start_date,
             end_dt=end_date,
             granularity=granularity,
             max_failures=max_failures,
-            product_list=product_list
+            product_list=product_list,
+            sync=options['sync'],
+            failed_only=options['retry_failed']
         )
+        if options['sync']:
+            report = qd.coverage(
+                start_dt=start_date,
+                end_dt=end_date,
+                granularity=granularity,
+                product_list=product_list
+            )
+            self.stdout.write(report.drop('missing', axis=1).to_string(index=False))
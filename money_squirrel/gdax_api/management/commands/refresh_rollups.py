@@ -0,0 +1,68 @@
+import datetime as dt
+from dateutil.parser import parse as dt_parse
+from django.core.management.base import BaseCommand
+from gdax_api.models import Product, QuoteRollup
+from bin import utils
+
+
+class Command(BaseCommand):
+    help = """
+    Rebuild OHLCV rollup bars from stored quotes.
+    download_gdax keeps rollups current for what it stores, so this is
+    for quotes loaded some other way or before rollups existed.
+    Please use UTC timestamps :D
+    """
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            '--start_date',
+            type=str,
+            dest='start_date',
+            nargs=1,
+            help='Choose a start_date for the rebuild. Defaults 1 DAY prior to END_DATE'
+        )
+        parser.add_argument(
+            '--end_date',
+            type=str,
+            dest='end_date',
+            nargs=1,
+            help='Choose an end_date for the rebuild. Defaults UTC now'
+        )
+        parser.add_argument(
+            '--granularity',
+            type=int,
+            dest='granularity',
+            nargs=1,
+            help='Granularity of the source quotes. Default 60'
+        )
+        parser.add_argument(
+            '--product',
+            type=str,
+            dest='product',
+            nargs='*',
+            help='Products to roll up, eg. BTC-USD, LTC-BTC, etc. Multiple products possible.'
+        )
+
+    def handle(self, *args, **options):
+
+        end_date = dt_parse(options['end_date'][0]) \
+            if options['end_date'] \
+            else dt.datetime.utcnow()
+        start_date = dt_parse(options['start_date'][0]) \
+            if options['start_date'] \
+            else end_date - dt.timedelta(days=1)
+        granularity = options['granularity'][0] if options['granularity'] else 60
+        product_list = options['product'] \
+            if options['product'] \
+            else utils.PRODUCT_LIST
+
+        assert end_date > start_date
+
+        written = QuoteRollup.refresh(
+            Product.get_ids(product_list).values(),
+            granularity,
+            start_date,
+            end_date
+        )
+        self.stdout.write("Wrote {} rollup bars".format(written))
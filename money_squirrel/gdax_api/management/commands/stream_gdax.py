@@ -0,0 +1,121 @@
+import os
+from time import sleep
+from django.core.management.base import BaseCommand, CommandError
+from gdax_api.external import QuoteStreamer
+from bin import utils
+
+FIXTURE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    'fixtures',
+    'gdax_matches.jsonl'
+)
+
+
+class Command(BaseCommand):
+    help = """
+    Stream live trades from the GDAX websocket into candles, written to
+    postgres in micro batches with rollups kept current.
+    Reconnects after errors; candles spanning a disconnect are dropped,
+    so backfill those with download_gdax --sync.
+    Use --replay to run a recorded feed through the same path offline.
+    """
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            '--product',
+            type=str,
+            dest='product',
+            nargs='*',
+            help='Products to stream, eg. BTC-USD, LTC-BTC, etc. Multiple products possible.'
+        )
+        parser.add_argument(
+            '--granularity',
+            type=int,
+            dest='granularity',
+            nargs='*',
+            help='Candle granularities in seconds. Default 20 60'
+        )
+        parser.add_argument(
+            '--flush_interval',
+            type=int,
+            dest='flush_interval',
+            nargs=1,
+            help='Seconds between batched writes. Default {}'.format(
+                QuoteStreamer.FLUSH_INTERVAL
+            )
+        )
+        parser.add_argument(
+            '--record',
+            type=str,
+            dest='record',
+            nargs=1,
+            help='Append raw websocket messages to this JSON lines file'
+        )
+        parser.add_argument(
+            '--replay',
+            type=str,
+            dest='replay',
+            nargs='?',
+            const=FIXTURE,
+            help='Replay a recorded JSON lines file instead of connecting. '
+                 'Without a path, replays the bundled fixture'
+        )
+        parser.add_argument(
+            '--reconnect_delay',
+            type=int,
+            dest='reconnect_delay',
+            nargs=1,
+            help='Seconds to wait before reconnecting after an error. Default 10'
+        )
+        parser.add_argument(
+            '--log_level',
+            type=str,
+            dest='log_level',
+            nargs=1,
+            help='Python logging level'
+        )
+
+    def handle(self, *args, **options):
+
+        product_list = options['product'] \
+            if options['product'] \
+            else utils.PRODUCT_LIST
+        granularities = options['granularity'] \
+            if options['granularity'] \
+            else [20, 60]
+        flush_interval = options['flush_interval'][0] \
+            if options['flush_interval'] \
+            else QuoteStreamer.FLUSH_INTERVAL
+        reconnect_delay = options['reconnect_delay'][0] \
+            if options['reconnect_delay'] \
+            else 10
+        log_level = options['log_level'][0] if options['log_level'] else 'INFO'
+
+        if options['replay'] and options['record']:
+            raise CommandError("--record and --replay can't be combined")
+
+        streamer = QuoteStreamer(
+            product_list,
+            granularities,
+            log_level=log_level,
+            flush_interval=flush_interval,
+            record_path=options['record'][0] if options['record'] else None
+        )
+        if options['replay']:
+            streamer.replay(options['replay'])
+            return
+
+        try:
+            while True:
+                streamer.error = None
+                streamer.start()
+                while not streamer.stop:
+                    sleep(1)
+                streamer.thread.join()
+                if streamer.error is None:
+                    break
+                streamer.logger.info("Reconnecting in %s seconds", reconnect_delay)
+                sleep(reconnect_delay)
+        except KeyboardInterrupt:
+            streamer.close()
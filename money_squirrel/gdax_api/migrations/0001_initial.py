@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Quote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(max_length=20)),
+                ('granularity', models.IntegerField()),
+                ('dt', models.DateTimeField()),
+                ('low', models.FloatField()),
+                ('high', models.FloatField()),
+                ('open', models.FloatField()),
+                ('close', models.FloatField()),
+                ('volume', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# The old downloader saved revised candles as extra rows for the same
+# product, granularity and dt. Keep the newest of each before the unique
+# index goes on.
+DELETE_DUPLICATES = """
+delete from gdax_api_quote
+where id not in (
+    select max(id)
+    from gdax_api_quote
+    group by product_id, granularity, dt
+)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdax_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL([DELETE_DUPLICATES], migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='quote',
+            unique_together=set([('product_id', 'granularity', 'dt')]),
+        ),
+    ]
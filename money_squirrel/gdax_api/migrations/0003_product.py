@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdax_api', '0002_quote_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quote',
+            unique_together=set([]),
+        ),
+        # Free up the product_id column name for the foreign key
+        migrations.RenameField(
+            model_name='quote',
+            old_name='product_id',
+            new_name='product_name',
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='product',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='quotes', to='gdax_api.Product'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def populate_product(apps, schema_editor):
+    Product = apps.get_model('gdax_api', 'Product')
+    Quote = apps.get_model('gdax_api', 'Quote')
+    names = Quote.objects.values_list('product_name', flat=True).distinct()
+    for name in names:
+        product, _ = Product.objects.get_or_create(name=name)
+        Quote.objects.filter(product_name=name).update(product=product)
+
+
+def populate_product_name(apps, schema_editor):
+    Product = apps.get_model('gdax_api', 'Product')
+    Quote = apps.get_model('gdax_api', 'Quote')
+    for product in Product.objects.all():
+        Quote.objects.filter(product=product).update(product_name=product.name)
+
+
+class Migration(migrations.Migration):
+
+    # Kept apart from the schema changes around it: postgres refuses to
+    # ALTER a table with pending deferred FK checks in the same transaction.
+
+    dependencies = [
+        ('gdax_api', '0003_product'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_product, populate_product_name),
+    ]
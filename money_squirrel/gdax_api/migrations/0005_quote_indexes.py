@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class AddPostgresIndex(migrations.AddIndex):
+    """ AddIndex which only touches postgres, eg. for BRIN indexes """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super(AddPostgresIndex, self).database_forwards(
+                app_label,
+                schema_editor,
+                from_state,
+                to_state
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super(AddPostgresIndex, self).database_backwards(
+                app_label,
+                schema_editor,
+                from_state,
+                to_state
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdax_api', '0004_populate_product'),
+    ]
+
+    operations = [
+        # Only so that migrating backwards can re-add the column to a
+        # table with rows; 0004 then fills it in.
+        migrations.AlterField(
+            model_name='quote',
+            name='product_name',
+            field=models.CharField(default='', max_length=20),
+        ),
+        migrations.RemoveField(
+            model_name='quote',
+            name='product_name',
+        ),
+        migrations.AlterField(
+            model_name='quote',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='quotes', to='gdax_api.Product'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='quote',
+            unique_together=set([('product', 'granularity', 'dt')]),
+        ),
+        AddPostgresIndex(
+            model_name='quote',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['dt'], name='gdax_api_quote_dt_brin'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdax_api', '0005_quote_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('row_count', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('granularity', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='jobs', to='gdax_api.Product')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quotejob',
+            unique_together=set([('product', 'granularity', 'start_dt')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdax_api', '0006_quotejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_granularity', models.IntegerField()),
+                ('granularity', models.IntegerField()),
+                ('dt', models.DateTimeField()),
+                ('low', models.FloatField()),
+                ('high', models.FloatField()),
+                ('open', models.FloatField()),
+                ('close', models.FloatField()),
+                ('volume', models.FloatField()),
+                ('candles', models.IntegerField()),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='rollups', to='gdax_api.Product')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quoterollup',
+            unique_together=set([('product', 'source_granularity', 'granularity', 'dt')]),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gdax_api', '0007_quoterollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quotejob',
+            name='sink',
+            field=models.CharField(choices=[('db', 'Quote table'), ('parquet', 'Parquet candle store')], default='db', max_length=10),
+        ),
+        migrations.AlterUniqueTogether(
+            name='quotejob',
+            unique_together=set([('product', 'granularity', 'sink', 'start_dt')]),
+        ),
+    ]
@@ -1,13 +1,38 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-from django.db import models
+from django.db import connection, models
+from django.contrib.postgres.indexes import BrinIndex
 from django.utils.encoding import python_2_unicode_compatible
+from bin.ledger import DownloadJob
+
+
+@python_2_unicode_compatible
+class Product(models.Model):
+
+    name = models.CharField(max_length=20, unique=True)
+
+    @classmethod
+    def get_ids(cls, names):
+        """ Map product names (eg. BTC-USD) to ids, creating missing products """
+        return {
+            name: cls.objects.get_or_create(name=name)[0].id
+            for name in names
+        }
+
+    def __str__(self):
+        return self.name
 
 
 @python_2_unicode_compatible
 class Quote(models.Model):
 
-    product_id = models.CharField(max_length=20)
+    # The unique index below leads with product, so skip the FK's own index
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        related_name='quotes',
+        db_index=False
+    )
     granularity = models.IntegerField()
     dt = models.DateTimeField()
     low = models.FloatField()
@@ -16,6 +41,15 @@ class Quote(models.Model):
     close = models.FloatField()
     volume = models.FloatField()
 
+    class Meta:
+        unique_together = (('product', 'granularity', 'dt'),)
+        # Quotes are appended roughly in dt order, so a BRIN index
+        # covers time range scans across products at a tiny size.
+        # Postgres only: migration 0005 skips it on other databases.
+        indexes = [
+            BrinIndex(fields=['dt'], name='gdax_api_quote_dt_brin'),
+        ]
+
     def __str__(self):
         return str({
             "product_id": self.product_id,
@@ -27,3 +61,168 @@ class Quote(models.Model):
             "close": self.close,
             "volume": self.volume,
         })
+
+
+@python_2_unicode_compatible
+class QuoteRollup(models.Model):
+    """
+    OHLCV bars aggregated from quotes of a finer source_granularity,
+    so long horizons can be read without scanning every base candle.
+    """
+
+    GRANULARITIES = (300, 3600, 86400)
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        related_name='rollups',
+        db_index=False
+    )
+    source_granularity = models.IntegerField()
+    granularity = models.IntegerField()
+    dt = models.DateTimeField()
+    low = models.FloatField()
+    high = models.FloatField()
+    open = models.FloatField()
+    close = models.FloatField()
+    volume = models.FloatField()
+    candles = models.IntegerField()  # source quotes in the bar
+
+    class Meta:
+        unique_together = (('product', 'source_granularity', 'granularity', 'dt'),)
+
+    @classmethod
+    def refresh(cls, product_ids, source_granularity, start_dt, end_dt):
+        """
+        Recompute every rollup bar overlapping [start_dt, end_dt] from
+        Quote, upserting one statement per rollup granularity and
+        dropping bars left without quotes.
+        Returns the number of bars written or dropped.
+        """
+        written = 0
+        for granularity in cls.GRANULARITIES:
+            if granularity <= source_granularity or granularity % source_granularity:
+                continue
+            params = {
+                "product_ids": list(product_ids),
+                "source_granularity": source_granularity,
+                "granularity": granularity,
+                "start_dt": start_dt,
+                "end_dt": end_dt,
+            }
+            with connection.cursor() as cursor:
+                # bars whose quotes are all gone would otherwise never change
+                cursor.execute(
+                    """
+                    delete from {rollup} r
+                    where r.product_id = any(%(product_ids)s)
+                        and r.source_granularity = %(source_granularity)s
+                        and r.granularity = %(granularity)s
+                        and r.dt >= timestamp 'epoch' + interval '1 second' * %(granularity)s
+                            * floor(extract(epoch from %(start_dt)s::timestamp) / %(granularity)s)
+                        and r.dt < timestamp 'epoch' + interval '1 second' * %(granularity)s
+                            * (floor(extract(epoch from %(end_dt)s::timestamp) / %(granularity)s) + 1)
+                        and not exists (
+                            select 1
+                            from {quote} q
+                            where q.product_id = r.product_id
+                                and q.granularity = r.source_granularity
+                                and q.dt >= r.dt
+                                and q.dt < r.dt + interval '1 second' * r.granularity
+                        )
+                    """.format(
+                        rollup=cls._meta.db_table,
+                        quote=Quote._meta.db_table
+                    ),
+                    params
+                )
+                written += cursor.rowcount
+                cursor.execute(
+                    """
+                    insert into {rollup}
+                        (product_id, source_granularity, granularity, dt,
+                         low, high, open, close, volume, candles)
+                    select product_id
+                        , %(source_granularity)s
+                        , %(granularity)s
+                        , bucket
+                        , min(low)
+                        , max(high)
+                        , (array_agg(open order by dt))[1]
+                        , (array_agg(close order by dt desc))[1]
+                        , sum(volume)
+                        , count(*)
+                    from (
+                        select q.*
+                            , timestamp 'epoch' + interval '1 second' * %(granularity)s
+                                * floor(extract(epoch from dt) / %(granularity)s) as bucket
+                        from {quote} q
+                        where product_id = any(%(product_ids)s)
+                            and granularity = %(source_granularity)s
+                            and dt >= timestamp 'epoch' + interval '1 second' * %(granularity)s
+                                * floor(extract(epoch from %(start_dt)s::timestamp) / %(granularity)s)
+                            and dt < timestamp 'epoch' + interval '1 second' * %(granularity)s
+                                * (floor(extract(epoch from %(end_dt)s::timestamp) / %(granularity)s) + 1)
+                    ) q
+                    group by product_id, bucket
+                    on conflict (product_id, source_granularity, granularity, dt) do update
+                    set low = excluded.low
+                        , high = excluded.high
+                        , open = excluded.open
+                        , close = excluded.close
+                        , volume = excluded.volume
+                        , candles = excluded.candles
+                    """.format(
+                        rollup=cls._meta.db_table,
+                        quote=Quote._meta.db_table
+                    ),
+                    params
+                )
+                written += cursor.rowcount
+        return written
+
+    def __str__(self):
+        return str({
+            "product_id": self.product_id,
+            "source_granularity": self.source_granularity,
+            "granularity": self.granularity,
+            "dt": self.dt,
+            "low": self.low,
+            "high": self.high,
+            "open": self.open,
+            "close": self.close,
+            "volume": self.volume,
+            "candles": self.candles,
+        })
+
+
+@python_2_unicode_compatible
+class QuoteJob(DownloadJob):
+
+    # Where the window's candles were written. Each sink keeps its own
+    # ledger, so a window stored in parquet is still downloaded for the DB.
+    DB = 'db'
+    PARQUET = 'parquet'
+    SINK_CHOICES = (
+        (DB, 'Quote table'),
+        (PARQUET, 'Parquet candle store'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='jobs')
+    granularity = models.IntegerField()
+    sink = models.CharField(max_length=10, choices=SINK_CHOICES, default=DB)
+
+    class Meta:
+        unique_together = (('product', 'granularity', 'sink', 'start_dt'),)
+
+    def __str__(self):
+        return str({
+            "product_id": self.product_id,
+            "granularity": self.granularity,
+            "sink": self.sink,
+            "start_dt": self.start_dt,
+            "end_dt": self.end_dt,
+            "status": self.status,
+            "attempts": self.attempts,
+            "row_count": self.row_count,
+        })
@@ -1,6 +1,615 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import datetime as dt
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from gdax_api.external import CandleAggregator, QuoteDownloader, QuoteStreamer
+from gdax_api.management.commands.benchmark import StubCandleHandler, StubServer
+from gdax_api.management.commands.stream_gdax import FIXTURE
+from gdax_api.models import Product, Quote, QuoteJob
+from bin import utils
+from etl.candle_store import CandleStore
 
-from django.test import TestCase
+DT = dt.datetime(2017, 1, 1)
+CANDLE_COLUMNS = ["product", "granularity", "dt", "low", "high", "open", "close", "volume"]
 
-# Create your tests here.
+
+def fixture_messages():
+    with open(FIXTURE) as messages:
+        return [json.loads(line) for line in messages if line.strip()]
+
+
+def match(seconds, price, size=1.0, product='BTC-USD'):
+    return {
+        "type": "match",
+        "product_id": product,
+        "time": (DT + dt.timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        "price": str(price),
+        "size": str(size),
+    }
+
+
+def sort_candles(frame):
+    return frame[CANDLE_COLUMNS].sort_values(
+        ["product", "granularity", "dt"]
+    ).reset_index(drop=True)
+
+
+class QuoteMigrationTest(TransactionTestCase):
+    """ Migrations over quotes stored by the old schema """
+
+    def migrate(self, name=None):
+        """ Migrate gdax_api to `name` (default latest), returning its apps """
+        executor = MigrationExecutor(connection)
+        targets = [('gdax_api', name)] if name \
+            else executor.loader.graph.leaf_nodes('gdax_api')
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def stored(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "select product_id, dt, close from gdax_api_quote order by product_id, dt, granularity"
+            )
+            return cursor.fetchall()
+
+    def test_duplicates_keep_newest(self):
+        OldQuote = self.migrate('0001_initial').get_model('gdax_api', 'Quote')
+        minute = dt.timedelta(minutes=1)
+        for product_id, quote_dt, close in [
+            ('BTC-USD', DT, 1.0),
+            ('BTC-USD', DT, 2.0),
+            ('ETH-USD', DT, 5.0),
+            ('BTC-USD', DT + minute, 4.0),
+            ('BTC-USD', DT, 3.0),  # the revision saved last wins
+            ('BTC-USD', DT + minute, 6.0),
+        ]:
+            OldQuote.objects.create(
+                product_id=product_id,
+                granularity=60,
+                dt=quote_dt,
+                low=close,
+                high=close,
+                open=close,
+                close=close,
+                volume=1.0
+            )
+        OldQuote.objects.create(
+            product_id='BTC-USD',
+            granularity=20,
+            dt=DT,
+            low=7.0,
+            high=7.0,
+            open=7.0,
+            close=7.0,
+            volume=1.0
+        )
+        self.migrate('0002_quote_unique')
+        self.assertEqual(self.stored(), [
+            ('BTC-USD', DT, 7.0),
+            ('BTC-USD', DT, 3.0),
+            ('BTC-USD', DT + minute, 6.0),
+            ('ETH-USD', DT, 5.0),
+        ])
+        self.migrate()
+        self.assertEqual(
+            sorted(Quote.objects.values_list('product__name', 'granularity', 'dt', 'close')),
+            [
+                ('BTC-USD', 20, DT, 7.0),
+                ('BTC-USD', 60, DT, 3.0),
+                ('BTC-USD', 60, DT + minute, 6.0),
+                ('ETH-USD', 60, DT, 5.0),
+            ]
+        )
+
+    def test_product_table_reverses_with_data(self):
+        product_ids = Product.get_ids(['BTC-USD', 'ETH-USD'])
+        for name, close in [('BTC-USD', 1.0), ('ETH-USD', 2.0)]:
+            Quote.objects.create(
+                product_id=product_ids[name],
+                granularity=60,
+                dt=DT,
+                low=close,
+                high=close,
+                open=close,
+                close=close,
+                volume=1.0
+            )
+        self.migrate('0001_initial')
+        self.assertEqual(self.stored(), [('BTC-USD', DT, 1.0), ('ETH-USD', DT, 2.0)])
+
+
+class CountingCandleHandler(StubCandleHandler):
+    """ Stub candles without delay, recording requests and failing some """
+
+    LATENCY = 0
+    requests = []
+    failing = set()  # products answered with 503
+
+    def do_GET(self):
+        product = self.path.split('/')[2]
+        self.requests.append(product)
+        if product in self.failing:
+            self.send_error(503)
+            return
+        StubCandleHandler.do_GET(self)
+
+
+class QuoteStoreTest(TestCase):
+
+    def setUp(self):
+        ids = Product.get_ids(['BTC-USD', 'ETH-USD'])
+        self.btc, self.eth = ids['BTC-USD'], ids['ETH-USD']
+        Quote.objects.bulk_create([
+            Quote(
+                product_id=product_id,
+                granularity=granularity,
+                dt=DT + dt.timedelta(minutes=m),
+                low=close,
+                high=close,
+                open=close,
+                close=close,
+                volume=1.0
+            )
+            for product_id, granularity, m, close in [
+                (self.btc, 60, 1, -1.0),  # already stored
+                (self.btc, 20, 3, -1.0),  # other keys don't clash
+                (self.eth, 60, 4, -1.0),
+            ]
+        ])
+        self.downloader = QuoteDownloader('ERROR')
+        minutes = [0, 1, 2, 3, 4, 2]
+        closes = [0.0, 1.0, 2.0, 3.0, 4.0, 99.0]  # minute 2 twice in one batch
+        self.records = pd.DataFrame({
+            "product_id": self.btc,
+            "granularity": 60,
+            "dt": pd.to_datetime([DT + dt.timedelta(minutes=m) for m in minutes]),
+            "low": closes,
+            "high": closes,
+            "open": closes,
+            "close": closes,
+            "volume": 1.0,
+        })[list(QuoteDownloader.STORE_COLUMNS)]
+
+    def assert_stored(self):
+        self.assertEqual(
+            list(Quote.objects.filter(product_id=self.btc, granularity=60)
+                 .order_by('dt').values_list('dt', 'close')),
+            [(DT + dt.timedelta(minutes=m), close)
+             for m, close in [(0, 0.0), (1, -1.0), (2, 2.0), (3, 3.0), (4, 4.0)]]
+        )
+        self.assertEqual(Quote.objects.count(), 7)
+
+    def test_store_skips_stored_and_duplicate_rows(self):
+        self.assertEqual(connection.vendor, 'postgresql')
+        self.assertEqual(self.downloader._store(self.records), (4, 2))
+        self.assert_stored()
+        self.assertEqual(self.downloader._store(self.records), (0, 6))
+        self.assertEqual((self.downloader.inserted_count, self.downloader.skipped_count), (4, 8))
+
+    def test_generic_store_matches(self):
+        self.assertEqual(self.downloader._store_generic(self.records), 4)
+        self.assert_stored()
+        self.assertEqual(self.downloader._store_generic(self.records), 0)
+        self.assert_stored()
+
+
+class QuoteValidationTest(SimpleTestCase):
+
+    payload = {
+        "product_id": "BTC-USD",
+        "start": "2017-01-01T00:00:00",
+        "end": "2017-01-01T00:10:00",
+        "granularity": 60,
+    }
+    ts = utils.dt_to_ts(DT)
+
+    def setUp(self):
+        self.downloader = QuoteDownloader('CRITICAL')
+        self.downloader.product_ids = {"BTC-USD": 7}
+
+    def candle(self, minute=0, low=1.0, high=4.0, open_=2.0, close=3.0, volume=5.0):
+        return [self.ts + 60 * minute, low, high, open_, close, volume]
+
+    def test_parses_whole_response(self):
+        response = [
+            self.candle(10),
+            self.candle(0, low=3.0, high=3.0, open_=3.0),
+            ["1483228860", 1, 4, 2, 3, 0],  # numeric strings parse too
+        ]
+        self.downloader._get_candles = lambda payload: response
+        frame = self.downloader._download_and_clean(self.payload)
+        self.assertEqual(list(frame.columns), list(QuoteDownloader.STORE_COLUMNS))
+        self.assertEqual(
+            list(frame["dt"]),
+            [DT + dt.timedelta(minutes=m) for m in (10, 0, 1)]
+        )
+        self.assertEqual(set(frame["product_id"]), {7})
+        self.assertEqual(list(frame["close"]), [3.0, 3.0, 3.0])
+        self.assertEqual(self.downloader._validate_response([], self.payload).shape, (0, 6))
+
+    def test_rejects_malformed_responses(self):
+        for response in [
+            {"message": "Rate limit exceeded"},
+            "candles",
+            [self.candle(), self.candle()[:5]],  # ragged
+            [self.candle()[:5]],
+            [self.candle() + [1.0]],
+            [[self.ts, "low", 4.0, 2.0, 3.0, 5.0]],
+            [[self.ts, None, 4.0, 2.0, 3.0, 5.0]],
+            [[self.ts, {"low": 1.0}, 4.0, 2.0, 3.0, 5.0]],
+            [self.candle(close=float('inf'))],
+            [self.candle(), self.candle(volume=float('nan'))],
+        ]:
+            with self.assertRaises(AssertionError):
+                self.downloader._validate_response(response, self.payload)
+
+    def test_rejects_out_of_range_candles(self):
+        for candle in [
+            self.candle(low=2.5),  # above open
+            self.candle(high=2.5),  # below close
+            self.candle(volume=-1.0),
+            self.candle(-1),  # before the window
+            self.candle(11),  # after it
+        ]:
+            with self.assertRaises(AssertionError):
+                self.downloader._validate_response([self.candle(), candle], self.payload)
+        # without a payload there is no window to check
+        self.downloader._validate_response([self.candle(-1), self.candle(11)])
+        # a window starting between candles includes the one it starts in
+        payload = dict(self.payload, start="2017-01-01T00:00:30")
+        self.downloader._validate_response([self.candle(0)], payload)
+
+
+class QuoteLedgerTest(TestCase):
+
+    start_dt = DT
+    end_dt = DT + dt.timedelta(hours=10)
+    products = ['BTC-USD', 'ETH-USD']
+
+    @classmethod
+    def setUpClass(cls):
+        super(QuoteLedgerTest, cls).setUpClass()
+        cls.server = StubServer(('127.0.0.1', 0), CountingCandleHandler)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super(QuoteLedgerTest, cls).tearDownClass()
+
+    def setUp(self):
+        CountingCandleHandler.requests = []
+        CountingCandleHandler.failing = set()
+
+    def download(self, candle_store=None, store_db=True, **kwargs):
+        """ Run a downloader over the test range, returning requested products """
+        downloader = QuoteDownloader(
+            'ERROR',
+            rate=1000,
+            api_url='http://127.0.0.1:{}'.format(self.server.server_address[1]),
+            candle_store=candle_store,
+            store_db=store_db
+        )
+        downloader.retry_policy.base_delay = 0.001
+        downloader.retry_policy.max_attempts = 2
+        CountingCandleHandler.requests = []
+        downloader.run(
+            self.start_dt,
+            self.end_dt,
+            granularity=60,
+            product_list=self.products,
+            **kwargs
+        )
+        return sorted(set(CountingCandleHandler.requests)), len(CountingCandleHandler.requests)
+
+    def stored(self, product):
+        return Quote.objects.filter(
+            product__name=product,
+            dt__gte=self.start_dt,
+            dt__lte=self.end_dt
+        ).count()
+
+    def statuses(self):
+        return set(QuoteJob.objects.values_list('product__name', 'status'))
+
+    def test_resume_skips_done_windows(self):
+        windows = len(list(QuoteDownloader()._windows(self.start_dt, self.end_dt, 60)))
+        CountingCandleHandler.failing = {'ETH-USD'}
+        self.download()
+        self.assertEqual(self.statuses(), {('BTC-USD', QuoteJob.DONE), ('ETH-USD', QuoteJob.FAILED)})
+        self.assertEqual(
+            QuoteJob.objects.filter(product__name='BTC-USD', row_count__gt=0).count(),
+            windows
+        )
+        # 10 hours of minutes, both ends included
+        self.assertEqual(self.stored('BTC-USD'), 601)
+
+        CountingCandleHandler.failing = set()
+        self.assertEqual(self.download(failed_only=True), (['ETH-USD'], windows))
+        self.assertEqual(self.statuses(), {('BTC-USD', QuoteJob.DONE), ('ETH-USD', QuoteJob.DONE)})
+        self.assertEqual(self.stored('ETH-USD'), 601)
+
+        count = Quote.objects.count()
+        self.assertEqual(self.download(), ([], 0))
+        self.assertEqual(Quote.objects.count(), count)
+
+    def test_sync_refills_done_windows(self):
+        self.download()
+        gap = Quote.objects.filter(
+            product__name='BTC-USD',
+            dt__gte=DT + dt.timedelta(hours=4),
+            dt__lt=DT + dt.timedelta(hours=5)
+        )
+        self.assertEqual(gap.count(), 60)
+        gap.delete()
+        self.assertEqual(self.download(), ([], 0))
+        requested, count = self.download(sync=True)
+        self.assertEqual(requested, ['BTC-USD'])
+        self.assertLessEqual(count, 2)  # the windows overlapping the hour
+        self.assertEqual(self.stored('BTC-USD'), 601)
+        self.assertEqual(
+            Quote.objects.filter(product__name='BTC-USD').latest('dt').dt,
+            self.end_dt
+        )
+
+    def test_sinks_keep_their_own_ledger(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        store = CandleStore(root)
+        windows = len(list(QuoteDownloader()._windows(self.start_dt, self.end_dt, 60)))
+        self.assertEqual(
+            self.download(candle_store=store, store_db=False),
+            (self.products, 2 * windows)
+        )
+        self.assertEqual(Quote.objects.count(), 0)
+        self.assertEqual(len(store.read(self.start_dt, self.end_dt, 60, self.products)), 2 * 601)
+        self.assertEqual(
+            set(QuoteJob.objects.values_list('sink', 'status')),
+            {(QuoteJob.PARQUET, QuoteJob.DONE)}
+        )
+        # done in parquet, but not yet in the DB
+        self.assertEqual(self.download(), (self.products, 2 * windows))
+        self.assertEqual(self.stored('BTC-USD'), 601)
+        self.assertEqual(self.download(candle_store=store), ([], 0))
+        # a window done in one sink only is downloaded again for both
+        QuoteJob.objects.filter(
+            product__name='ETH-USD',
+            sink=QuoteJob.DB,
+            start_dt__gt=self.start_dt
+        ).update(status=QuoteJob.FAILED)
+        self.assertEqual(self.download(candle_store=store), (['ETH-USD'], windows - 1))
+        self.assertEqual(
+            set(QuoteJob.objects.values_list('sink', 'status')),
+            {(QuoteJob.PARQUET, QuoteJob.DONE), (QuoteJob.DB, QuoteJob.DONE)}
+        )
+        self.assertEqual(len(store.read(self.start_dt, self.end_dt, 60, self.products)), 2 * 601)
+
+
+class CandleStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = CandleStore(self.root)
+
+    def candles(self, product, minutes, close=1.0):
+        count = len(minutes)
+        return pd.DataFrame({
+            "product": product,
+            "granularity": 60,
+            "dt": [DT + dt.timedelta(minutes=m) for m in minutes],
+            "low": np.full(count, close - 0.5),
+            "high": np.full(count, close + 0.5),
+            "open": np.full(count, close),
+            "close": np.full(count, close),
+            "volume": np.arange(count, dtype=np.float64),
+        })
+
+    def test_round_trip(self):
+        # across midnight, so into two day files
+        minutes = range(1430, 1450)
+        btc = self.candles('BTC-USD', minutes)
+        self.assertEqual(self.store.write(pd.concat([btc, btc.iloc[:3]])), (20, 3))
+        eth = self.candles('ETH-USD', minutes[::2], close=2.0)
+        self.assertEqual(self.store.write(eth), (10, 0))
+        # stored candles win over rewrites
+        rewrite = self.candles('BTC-USD', range(1445, 1455), close=9.0)
+        self.assertEqual(self.store.write(rewrite), (5, 5))
+        self.assertEqual(
+            sorted(os.path.relpath(path, self.root) for path in self.store._paths(
+                'BTC-USD', 60, DT, DT + dt.timedelta(days=3)
+            )),
+            [os.path.join('BTC-USD', '60', '2017-01-01.parquet'),
+             os.path.join('BTC-USD', '60', '2017-01-02.parquet')]
+        )
+
+        start_dt = DT + dt.timedelta(minutes=1435)
+        end_dt = DT + dt.timedelta(minutes=1452)
+        candles = self.store.read(start_dt, end_dt, 60, ['BTC-USD', 'ETH-USD'])
+        self.assertEqual(list(candles.columns), ['product'] + CandleStore.COLUMNS)
+        self.assertEqual(list(candles['product'].cat.categories), ['BTC-USD', 'ETH-USD'])
+        self.assertEqual(candles['close'].dtype, np.float32)
+        self.assertEqual(candles['dt'].min(), start_dt)
+        self.assertEqual(candles['dt'].max(), end_dt)
+        btc = candles[candles['product'] == 'BTC-USD']
+        self.assertEqual(list(btc['dt']), [DT + dt.timedelta(minutes=m) for m in range(1435, 1453)])
+        self.assertEqual(list(btc['close']), [1.0] * 15 + [9.0] * 3)
+        self.assertEqual(list(btc['volume'][:2]), [5.0, 6.0])
+        eth = candles[candles['product'] == 'ETH-USD']
+        self.assertEqual(
+            list(eth['dt']),
+            [DT + dt.timedelta(minutes=m) for m in range(1436, 1450, 2)]
+        )
+        # ordered by dt, then product
+        self.assertTrue(candles['dt'].is_monotonic_increasing)
+
+        empty = self.store.read(
+            DT + dt.timedelta(days=5),
+            DT + dt.timedelta(days=6),
+            60,
+            ['BTC-USD']
+        )
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(list(empty.columns), ['product'] + CandleStore.COLUMNS)
+
+
+class QuoteCoverageTest(TestCase):
+
+    def setUp(self):
+        product_id = Product.get_ids(['BTC-USD'])['BTC-USD']
+        minutes = [
+            m for m in range(0, 601)
+            if 30 <= m < 570  # missing at both edges
+            and not 240 <= m < 260  # a gap
+            and not 300 <= m < 305  # a hole too short to count
+        ]
+        Quote.objects.bulk_create([
+            Quote(
+                product_id=product_id,
+                granularity=60,
+                dt=DT + dt.timedelta(minutes=m),
+                low=1.0,
+                high=1.0,
+                open=1.0,
+                close=1.0,
+                volume=1.0
+            )
+            for m in minutes
+        ])
+        self.product_id = product_id
+        self.downloader = QuoteDownloader('ERROR')
+
+    def test_gaps_match_on_every_backend(self):
+        end_dt = DT + dt.timedelta(hours=10)
+        expected = [(DT + dt.timedelta(minutes=239), DT + dt.timedelta(minutes=260))]
+        self.assertEqual(self.downloader._gaps_postgres(self.product_id, 60, DT, end_dt), expected)
+        self.assertEqual(self.downloader._gaps_generic(self.product_id, 60, DT, end_dt), expected)
+
+    def test_coverage_reports_edges_and_gaps(self):
+        end_dt = DT + dt.timedelta(hours=10)
+        report = self.downloader.coverage(DT, end_dt, 60, ['BTC-USD', 'ETH-USD'])
+        btc, eth = report.to_dict('records')
+        minute = dt.timedelta(minutes=1)
+        self.assertEqual(btc['missing'], [
+            (DT, DT + 30 * minute),
+            (DT + 240 * minute, DT + 260 * minute),
+            (DT + 570 * minute, end_dt),
+        ])
+        self.assertEqual((btc['candles'], btc['expected'], btc['gaps']), (515, 601, 3))
+        self.assertEqual(btc['missing_seconds'], (30 + 20 + 30) * 60)
+        self.assertEqual(eth['missing'], [(DT, end_dt)])
+        self.assertEqual(eth['coverage'], 0)
+
+
+class CandleAggregatorTest(SimpleTestCase):
+
+    def test_fixture_candles_match_trades(self):
+        messages = fixture_messages()
+        aggregator = CandleAggregator(granularities=(20, 60), grace=2)
+        for message in messages:
+            aggregator.add(message)
+        candles = sort_candles(aggregator.pop_closed())
+
+        trades = pd.DataFrame([m for m in messages if m["type"] == "match"])
+        ts = pd.to_datetime(trades["time"]).values.astype(np.int64) / 1e9
+        trades = pd.DataFrame({
+            "product": trades["product_id"],
+            "ts": ts,
+            "price": trades["price"].astype(float),
+            "size": trades["size"].astype(float),
+        })
+        expected = []
+        for granularity in (20, 60):
+            bucket = trades["ts"] - trades["ts"] % granularity
+            # buckets underway at the first trade, or still open at the last, are dropped
+            keep = (bucket >= ts.min()) & (bucket + granularity + 2 <= ts.max())
+            grouped = trades[keep].groupby(["product", bucket[keep].astype(int)])
+            frame = grouped["price"].agg(["min", "max", "first", "last"])
+            frame.columns = ["low", "high", "open", "close"]
+            frame["volume"] = grouped["size"].sum()
+            frame = frame.reset_index()
+            frame.columns = ["product", "ts"] + list(frame.columns[2:])
+            frame["granularity"] = granularity
+            frame["dt"] = pd.to_datetime(frame.pop("ts"), unit="s")
+            expected.append(frame)
+        expected = sort_candles(pd.concat(expected))
+
+        self.assertEqual(aggregator.match_count, len(trades))
+        self.assertEqual(aggregator.late_count, 0)
+        self.assertEqual(len(candles), 36)
+        self.assertEqual(
+            candles[["product", "granularity", "dt"]].values.tolist(),
+            expected[["product", "granularity", "dt"]].values.tolist()
+        )
+        np.testing.assert_allclose(
+            candles[CANDLE_COLUMNS[3:]].values.astype(float),
+            expected[CANDLE_COLUMNS[3:]].values.astype(float)
+        )
+
+    def test_partial_and_late_trades_are_dropped(self):
+        aggregator = CandleAggregator(granularities=(20,), grace=2)
+        self.assertFalse(aggregator.add({"type": "heartbeat"}))
+        for message in [
+            match(5, 10.0),  # the bucket at 0 started before the stream
+            match(25, 12.0, 2.0),
+            match(30, 11.0, 0.5),
+            match(39, 13.0),
+            match(42, 9.0),  # closes the bucket at 20
+            match(38, 20.0),  # too late for it
+        ]:
+            self.assertTrue(aggregator.add(message))
+        self.assertEqual(aggregator.late_count, 1)
+        candles = aggregator.pop_closed()
+        self.assertEqual(
+            candles[CANDLE_COLUMNS].values.tolist(),
+            [['BTC-USD', 20, DT + dt.timedelta(seconds=20), 11.0, 13.0, 12.0, 13.0, 3.5]]
+        )
+        # the bucket at 40 stays open
+        self.assertEqual(list(aggregator.candles), [('BTC-USD', 20, utils.dt_to_ts(DT) + 40)])
+
+
+class QuoteStreamerTest(TransactionTestCase):
+    """ Replays close the DB connection like the listener thread does """
+
+    def test_replay_stores_closed_candles_once(self):
+        expected = CandleAggregator()
+        for message in fixture_messages():
+            expected.add(message)
+        expected = sort_candles(expected.pop_closed())
+
+        streamer = QuoteStreamer(['BTC-USD', 'ETH-USD'], log_level='ERROR')
+        streamer.replay(FIXTURE)
+        self.assertEqual(streamer.inserted_count, len(expected))
+        stored = sort_candles(pd.DataFrame(
+            list(Quote.objects.values_list(
+                'product__name', 'granularity', 'dt', 'low', 'high', 'open', 'close', 'volume'
+            )),
+            columns=CANDLE_COLUMNS
+        ))
+        self.assertEqual(
+            stored[CANDLE_COLUMNS[:3]].values.tolist(),
+            expected[CANDLE_COLUMNS[:3]].values.tolist()
+        )
+        np.testing.assert_allclose(
+            stored[CANDLE_COLUMNS[3:]].values.astype(float),
+            expected[CANDLE_COLUMNS[3:]].values.astype(float)
+        )
+
+        streamer = QuoteStreamer(['BTC-USD', 'ETH-USD'], log_level='ERROR')
+        streamer.replay(FIXTURE)
+        self.assertEqual((streamer.inserted_count, streamer.skipped_count), (0, len(expected)))
+        self.assertEqual(Quote.objects.count(), len(expected))
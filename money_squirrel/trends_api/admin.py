@@ -2,8 +2,10 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
-from models import  InterestOverTime, InterestByRegion
+from models import  InterestOverTime, InterestByRegion, StitchedInterest, TrendJob
 
 # Register your models here.
 admin.site.register(InterestOverTime)
-admin.site.register(InterestByRegion)
\ No newline at end of file
+admin.site.register(InterestByRegion)
+admin.site.register(StitchedInterest)
+admin.site.register(TrendJob)
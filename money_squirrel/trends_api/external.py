@@ -1,35 +1,112 @@
 import datetime as dt
-from time import sleep
-from requests.exceptions import ConnectionError
+import math
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 import pandas as pd
 from pytrends.request import TrendReq
+from django.db import connection
 from bin import utils
-from models import InterestByRegion, InterestOverTime
+from bin.throttle import RetryPolicy, TokenBucket
+from models import InterestByRegion, InterestOverTime, StitchedInterest, TrendJob
 
 
-KEYS = utils.load_config('keys')
+class TrendClientPool(object):
+    """
+    Logged in TrendReq sessions shared by worker threads, and the rate
+    limiter all requests to Google go through. Sessions log in on first
+    use, up to `size` of them, and each serves one thread at a time.
+    """
+
+    SIZE = 4
+    RATE_LIMIT = 0.5  # requests/sec across all sessions
+
+    def __init__(self, size=SIZE, rate=RATE_LIMIT, keys=None):
+        self.size = size
+        self.keys = keys
+        self.rate_limiter = TokenBucket(rate)
+        self.sessions = Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _login(self):
+        if self.keys is None:
+            self.keys = utils.load_config('keys')
+        return TrendReq(
+            self.keys['gmail'],
+            self.keys['gpass'],
+            tz=0
+        )
+
+    @contextmanager
+    def session(self):
+        with self.lock:
+            login = self.sessions.empty() and self.created < self.size
+            if login:
+                self.created += 1
+        if login:
+            try:
+                client = self._login()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        else:
+            client = self.sessions.get()
+        try:
+            yield client
+        finally:
+            self.sessions.put(client)
+
+
+_CLIENT_POOL = None
+_CLIENT_POOL_LOCK = threading.Lock()
+
+
+def get_client_pool(size=TrendClientPool.SIZE):
+    """
+    Process wide TrendClientPool, so every downloader shares sessions
+    and the rate limit. Grows to allow at least `size` sessions.
+    """
+    global _CLIENT_POOL
+    with _CLIENT_POOL_LOCK:
+        if _CLIENT_POOL is None:
+            _CLIENT_POOL = TrendClientPool(size)
+        with _CLIENT_POOL.lock:
+            _CLIENT_POOL.size = max(_CLIENT_POOL.size, size)
+        return _CLIENT_POOL
 
 
 class TrendDownloader(object):
 
     MODEL = None
+    VALUE_FIELDS = ('score', 'is_partial')  # stored fields outside the unique key
+    MAX_TERMS = 5  # keywords Trends accepts per payload
+    WORKERS = 4
 
-    def __init__(self, log_level=None):
-        self.client = TrendReq(
-            KEYS['gmail'],
-            KEYS['gpass'],
-            tz=0
-        )
-        self.start_dt = None
-        self.end_dt = None
-        self.request_payload = dict()
-        self.data = []
-        self.geo = None
+    def __init__(self, log_level=None, workers=WORKERS, client_pool=None):
+        self.client_pool = client_pool or get_client_pool(workers)
+        self.workers = workers
+        self.failure_count = 0
+        self.inserted_count = 0
+        self.updated_count = 0
         self.logger = utils.get_logger(__name__, log_level)
+        self.retry_policy = RetryPolicy(
+            rate_limiter=self.client_pool.rate_limiter,
+            logger=self.logger
+        )
 
-    def _download_and_clean(self):
+    def _download_and_clean(self, client, request):
         raise NotImplementedError
 
+    @staticmethod
+    def _search_terms(kw_list):
+        return ', '.join(sorted(kw_list))
+
     @staticmethod
     def _build_timeframe(start_dt, end_dt):
 
@@ -48,21 +125,121 @@ class TrendDownloader(object):
             )
             raise e
 
-    def _store(self, data):
+    def _upsert_postgres(self, data):
+        """
+        Upsert all rows of a response in one statement, passing each
+        column as an array. Rows whose values are unchanged are left
+        alone. Returns (inserted, updated) counts.
+        """
+        keys = list(self.MODEL._meta.unique_together[0])
+        values = [f for f in self.VALUE_FIELDS if f in data[0]]
+        columns = keys + values
+        fields = [self.MODEL._meta.get_field(c) for c in columns]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                insert into {table} ({columns})
+                select * from unnest({arrays})
+                on conflict ({keys}) do update
+                set {updates}
+                where ({values}) is distinct from ({excluded})
+                returning xmax = 0
+                """.format(
+                    table=self.MODEL._meta.db_table,
+                    columns=", ".join(columns),
+                    arrays=", ".join(
+                        "%s::{}[]".format(f.db_type(connection)) for f in fields
+                    ),
+                    keys=", ".join(keys),
+                    updates=", ".join("{0} = excluded.{0}".format(v) for v in values),
+                    values=", ".join("{}.{}".format(self.MODEL._meta.db_table, v) for v in values),
+                    excluded=", ".join("excluded.{}".format(v) for v in values)
+                ),
+                [[datum[c] for datum in data] for c in columns]
+            )
+            written = [row[0] for row in cursor.fetchall()]
+        inserted = sum(written)
+        return inserted, len(written) - inserted
+
+    def _upsert_generic(self, data):
+        inserted = updated = 0
         for datum in data:
-            datum['search_terms'] = ', '.join(sorted(datum['scores'].keys()))
-            record, created = self.MODEL.objects.get_or_create(**datum)
+            keys = {k: v for k, v in datum.items() if k not in self.VALUE_FIELDS}
+            record, created = self.MODEL.objects.get_or_create(
+                defaults={k: datum[k] for k in self.VALUE_FIELDS if k in datum},
+                **keys
+            )
             if created:
-                self.logger.debug(
-                    "Storing data %s",
-                    record
-                )
+                inserted += 1
+            elif any(getattr(record, k) != datum[k] for k in self.VALUE_FIELDS if k in datum):
+                for k in self.VALUE_FIELDS:
+                    if k in datum:
+                        setattr(record, k, datum[k])
                 record.save()
-            else:
-                self.logger.debug(
-                    "Record already exists: %s",
-                    record
-                )
+                updated += 1
+        return inserted, updated
+
+    def _store(self, data):
+        """
+        Insert new rows and update revised scores, keyed on the model's
+        unique key. Returns a tuple of (inserted, updated) counts.
+        """
+        if not data:
+            return 0, 0
+        # the last of any duplicates in a response wins
+        keys = self.MODEL._meta.unique_together[0]
+        data = list({tuple(datum[k] for k in keys): datum for datum in data}.values())
+        if connection.vendor == "postgresql":
+            inserted, updated = self._upsert_postgres(data)
+        else:
+            inserted, updated = self._upsert_generic(data)
+        self.inserted_count += inserted
+        self.updated_count += updated
+        self.logger.info(
+            "Stored %s new %s rows, updated %s, %s unchanged",
+            inserted,
+            self.MODEL.__name__,
+            updated,
+            len(data) - inserted - updated
+        )
+        return inserted, updated
+
+    def _request(self, kw_list, start_dt, end_dt, geo=None):
+        assert type(start_dt) is dt.datetime
+        assert type(end_dt) is dt.datetime
+        return {
+            "kw_list": list(kw_list),
+            "start_dt": start_dt.replace(minute=0, second=0, microsecond=0),
+            "end_dt": end_dt.replace(minute=0, second=0, microsecond=0),
+            "geo": geo,
+            "search_terms": self._search_terms(kw_list),
+        }
+
+    def _download(self, request):
+        """ One Trends API call on a pooled session """
+        request_payload = {
+            "kw_list": request["kw_list"],
+            "geo": request["geo"],
+            "timeframe": self._build_timeframe(request["start_dt"], request["end_dt"])
+        }
+        with self.client_pool.session() as client:
+            self.logger.debug(
+                "Building payload for Trends API client:\n%s",
+                request_payload
+            )
+            client.build_payload(**request_payload)
+            self.logger.info("Sending payload to Trends API")
+            return self._download_and_clean(client, request)
+
+    def _fetch(self, job):
+        """
+        Runs in a worker thread: download one request, retrying it with
+        backoff. Returns (job, rows, error).
+        """
+        try:
+            return job, self.retry_policy.call(self._download, job[1]), None
+        except Exception as e:
+            return job, None, e
 
     def run(
             self,
@@ -71,43 +248,85 @@ class TrendDownloader(object):
             end_dt,
             geo=None
     ):
-        assert type(start_dt) is dt.datetime
-        assert type(end_dt) is dt.datetime
-
-        self.start_dt = start_dt.replace(minute=0, second=0, microsecond=0)
-        self.end_dt = end_dt.replace(minute=0, second=0, microsecond=0)
-        self.geo = geo
-        request_payload = {
-            "kw_list": kw_list,
-            "geo": geo,
-            "timeframe": self._build_timeframe(start_dt, end_dt)
-        }
-        self.logger.debug(
-            "Building payload for Trends API client:\n%s",
-            request_payload
+        new_data = self.retry_policy.call(
+            self._download,
+            self._request(kw_list, start_dt, end_dt, geo)
         )
-        self.client.build_payload(**request_payload)
-        self.logger.info("Sending payload to Trends API")
-        new_data = self._download_and_clean()
         self._store(new_data)
+        return len(new_data)
+
+    def run_many(self, requests, max_failures=10):
+        """
+        Download (kw_list, start_dt, end_dt, geo) requests on a pool of
+        worker threads, tracked in the TrendJob ledger so restarted
+        backfills resume. Workers only talk to Google; responses are
+        stored and jobs updated on this thread. The run aborts once
+        max_failures requests have failed. Returns the rows downloaded.
+        """
+        pending = []
+        for kw_list, start_dt, end_dt, geo in requests:
+            request = self._request(kw_list, start_dt, end_dt, geo)
+            job, _ = TrendJob.objects.get_or_create(
+                report=self.MODEL.__name__,
+                search_terms=request["search_terms"],
+                geo=geo or '',
+                start_dt=request["start_dt"],
+                end_dt=request["end_dt"]
+            )
+            if job.status == TrendJob.DONE:
+                self.logger.info("Skipping window already downloaded: %s", job)
+                continue
+            pending.append((job.id, request))
+
+        row_count = 0
+        pool = ThreadPool(self.workers)
+        try:
+            for (job_id, request), new_data, error in pool.imap_unordered(self._fetch, pending):
+                if error is None:
+                    self._store(new_data)
+                    TrendJob.mark_done(job_id, len(new_data))
+                    row_count += len(new_data)
+                    continue
+                TrendJob.mark_failed(job_id, error)
+                self.failure_count += 1
+                self.logger.warn(
+                    "Window failed. Failure count: {}. Error message: {}"
+                    .format(self.failure_count, str(error))
+                )
+                if self.failure_count >= max_failures:
+                    raise RuntimeError(
+                        "{} windows failed. Aborting."
+                        .format(max_failures)
+                    )
+        finally:
+            pool.terminate()
+        return row_count
 
 
 class InterestOverTimeDownloader(TrendDownloader):
 
     MODEL = InterestOverTime
 
-    def _download_and_clean(self):
-        new_data = self.client.interest_over_time()
+    def _download_and_clean(self, client, request):
+        new_data = client.interest_over_time()
         self._validate_new_data(new_data)
-        new_data = new_data.T.to_dict()
+        if 'isPartial' in new_data:
+            is_partial = new_data.pop('isPartial').astype(bool)
+        else:
+            is_partial = pd.Series(False, index=new_data.index)
         return [
             {
-                "start_dt": self.start_dt,
-                "end_dt": self.end_dt,
-                "geo": self.geo,
-                "scores": new_data[ts],
-                "dt": ts.to_pydatetime()
-            } for ts in new_data
+                "term": term,
+                "geo": request["geo"] or '',
+                "dt": ts.to_pydatetime(),
+                "start_dt": request["start_dt"],
+                "end_dt": request["end_dt"],
+                "search_terms": request["search_terms"],
+                "score": int(score),
+                "is_partial": bool(is_partial[ts]),
+            }
+            for term in new_data
+            for ts, score in new_data[term].dropna().items()
         ]
 
 
@@ -115,65 +334,129 @@ class InterestByRegionDownloader(TrendDownloader):
 
     MODEL = InterestByRegion
 
-    def _download_and_clean(self):
-        new_data = self.client.interest_by_region()
+    def _download_and_clean(self, client, request):
+        new_data = client.interest_by_region()
         self._validate_new_data(new_data)
-        new_data = new_data.T.to_dict()
         return [
             {
-                "start_dt": self.start_dt,
-                "end_dt": self.end_dt,
+                "term": term,
                 "geo": geo,
-                "scores": new_data[geo],
-            } for geo in self.data
+                "start_dt": request["start_dt"],
+                "end_dt": request["end_dt"],
+                "search_terms": request["search_terms"],
+                "score": int(score),
+            }
+            for term in new_data
+            for geo, score in new_data[term].dropna().items()
         ]
 
 
 class IOTHourlyFromConfigDownloader(InterestOverTimeDownloader):
 
-    def __init__(self, config_name, log_level=None):
-        super(IOTHourlyFromConfigDownloader, self).__init__(log_level=log_level)
+    WINDOW_HOURS = 168  # longest timeframe Trends still serves hourly
+    OVERLAP = 1  # hourly points neighbouring windows share, for stitching
+
+    def __init__(
+            self,
+            config_name,
+            log_level=None,
+            workers=TrendDownloader.WORKERS,
+            client_pool=None
+    ):
+        super(IOTHourlyFromConfigDownloader, self).__init__(
+            log_level=log_level,
+            workers=workers,
+            client_pool=client_pool
+        )
         self.config = utils.load_config('interest_over_time')[config_name]
 
-    def run(self, start_dt, end_dt, max_failures=10, tags=True):
+    def _batches(self, tags=True):
+        """
+        kw_lists requested per window: the config terms, then every
+        term/tag combination, each packed into payloads of MAX_TERMS
+        """
+        keywords = [list(self.config['kw_list'])]
+        if tags:
+            keywords.append([
+                ' '.join([term, tag])
+                for term in self.config['kw_list']
+                for tag in self.config.get('tags', [])
+            ])
+        return [
+            group[i:i + self.MAX_TERMS]
+            for group in keywords
+            for i in range(0, len(group), self.MAX_TERMS)
+        ]
 
-        # Go back in time starting with end date.
-        # use weekly pulls to get hourly data
-        # We should get 1 datapoint of overlap
-        current_end_dt = end_dt
-        current_start_dt = end_dt - dt.timedelta(days=7)
-        failure_count = 0
-        while current_end_dt > start_dt:
-            try:
-                # get all of the search terms
-                super(IOTHourlyFromConfigDownloader, self).run(
-                    self.config['kw_list'],
-                    start_dt=current_start_dt,
-                    end_dt=current_end_dt
-                )
-                # get each search term with tags
-                if tags:
-                    for term in self.config['kw_list']:
-                        kw_list = [' '.join([term, tag]) for tag in self.config['tags']]
-                        super(IOTHourlyFromConfigDownloader, self).run(
-                            kw_list,
-                            start_dt=current_start_dt,
-                            end_dt=current_end_dt
-                        )
-                current_end_dt = current_end_dt - dt.timedelta(hours=1)
-                current_start_dt = current_end_dt - dt.timedelta(days=7)
-            except ConnectionError:
-                failure_count += 1
-                self.logger.warn(
-                    "HTTP Connection failure. Failure count: {}"
-                    .format(failure_count)
+    def _windows(self, start_dt, end_dt, overlap=OVERLAP):
+        """
+        Weekly windows covering [start_dt, end_dt], newest first, with
+        neighbours sharing `overlap` hourly points. Windows sit on a fixed
+        grid from the epoch so later runs find earlier ones in the
+        ledger; only the newest is cut short at end_dt.
+        """
+        assert 1 <= overlap < self.WINDOW_HOURS
+        window = self.WINDOW_HOURS * 3600
+        step = (self.WINDOW_HOURS - overlap + 1) * 3600
+        start_ts = utils.dt_to_ts(start_dt)
+        end_ts = utils.dt_to_ts(end_dt.replace(minute=0, second=0, microsecond=0))
+        first = int(math.ceil((start_ts - window) / float(step)))
+        last = int(end_ts // step)
+        for k in range(last, first - 1, -1):
+            window_start = k * step
+            window_end = min(window_start + window, end_ts)
+            if window_end > window_start:
+                yield (
+                    dt.datetime.utcfromtimestamp(window_start),
+                    dt.datetime.utcfromtimestamp(window_end)
                 )
-                sleep(60)
-                if failure_count >= max_failures:
-                    raise RuntimeError(
-                        "{} HTTP connection errors. Aborting."
-                        .format(max_failures)
-                    )
+
+    def plan(self, start_dt, end_dt, tags=True, overlap=OVERLAP):
+        """
+        (kw_list, start_dt, end_dt) requests needed to cover the range,
+        leaving out those already done in the TrendJob ledger.
+        """
+        windows = list(self._windows(start_dt, end_dt, overlap))
+        batches = self._batches(tags)
+        done = set(TrendJob.objects.filter(
+            report=self.MODEL.__name__,
+            geo='',
+            status=TrendJob.DONE,
+            search_terms__in=[self._search_terms(kw_list) for kw_list in batches],
+            start_dt__in=[window_start for window_start, _ in windows]
+        ).values_list('search_terms', 'start_dt', 'end_dt'))
+        requests = [
+            (kw_list, window_start, window_end)
+            for window_start, window_end in windows
+            for kw_list in batches
+            if (self._search_terms(kw_list), window_start, window_end) not in done
+        ]
+        self.logger.info(
+            "Planned %s Trends requests: %s windows x %s keyword batches, %s already stored",
+            len(requests),
+            len(windows),
+            len(batches),
+            len(windows) * len(batches) - len(requests)
+        )
+        return requests
+
+    def run(self, start_dt, end_dt, max_failures=10, tags=True, overlap=OVERLAP):
+
+        self.failure_count = 0
+        requests = self.plan(start_dt, end_dt, tags, overlap)
+        try:
+            self.run_many(
+                [(kw_list, window_start, window_end, None)
+                 for kw_list, window_start, window_end in requests],
+                max_failures=max_failures
+            )
+        finally:
+            if requests:
+                written = StitchedInterest.refresh(search_terms=set(
+                    self._search_terms(kw_list) for kw_list, _, _ in requests
+                ))
+                self.logger.info("Stitched %s hourly scores", written)
+        return len(requests)
 
 
 class IBRDailyFromConfigDownloader(InterestByRegionDownloader):
@@ -184,31 +467,20 @@ class IBRDailyFromConfigDownloader(InterestByRegionDownloader):
 
     def run(self, start_dt, end_dt, max_failures=0):
 
-        # Go back in time starting with end date.
-        # use weekly pulls to get hourly data
-        # We should get 1 datapoint of overlap
+        # Go back in time starting with end date, one day per request
+        requests = []
         current_end_dt = end_dt
         current_start_dt = end_dt - dt.timedelta(days=1)
-        failure_count = 0
+        self.failure_count = 0
         while current_end_dt > start_dt:
-            try:
-                # get all of the search terms
-                super(InterestByRegionDownloader, self).run(
-                    self.config['kw_list'],
-                    start_dt=current_start_dt,
-                    end_dt=current_end_dt
-                )
-                current_end_dt = current_start_dt
-                current_start_dt = current_end_dt - dt.timedelta(days=1)
-            except ConnectionError:
-                failure_count += 1
-                self.logger.warn(
-                    "HTTP Connection failure. Failure count: {}"
-                    .format(failure_count)
-                )
-                sleep(60)
-                if failure_count >= max_failures:
-                    raise RuntimeError(
-                        "{} HTTP connection errors. Aborting."
-                        .format(max_failures)
-                    )
+            # get all of the search terms
+            for i in range(0, len(self.config['kw_list']), self.MAX_TERMS):
+                requests.append((
+                    self.config['kw_list'][i:i + self.MAX_TERMS],
+                    current_start_dt,
+                    current_end_dt,
+                    None
+                ))
+            current_end_dt = current_start_dt
+            current_start_dt = current_end_dt - dt.timedelta(days=1)
+        return self.run_many(requests, max_failures=max_failures)
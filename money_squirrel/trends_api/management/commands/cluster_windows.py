@@ -0,0 +1,85 @@
+import datetime as dt
+from dateutil.parser import parse as dt_parse
+from django.core.management.base import BaseCommand
+from bin import utils
+from etl.clusters import ClusterFeatures
+
+
+class Command(BaseCommand):
+    help = """
+    Cluster windows of stitched Trends scores and prices, storing the
+    distance of each window to every cluster as compact float32
+    features under data/clusters/<config>/. Later runs carry on from
+    the last stored bar and keep updating the same centroids.
+    """
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            '--start_date',
+            type=str,
+            dest='start_date',
+            nargs=1,
+            help='First bar to cluster. Defaults to just after the last stored bar'
+        )
+        parser.add_argument(
+            '--end_date',
+            type=str,
+            dest='end_date',
+            nargs=1,
+            help='Last bar to cluster. Defaults UTC now'
+        )
+        parser.add_argument(
+            '--config',
+            type=str,
+            default='coins',
+            help='Choose a keyword config from config/interest_over_time.json'
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=16,
+            help='Number of clusters. Only used the first time a config is clustered'
+        )
+        parser.add_argument(
+            '--length',
+            type=int,
+            default=24,
+            help='Bars per window. Only used the first time a config is clustered'
+        )
+        parser.add_argument(
+            '--no_prices',
+            action='store_true',
+            help='Cluster Trends windows only'
+        )
+        parser.add_argument(
+            '--log_level',
+            type=str,
+            dest='log_level',
+            nargs=1,
+            help='Python logging level'
+        )
+
+    def handle(self, *args, **options):
+
+        if options['end_date']:
+            end_date = dt_parse(options['end_date'][0])
+        else:
+            end_date = dt.datetime.utcnow()
+        # stitched scores are hourly
+        end_date = end_date.replace(minute=0, second=0, microsecond=0)
+        start_date = dt_parse(options['start_date'][0]) if options['start_date'] else None
+
+        config = utils.load_config('interest_over_time')[options['config']]
+        features = ClusterFeatures(
+            options['config'],
+            terms=config['kw_list'],
+            product_list=() if options['no_prices'] else utils.PRODUCT_LIST,
+            k=options['k'],
+            length=options['length'],
+            log_level=options['log_level'][0] if options['log_level'] else 'INFO'
+        )
+        if start_date is None and features.last_dt() is None:
+            start_date = end_date - dt.timedelta(days=30)
+        written = features.update(end_date, start_date)
+        self.stdout.write("Wrote {} bars of cluster distances".format(written))
@@ -38,7 +38,16 @@ class Command(BaseCommand):
             type=int,
             dest='max_failures',
             nargs=1,
-            help='How many HTTP failures before shut down?'
+            help='How many windows may fail, after retrying each, before shut down?'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            nargs=1,
+            help='Parallel Trends sessions. Default {}'.format(
+                IOTHourlyFromConfigDownloader.WORKERS
+            )
         )
         parser.add_argument(
             '--log_level',
@@ -52,6 +61,20 @@ class Command(BaseCommand):
             action='store_true',
             help='Download search terms with tags'
         )
+        parser.add_argument(
+            '--overlap',
+            type=int,
+            dest='overlap',
+            nargs=1,
+            help='Hourly points shared by neighbouring weekly windows. Default {}'.format(
+                IOTHourlyFromConfigDownloader.OVERLAP
+            )
+        )
+        parser.add_argument(
+            '--plan_only',
+            action='store_true',
+            help='Report how many requests the download needs and exit'
+        )
 
     def handle(self, *args, **options):
 
@@ -68,13 +91,25 @@ class Command(BaseCommand):
         config = options['config'] if options['config'] else 'coins'
         max_failures = options['max_failures'][0] if options['max_failures'] else 10
         log_level = options['log_level'][0] if options['log_level'] else 'INFO'
+        overlap = options['overlap'][0] \
+            if options['overlap'] \
+            else IOTHourlyFromConfigDownloader.OVERLAP
 
         assert end_date > start_date
 
-        downloader = IOTHourlyFromConfigDownloader(config, log_level)
+        workers = options['workers'][0] \
+            if options['workers'] \
+            else IOTHourlyFromConfigDownloader.WORKERS
+
+        downloader = IOTHourlyFromConfigDownloader(config, log_level, workers)
+        if options['plan_only']:
+            requests = downloader.plan(start_date, end_date, options['tags'], overlap)
+            self.stdout.write("{} Trends requests planned".format(len(requests)))
+            return
         downloader.run(
             start_dt=start_date,
             end_dt=end_date,
             max_failures=max_failures,
-            tags=options['tags']
+            tags=options['tags'],
+            overlap=overlap
         )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from trends_api.models import StitchedInterest
+
+
+class Command(BaseCommand):
+    help = """
+    Stitch downloaded InterestOverTime windows into continuous series.
+    download_trends does this for what it downloads, so this is for
+    windows loaded some other way or before stitching existed.
+    Only new or re-downloaded windows are processed.
+    """
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            '--term',
+            type=str,
+            dest='term',
+            nargs='*',
+            help='Terms to stitch. Defaults to every term'
+        )
+        parser.add_argument(
+            '--geo',
+            type=str,
+            dest='geo',
+            nargs=1,
+            help='Geo to stitch. Defaults to worldwide'
+        )
+
+    def handle(self, *args, **options):
+
+        written = StitchedInterest.refresh(
+            terms=options['term'] or None,
+            geo=options['geo'][0] if options['geo'] else ''
+        )
+        self.stdout.write("Wrote {} stitched scores".format(written))
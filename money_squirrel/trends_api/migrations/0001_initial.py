@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterestByRegion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geo', models.CharField(max_length=100)),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+                ('search_terms', models.CharField(blank=True, default=None, max_length=200, null=True)),
+                ('scores', django.contrib.postgres.fields.jsonb.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InterestOverTime',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geo', models.CharField(blank=True, default=None, max_length=100, null=True)),
+                ('dt', models.DateTimeField(blank=True, default=None, null=True)),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+                ('search_terms', models.CharField(blank=True, default=None, max_length=200, null=True)),
+                ('scores', django.contrib.postgres.fields.jsonb.JSONField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trends_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('row_count', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('report', models.CharField(max_length=30)),
+                ('search_terms', models.CharField(max_length=200)),
+                ('geo', models.CharField(blank=True, default='', max_length=100)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='trendjob',
+            unique_together=set([('report', 'search_terms', 'geo', 'start_dt', 'end_dt')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trends_api', '0002_trendjob'),
+    ]
+
+    operations = [
+        migrations.RenameModel('InterestByRegion', 'InterestByRegionJson'),
+        migrations.RenameModel('InterestOverTime', 'InterestOverTimeJson'),
+        migrations.CreateModel(
+            name='InterestByRegion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('geo', models.CharField(max_length=100)),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+                ('search_terms', models.CharField(max_length=200)),
+                ('score', models.SmallIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InterestOverTime',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('geo', models.CharField(blank=True, default='', max_length=100)),
+                ('dt', models.DateTimeField()),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+                ('search_terms', models.CharField(max_length=200)),
+                ('score', models.SmallIntegerField()),
+                ('is_partial', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='interestbyregion',
+            unique_together=set([('term', 'geo', 'search_terms', 'start_dt', 'end_dt')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='interestovertime',
+            unique_together=set([('term', 'geo', 'dt', 'search_terms', 'start_dt', 'end_dt')]),
+        ),
+    ]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# search_terms is rebuilt from the JSON keys, sorted by code point like
+# python's sorted(), since the old downloader counted isPartial as a term.
+# Re-downloads with different scores were stored as separate rows; the
+# newest one wins.
+POPULATE_IOT = """
+insert into trends_api_interestovertime
+    (term, geo, dt, start_dt, end_dt, search_terms, score, is_partial)
+select distinct on (s.key, coalesce(o.geo, ''), o.dt, terms.search_terms, o.start_dt, o.end_dt)
+    s.key
+    , coalesce(o.geo, '')
+    , o.dt
+    , o.start_dt
+    , o.end_dt
+    , terms.search_terms
+    , round(s.value::numeric)::smallint
+    , coalesce((o.scores ->> 'isPartial')::boolean, false)
+from trends_api_interestovertimejson o
+cross join lateral (
+    select array_to_string(array(
+        select k
+        from jsonb_object_keys(o.scores) k
+        where k <> 'isPartial'
+        order by k collate "C"
+    ), ', ') as search_terms
+) terms
+cross join lateral jsonb_each_text(o.scores) s
+where s.key <> 'isPartial'
+    and s.value is not null
+    and o.dt is not null
+order by s.key, coalesce(o.geo, ''), o.dt, terms.search_terms, o.start_dt, o.end_dt, o.id desc
+"""
+
+POPULATE_IBR = """
+insert into trends_api_interestbyregion
+    (term, geo, start_dt, end_dt, search_terms, score)
+select distinct on (s.key, o.geo, terms.search_terms, o.start_dt, o.end_dt)
+    s.key
+    , o.geo
+    , o.start_dt
+    , o.end_dt
+    , terms.search_terms
+    , round(s.value::numeric)::smallint
+from trends_api_interestbyregionjson o
+cross join lateral (
+    select array_to_string(array(
+        select k
+        from jsonb_object_keys(o.scores) k
+        order by k collate "C"
+    ), ', ') as search_terms
+) terms
+cross join lateral jsonb_each_text(o.scores) s
+where s.value is not null
+order by s.key, o.geo, terms.search_terms, o.start_dt, o.end_dt, o.id desc
+"""
+
+UNPOPULATE_IOT = """
+insert into trends_api_interestovertimejson
+    (geo, dt, start_dt, end_dt, search_terms, scores)
+select nullif(geo, '')
+    , dt
+    , start_dt
+    , end_dt
+    , search_terms
+    , jsonb_object_agg(term, score) || jsonb_build_object('isPartial', bool_or(is_partial))
+from trends_api_interestovertime
+group by geo, dt, start_dt, end_dt, search_terms
+"""
+
+UNPOPULATE_IBR = """
+insert into trends_api_interestbyregionjson
+    (geo, start_dt, end_dt, search_terms, scores)
+select geo
+    , start_dt
+    , end_dt
+    , search_terms
+    , jsonb_object_agg(term, score)
+from trends_api_interestbyregion
+group by geo, start_dt, end_dt, search_terms
+"""
+
+
+def postgres_sql(sql):
+    """
+    Run sql on postgres only. The JSON tables are jsonb, so other
+    databases never held scores to convert.
+    """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trends_api', '0003_score_tables'),
+    ]
+
+    operations = [
+        migrations.RunPython(postgres_sql(POPULATE_IOT), postgres_sql(UNPOPULATE_IOT)),
+        migrations.RunPython(postgres_sql(POPULATE_IBR), postgres_sql(UNPOPULATE_IBR)),
+    ]
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trends_api', '0004_populate_scores'),
+    ]
+
+    operations = [
+        migrations.DeleteModel('InterestByRegionJson'),
+        migrations.DeleteModel('InterestOverTimeJson'),
+    ]
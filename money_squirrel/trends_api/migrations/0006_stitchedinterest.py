@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trends_api', '0005_drop_json_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StitchedInterest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('geo', models.CharField(blank=True, default='', max_length=100)),
+                ('search_terms', models.CharField(max_length=200)),
+                ('dt', models.DateTimeField()),
+                ('score', models.FloatField()),
+                ('scale', models.FloatField()),
+                ('start_dt', models.DateTimeField()),
+                ('end_dt', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='stitchedinterest',
+            unique_together=set([('term', 'geo', 'search_terms', 'dt')]),
+        ),
+    ]
@@ -1,46 +1,273 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.db import models
-from django.contrib.postgres.fields import JSONField
+import numpy as np
+import pandas as pd
+from django.db import models, transaction
+from django.db.models import F, Max
 from django.utils.encoding import python_2_unicode_compatible
+from bin.ledger import DownloadJob
 
 
 @python_2_unicode_compatible
 class InterestByRegion(models.Model):
+    """
+    One row per term and region. Scores are only comparable within the
+    batch of search_terms and the window they were requested with.
+    """
 
+    term = models.CharField(max_length=100)
     geo = models.CharField(max_length=100)
     start_dt = models.DateTimeField()
     end_dt = models.DateTimeField()
-    search_terms = models.CharField(max_length=200, default=None, blank=True, null=True)
-    scores = JSONField()
+    search_terms = models.CharField(max_length=200)
+    score = models.SmallIntegerField()
+
+    class Meta:
+        # leading (term, geo) also serves per term lookups
+        unique_together = (('term', 'geo', 'search_terms', 'start_dt', 'end_dt'),)
 
     def __str__(self):
         return str({
+            "term": self.term,
             "geo": self.geo,
             "start_dt": self.start_dt,
-            "end_dt": self.start_dt,
-            "scores": self.scores,
+            "end_dt": self.end_dt,
+            "score": self.score,
             "search_terms": self.search_terms
         })
 
 
 @python_2_unicode_compatible
 class InterestOverTime(models.Model):
+    """
+    One row per term and time step. geo is '' for worldwide. Scores are
+    only comparable within the batch of search_terms and the window
+    they were requested with.
+    """
 
-    geo = models.CharField(max_length=100, default=None, blank=True, null=True)
-    dt = models.DateTimeField(default=None, blank=True, null=True)
+    term = models.CharField(max_length=100)
+    geo = models.CharField(max_length=100, default='', blank=True)
+    dt = models.DateTimeField()
     start_dt = models.DateTimeField()
     end_dt = models.DateTimeField()
-    search_terms = models.CharField(max_length=200, default=None, blank=True, null=True)
-    scores = JSONField()
+    search_terms = models.CharField(max_length=200)
+    score = models.SmallIntegerField()
+    is_partial = models.BooleanField(default=False)
+
+    class Meta:
+        # leading (term, geo, dt) also serves series lookups
+        unique_together = (('term', 'geo', 'dt', 'search_terms', 'start_dt', 'end_dt'),)
 
     def __str__(self):
         return str({
+            "term": self.term,
             "geo": self.geo,
             "dt": self.dt,
             "start_dt": self.start_dt,
             "end_dt": self.end_dt,
-            "scores": self.scores,
+            "score": self.score,
             "search_terms": self.search_terms
         })
+
+
+@python_2_unicode_compatible
+class StitchedInterest(models.Model):
+    """
+    InterestOverTime windows chained into one continuous hourly series
+    per term, geo and batch of search_terms. Each window is rescaled so
+    it agrees with its neighbours where they overlap; where windows
+    overlap the newer one is kept. Scales are relative to the first
+    window ever stitched for the series, so new windows never rescale
+    stored ones and refresh() only reads what changed.
+    etl.trends.load_stitched_interest rebases onto the newest window.
+    """
+
+    term = models.CharField(max_length=100)
+    geo = models.CharField(max_length=100, default='', blank=True)
+    search_terms = models.CharField(max_length=200)
+    dt = models.DateTimeField()
+    score = models.FloatField()  # raw score * scale
+    scale = models.FloatField()
+    start_dt = models.DateTimeField()  # window the score came from
+    end_dt = models.DateTimeField()
+
+    class Meta:
+        unique_together = (('term', 'geo', 'search_terms', 'dt'),)
+
+    def __str__(self):
+        return str({
+            "term": self.term,
+            "geo": self.geo,
+            "search_terms": self.search_terms,
+            "dt": self.dt,
+            "score": self.score,
+            "scale": self.scale,
+        })
+
+    @classmethod
+    def refresh(cls, terms=None, geo='', search_terms=None):
+        """
+        Stitch new or re-downloaded windows of every matching series.
+        Returns the number of rows written.
+        """
+        series = InterestOverTime.objects.filter(geo=geo)
+        if terms is not None:
+            series = series.filter(term__in=list(terms))
+        if search_terms is not None:
+            series = series.filter(search_terms__in=list(search_terms))
+        written = 0
+        for term, batch in series.values_list('term', 'search_terms').distinct():
+            written += cls._refresh_series(term, geo, batch)
+        return written
+
+    @staticmethod
+    def _log_ratios(matrix):
+        """
+        log(scale[i] / scale[i - 1]) which makes each pair of neighbouring
+        window columns agree on the sum of their overlapping scores.
+        NaN where they don't overlap or the overlap is all zeros.
+        """
+        both = ~np.isnan(matrix[:, 1:]) & ~np.isnan(matrix[:, :-1])
+        newer = np.where(both, matrix[:, 1:], 0.0).sum(axis=0)
+        older = np.where(both, matrix[:, :-1], 0.0).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.log(older) - np.log(newer)
+        ratios[~np.isfinite(ratios)] = np.nan
+        return ratios
+
+    @staticmethod
+    def _chain(log_ratios, stored_log_scales):
+        """
+        Log scale per window from neighbour ratios. Each run of linked
+        windows is pinned to its newest already stored window, or else
+        its newest window gets scale 1.
+        """
+        n = len(stored_log_scales)
+        breaks = np.isnan(log_ratios)
+        segment = np.concatenate([[0], np.cumsum(breaks)])
+        total = np.concatenate([[0.0], np.cumsum(np.where(breaks, 0.0, log_ratios))])
+        log_scales = np.empty(n)
+        for s in np.unique(segment):
+            members = np.flatnonzero(segment == s)
+            cum = total[members] - total[members[0]]
+            pinned = members[~np.isnan(stored_log_scales[members])]
+            if len(pinned):
+                anchor = np.searchsorted(members, pinned[-1])
+                offset = stored_log_scales[pinned[-1]] - cum[anchor]
+            else:
+                offset = -cum[-1]
+            log_scales[members] = cum + offset
+        return log_scales
+
+    @classmethod
+    def _refresh_series(cls, term, geo, search_terms):
+        raw = InterestOverTime.objects.filter(
+            term=term,
+            geo=geo,
+            search_terms=search_terms
+        )
+        stitched = cls.objects.filter(term=term, geo=geo, search_terms=search_terms)
+        # the latest download of each window start wins
+        windows = sorted(
+            raw.values('start_dt').annotate(latest_end_dt=Max('end_dt'))
+            .values_list('start_dt', 'latest_end_dt')
+        )
+        stored = {
+            start_dt: (end_dt, scale)
+            for start_dt, end_dt, scale
+            in stitched.values_list('start_dt', 'end_dt', 'scale').distinct()
+        }
+        starts = [start_dt for start_dt, _ in windows]
+        fresh = np.array([
+            stored.get(start_dt, (None, None))[0] != end_dt
+            for start_dt, end_dt in windows
+        ])
+        if not fresh.any():
+            return 0
+        stored_scales = np.array([
+            np.nan if is_fresh else stored[start_dt][1]
+            for (start_dt, _), is_fresh in zip(windows, fresh)
+        ])
+
+        # raw scores are only read for fresh windows and their neighbours
+        needed = fresh.copy()
+        needed[1:] |= fresh[:-1]
+        needed[:-1] |= fresh[1:]
+        needed_windows = set(w for w, is_needed in zip(windows, needed) if is_needed)
+        scores = pd.DataFrame(
+            list(raw.filter(
+                start_dt__in=[start_dt for start_dt, _ in needed_windows]
+            ).values_list('start_dt', 'end_dt', 'dt', 'score')),
+            columns=['start_dt', 'end_dt', 'dt', 'score']
+        )
+        scores = scores[[
+            (start_dt, end_dt) in needed_windows
+            for start_dt, end_dt in zip(scores['start_dt'], scores['end_dt'])
+        ]]
+        matrix = scores.pivot(index='dt', columns='start_dt', values='score') \
+            .reindex(columns=starts).astype(np.float64)
+
+        log_ratios = cls._log_ratios(matrix.values)
+        # ratios between stored windows are already settled
+        settled = ~fresh[1:] & ~fresh[:-1]
+        log_ratios[settled] = np.diff(np.log(stored_scales))[settled]
+        scales = np.exp(cls._chain(log_ratios, np.log(stored_scales)))
+
+        written = 0
+        with transaction.atomic():
+            for i, (start_dt, end_dt) in enumerate(windows):
+                if not fresh[i]:
+                    old_scale = stored_scales[i]
+                    if abs(scales[i] - old_scale) > 1e-9 * abs(old_scale):
+                        written += stitched.filter(start_dt=start_dt).update(
+                            score=F('score') * float(scales[i] / old_scale),
+                            scale=float(scales[i])
+                        )
+                    continue
+                # a window owns hours until the next window starts
+                column = matrix[start_dt].dropna()
+                column = column[column.index >= start_dt]
+                replaced = stitched.filter(dt__gte=start_dt)
+                if i + 1 < len(windows):
+                    column = column[column.index < starts[i + 1]]
+                    replaced = replaced.filter(dt__lt=starts[i + 1])
+                replaced.delete()
+                cls.objects.bulk_create([
+                    cls(
+                        term=term,
+                        geo=geo,
+                        search_terms=search_terms,
+                        dt=hour.to_pydatetime(),
+                        score=float(score * scales[i]),
+                        scale=float(scales[i]),
+                        start_dt=start_dt,
+                        end_dt=end_dt
+                    )
+                    for hour, score in column.items()
+                ])
+                written += len(column)
+        return written
+
+
+@python_2_unicode_compatible
+class TrendJob(DownloadJob):
+
+    report = models.CharField(max_length=30)  # name of the model downloaded to
+    search_terms = models.CharField(max_length=200)
+    geo = models.CharField(max_length=100, default='', blank=True)
+
+    class Meta:
+        unique_together = (('report', 'search_terms', 'geo', 'start_dt', 'end_dt'),)
+
+    def __str__(self):
+        return str({
+            "report": self.report,
+            "search_terms": self.search_terms,
+            "geo": self.geo,
+            "start_dt": self.start_dt,
+            "end_dt": self.end_dt,
+            "status": self.status,
+            "attempts": self.attempts,
+            "row_count": self.row_count,
+        })
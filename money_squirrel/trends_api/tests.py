@@ -1,6 +1,358 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import datetime as dt
+import time
+from timeit import default_timer
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from bin import utils
+from trends_api.external import (
+    InterestOverTimeDownloader, IOTHourlyFromConfigDownloader, TrendClientPool
+)
+from trends_api.models import InterestByRegion, InterestOverTime, StitchedInterest, TrendJob
 
-from django.test import TestCase
+DT = dt.datetime(2017, 1, 1)
+HOUR = dt.timedelta(hours=1)
 
-# Create your tests here.
+
+class ScoreMigrationTest(TransactionTestCase):
+    """ Migration 0004 moving JSON scores into typed long tables """
+
+    def migrate(self, name=None):
+        """ Migrate trends_api to `name` (default latest), returning its apps """
+        executor = MigrationExecutor(connection)
+        targets = [('trends_api', name)] if name \
+            else executor.loader.graph.leaf_nodes('trends_api')
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def test_scores_become_rows(self):
+        apps = self.migrate('0003_score_tables')
+        InterestOverTimeJson = apps.get_model('trends_api', 'InterestOverTimeJson')
+        InterestByRegionJson = apps.get_model('trends_api', 'InterestByRegionJson')
+        window = dict(start_dt=DT - 7 * 24 * HOUR, end_dt=DT + 24 * HOUR)
+        for geo, hour, scores in [
+            (None, 0, {'bitcoin': 50, 'Ethereum': 20, 'isPartial': False}),
+            # downloaded again later, so this one wins
+            (None, 0, {'bitcoin': 55, 'Ethereum': 20, 'isPartial': True}),
+            ('US', 1, {'bitcoin': 30.4, 'isPartial': False}),
+            (None, 2, {'bitcoin': None, 'Ethereum': 10}),
+        ]:
+            InterestOverTimeJson.objects.create(
+                geo=geo,
+                dt=DT + hour * HOUR,
+                search_terms='bitcoin, Ethereum, isPartial',
+                scores=scores,
+                **window
+            )
+        InterestByRegionJson.objects.create(
+            geo='US',
+            search_terms='bitcoin, litecoin',
+            scores={'litecoin': 3, 'bitcoin': 80},
+            **window
+        )
+
+        self.migrate()
+        self.assertEqual(
+            sorted(InterestOverTime.objects.values_list(
+                'term', 'geo', 'dt', 'search_terms', 'score', 'is_partial'
+            )),
+            [
+                ('Ethereum', '', DT, 'Ethereum, bitcoin', 20, True),
+                ('Ethereum', '', DT + 2 * HOUR, 'Ethereum, bitcoin', 10, False),
+                ('bitcoin', '', DT, 'Ethereum, bitcoin', 55, True),
+                ('bitcoin', 'US', DT + HOUR, 'bitcoin', 30, False),
+            ]
+        )
+        self.assertEqual(
+            set(InterestOverTime.objects.values_list('start_dt', 'end_dt')),
+            {(window['start_dt'], window['end_dt'])}
+        )
+        self.assertEqual(
+            sorted(InterestByRegion.objects.values_list('term', 'geo', 'search_terms', 'score')),
+            [('bitcoin', 'US', 'bitcoin, litecoin', 80), ('litecoin', 'US', 'bitcoin, litecoin', 3)]
+        )
+
+
+class StubTrendClient(object):
+    """
+    Stands in for a TrendReq session, serving hourly scores for every
+    hour of the requested timeframe. Scores of even hours go up by
+    `revision`, like Trends revising its sample.
+    """
+
+    def __init__(self):
+        self.revision = 0
+        self.requests = 0
+        self.payload = None
+
+    def build_payload(self, kw_list, geo, timeframe):
+        self.payload = dict(kw_list=kw_list, geo=geo, timeframe=timeframe)
+
+    def score(self, term, hour):
+        return (7 * hour + len(term)) % 90 + (self.revision if hour % 2 == 0 else 0)
+
+    def interest_over_time(self):
+        self.requests += 1
+        start_dt, end_dt = [
+            dt.datetime.strptime(d, utils.ISO_HOURLY)
+            for d in self.payload['timeframe'].split(' ')
+        ]
+        index = pd.date_range(start_dt, end_dt, freq='H')
+        hours = ((index - pd.Timestamp(DT)) // pd.Timedelta(hours=1)).values
+        frame = pd.DataFrame({
+            term: [self.score(term, h) for h in hours]
+            for term in self.payload['kw_list']
+        }, index=index)
+        frame['isPartial'] = index == index[-1]
+        return frame
+
+
+class StubClientPool(TrendClientPool):
+    """ A TrendClientPool whose sessions all share one StubTrendClient """
+
+    def __init__(self, client=None, **kwargs):
+        kwargs.setdefault('rate', 1000)
+        super(StubClientPool, self).__init__(**kwargs)
+        self.client = client or StubTrendClient()
+
+    def _login(self):
+        return self.client
+
+
+class TrendUpsertTest(TestCase):
+
+    def test_revised_scores_are_updated(self):
+        self.assertEqual(connection.vendor, 'postgresql')
+        pool = StubClientPool()
+        kw_list, start_dt, end_dt = ['bitcoin', 'ethereum'], DT, DT + 9 * HOUR
+
+        def run():
+            downloader = InterestOverTimeDownloader(client_pool=pool)
+            rows = downloader.run(kw_list, start_dt, end_dt)
+            return rows, downloader.inserted_count, downloader.updated_count
+
+        self.assertEqual(run(), (20, 20, 0))
+        # the same window again, with every even hour revised
+        pool.client.revision = 5
+        self.assertEqual(run(), (20, 0, 10))
+        self.assertEqual(run(), (20, 0, 0))
+        self.assertEqual(
+            sorted(InterestOverTime.objects.values_list('term', 'dt', 'score', 'is_partial')),
+            [
+                (term, DT + h * HOUR, pool.client.score(term, h), h == 9)
+                for term in kw_list
+                for h in range(10)
+            ]
+        )
+
+
+class CheckoutClient(StubTrendClient):
+    """ A slow session which fails if two threads use it at once """
+
+    def build_payload(self, **payload):
+        assert not getattr(self, 'busy', False), "session shared between threads"
+        self.busy = True
+        super(CheckoutClient, self).build_payload(**payload)
+
+    def interest_over_time(self):
+        time.sleep(0.05)
+        self.busy = False
+        return super(CheckoutClient, self).interest_over_time()
+
+
+class CheckoutPool(TrendClientPool):
+
+    def __init__(self, login_errors=(), **kwargs):
+        super(CheckoutPool, self).__init__(**kwargs)
+        self.login_errors = list(login_errors)
+        self.logins = 0
+
+    def _login(self):
+        self.logins += 1
+        if self.login_errors:
+            raise self.login_errors.pop(0)
+        return CheckoutClient()
+
+
+class TrendClientPoolTest(TestCase):
+
+    def test_concurrent_checkout(self):
+        pool = CheckoutPool(size=3, rate=50)
+        downloader = InterestOverTimeDownloader(workers=4, client_pool=pool)
+        requests = [
+            (['bitcoin'], DT + 10 * i * HOUR, DT + (10 * i + 9) * HOUR, None)
+            for i in range(12)
+        ]
+        started = default_timer()
+        self.assertEqual(downloader.run_many(requests), 120)
+        # one token per request at 50 per second, after the first
+        self.assertGreaterEqual(default_timer() - started, 11 / 50.0)
+        self.assertEqual(downloader.failure_count, 0)
+        # requests overlapped, on at most `size` sessions, and every one was returned
+        self.assertTrue(2 <= pool.created <= 3)
+        self.assertEqual(pool.logins, pool.created)
+        self.assertEqual(pool.sessions.qsize(), pool.created)
+
+    def test_sessions_are_reused(self):
+        pool = CheckoutPool(login_errors=[ValueError()], size=2)
+        with self.assertRaises(ValueError):
+            with pool.session():
+                pass
+        # a failed login doesn't count towards the size
+        self.assertEqual(pool.created, 0)
+        with pool.session() as first:
+            with pool.session() as second:
+                self.assertIsNot(first, second)
+        with pool.session() as client:
+            self.assertIn(client, (first, second))
+        self.assertEqual((pool.logins, pool.created), (3, 2))
+
+
+class TrendPlanTest(TestCase):
+
+    start_dt = dt.datetime(2017, 1, 1, 5, 30)
+    end_dt = dt.datetime(2017, 1, 29, 17, 45)
+
+    def setUp(self):
+        self.pool = StubClientPool()
+        self.downloader = IOTHourlyFromConfigDownloader('coins', client_pool=self.pool)
+
+    def test_windows(self):
+        week = 168 * HOUR
+        for overlap in (1, 3, 24):
+            step = (168 - overlap + 1) * HOUR
+            windows = list(self.downloader._windows(self.start_dt, self.end_dt, overlap))
+            # newest first, on a grid of steps from the epoch
+            for start, end in windows:
+                self.assertEqual(utils.dt_to_ts(start) % step.total_seconds(), 0)
+            for (newer_start, _), (older_start, older_end) in zip(windows, windows[1:]):
+                self.assertEqual(newer_start - older_start, step)
+                self.assertEqual(older_end - older_start, week)
+                # neighbours share `overlap` hourly points
+                self.assertEqual(older_end - newer_start, (overlap - 1) * HOUR)
+            # the newest is cut short at the last whole hour
+            self.assertEqual(windows[0][1], dt.datetime(2017, 1, 29, 17))
+            self.assertLessEqual(windows[-1][0], self.start_dt)
+            self.assertGreater(windows[-1][1], self.start_dt)
+        self.assertEqual(
+            [w for w, _ in self.downloader._windows(self.start_dt, self.end_dt)],
+            [dt.datetime(2017, 1, 26), dt.datetime(2017, 1, 19), dt.datetime(2017, 1, 12),
+             dt.datetime(2017, 1, 5), dt.datetime(2016, 12, 29)]
+        )
+
+    def test_second_run_is_skipped(self):
+        self.assertEqual(len(self.downloader.plan(self.start_dt, self.end_dt)), 5 * 4)
+        self.assertEqual(self.downloader.run(self.start_dt, self.end_dt, tags=False), 5)
+        self.assertEqual(self.pool.client.requests, 5)
+        self.assertEqual(
+            set(TrendJob.objects.values_list('status', flat=True)),
+            {TrendJob.DONE}
+        )
+        self.assertTrue(StitchedInterest.objects.exists())
+
+        downloader = IOTHourlyFromConfigDownloader('coins', client_pool=self.pool)
+        self.assertEqual(downloader.run(self.start_dt, self.end_dt, tags=False), 0)
+        self.assertEqual(self.pool.client.requests, 5)
+        # tagged batches were never downloaded
+        self.assertEqual(len(downloader.plan(self.start_dt, self.end_dt)), 5 * 3)
+
+
+class StitchTest(SimpleTestCase):
+
+    def test_log_ratios(self):
+        nan = np.nan
+        matrix = np.array([
+            [10, nan, nan, nan],
+            [20, 40, nan, nan],
+            [30, 60, nan, 5],
+            [nan, 15, nan, 0],
+        ])
+        np.testing.assert_allclose(
+            StitchedInterest._log_ratios(matrix),
+            # columns 2 and 3 overlap nothing, the last overlap is all zeros
+            [np.log(0.5), nan, nan]
+        )
+        matrix[3, 2] = 0
+        self.assertTrue(np.isnan(StitchedInterest._log_ratios(matrix)[-1]))
+
+    def test_chain(self):
+        log_ratios = np.array([0.5, np.nan, 1.0])
+        unknown = np.full(4, np.nan)
+        # each run of linked windows ends at scale 1
+        np.testing.assert_allclose(
+            StitchedInterest._chain(log_ratios, unknown),
+            [-0.5, 0, -1, 0]
+        )
+        # or is pinned to its newest stored window
+        np.testing.assert_allclose(
+            StitchedInterest._chain(log_ratios, np.array([2.0, np.nan, 3.0, np.nan])),
+            [2.0, 2.5, 3.0, 4.0]
+        )
+
+
+class StitchedInterestTest(TestCase):
+
+    search_terms = 'bitcoin, ethereum'
+    hours = 10
+    step = 7  # windows overlap by 3 hours
+
+    def setUp(self):
+        # the true series, and the rescaled window scores Trends would return
+        self.truth = 2 * np.random.RandomState(0).randint(1, 13, 40)
+
+    def add_window(self, i, scale, term='bitcoin'):
+        start = i * self.step
+        start_dt = DT + start * HOUR
+        InterestOverTime.objects.bulk_create([
+            InterestOverTime(
+                term=term,
+                dt=DT + h * HOUR,
+                start_dt=start_dt,
+                end_dt=start_dt + (self.hours - 1) * HOUR,
+                search_terms=self.search_terms,
+                score=int(self.truth[h] * scale)
+            )
+            for h in range(start, start + self.hours)
+        ])
+
+    def stitched(self):
+        rows = StitchedInterest.objects.filter(term='bitcoin').order_by('dt')
+        return list(rows.values_list('dt', flat=True)), \
+            np.array(rows.values_list('score', flat=True))
+
+    def assert_proportional(self, scores, truth):
+        ratio = scores / truth
+        np.testing.assert_allclose(ratio, ratio[0])
+
+    def test_matches_series_up_to_a_constant(self):
+        for i, scale in enumerate([1, 2, 0.5, 4]):
+            self.add_window(i, scale)
+        self.add_window(0, 3, term='ethereum')
+        # each window owns its hours until the next one starts
+        self.assertEqual(StitchedInterest.refresh(terms=['bitcoin']), 31)
+        dts, scores = self.stitched()
+        self.assertEqual(dts, [DT + h * HOUR for h in range(31)])
+        self.assert_proportional(scores, self.truth[:31])
+        # the newest window keeps its raw scale
+        np.testing.assert_allclose(scores[-10:], 4 * self.truth[21:31])
+        self.assertEqual(StitchedInterest.refresh(terms=['bitcoin']), 0)
+
+        # a new window only adds its own hours, without rescaling the others
+        old = dict(StitchedInterest.objects.values_list('dt', 'score'))
+        self.add_window(4, 1)
+        self.assertEqual(StitchedInterest.refresh(terms=['bitcoin']), 10)
+        dts, scores = self.stitched()
+        self.assertEqual(dts, [DT + h * HOUR for h in range(38)])
+        self.assert_proportional(scores, self.truth[:38])
+        self.assertEqual(
+            dict(StitchedInterest.objects.filter(dt__lt=DT + 28 * HOUR)
+                 .values_list('dt', 'score')),
+            {k: v for k, v in old.items() if k < DT + 28 * HOUR}
+        )